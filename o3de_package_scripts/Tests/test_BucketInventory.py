@@ -0,0 +1,80 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from bucket_inventory import BucketInventory
+from find_package_on_server import FindPackageUtils
+import tempfile
+import os
+
+class StubS3Session():
+    ''' Just enough of a boto3 session to list a bucket, 1000 keys per page like S3, counting the requests '''
+    profile_name = None
+
+    def __init__(self, buckets):
+        self.buckets = buckets # map of bucket name -> keys
+        self.list_requests = []
+
+    def client(self, service_name):
+        return self
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix = ''):
+        keys = sorted(key for key in self.buckets[Bucket] if key.startswith(Prefix))
+        for page_start in range(0, max(1, len(keys)), 1000):
+            self.list_requests.append((Bucket, Prefix))
+            page_keys = keys[page_start:page_start + 1000]
+            yield {'Contents': [{'Key': key} for key in page_keys]} if page_keys else {}
+
+def MakeBucket(package_names):
+    return [f'{package_name}{extension}' for package_name in package_names for extension in ['.tar.xz', '.tar.xz.SHA256SUMS', '.tar.xz.content.SHA256SUMS', '.PackageInfo.json']]
+
+def test_BucketInventory_lists_the_bucket_once():
+    package_names = [f'package{index}-1.0-rev1-linux' for index in range(600)]
+    # a package whose upload was interrupted before its PackageInfo.json does not count
+    session = StubS3Session({'packages': MakeBucket(package_names) + ['partial-1.0-rev1-linux.tar.xz'], 'empty': []})
+    inventory = BucketInventory(session, 'packages')
+    for package_name in package_names + ['partial-1.0-rev1-linux']:
+        assert inventory.Contains(package_name) == (package_name != 'partial-1.0-rev1-linux')
+    assert inventory.GetPackageNames() == set(package_names)
+    assert len(session.list_requests) == 3 # 2401 keys, 1000 per page
+
+    assert BucketInventory(session, 'empty').GetPackageNames() == set()
+
+def test_BucketInventory_snapshot_is_reused_until_it_is_too_old():
+    session = StubS3Session({'packages': MakeBucket(['old-1.0-rev1-linux'])})
+    with tempfile.TemporaryDirectory() as output_folder:
+        snapshot_path = BucketInventory.GetSnapshotPath(output_folder, 'packages')
+        inventory = BucketInventory(session, 'packages', snapshot_path, max_age=3600)
+        assert inventory.Contains('old-1.0-rev1-linux')
+        inventory.Add('new-1.0-rev1-linux')
+        assert os.path.exists(snapshot_path)
+
+        # a later run uses the snapshot, including the package it uploaded, without asking S3
+        session.list_requests.clear()
+        assert BucketInventory(session, 'packages', snapshot_path, max_age=3600).GetPackageNames() == {'old-1.0-rev1-linux', 'new-1.0-rev1-linux'}
+        assert session.list_requests == []
+
+        # but not once it is too old, or when snapshots are not wanted
+        assert BucketInventory(session, 'packages', snapshot_path, max_age=0).GetPackageNames() == {'old-1.0-rev1-linux'}
+        os.utime(snapshot_path) # the age comes from inside the snapshot, not the file
+        assert BucketInventory(session, 'packages', snapshot_path, max_age=1e-9).GetPackageNames() == {'old-1.0-rev1-linux'}
+        assert len(session.list_requests) == 2
+
+def test_FindPackageOnServer_shares_one_inventory_per_bucket(monkeypatch):
+    session = StubS3Session({'packages': MakeBucket(['found-1.0-rev1-linux'])})
+    monkeypatch.setattr(FindPackageUtils, 'bucket_inventories', {})
+    FindPackageUtils.GetBucketInventory('packages', None, session)
+    for _ in range(5):
+        assert FindPackageUtils.FindPackageOnServer('found-1.0-rev1-linux', 's3://packages', None) == 's3://packages/found-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+        assert FindPackageUtils.FindPackageOnServer('missing-1.0-rev1-linux', 's3://packages/some/prefix', None) == ''
+    assert FindPackageUtils.IsPackageAlreadyInS3Bucket('found-1.0-rev1-linux', session, 'packages')
+    assert len(session.list_requests) == 1
+    # asking S3 directly, for when the inventory may be out of date
+    assert FindPackageUtils.IsPackageInS3BucketNow('found-1.0-rev1-linux', session, 'packages')
+    assert session.list_requests[-1] == ('packages', 'found-1.0-rev1-linux.PackageInfo.json')
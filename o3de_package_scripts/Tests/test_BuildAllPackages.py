@@ -0,0 +1,96 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from find_package_on_server import FindPackageUtils
+import build_all_packages
+import tempfile
+import json
+import os
+import pytest
+
+build_script_template = '''
+import os, sys
+package_name = sys.argv[1]
+if package_name == 'broken-1.0-rev1-linux':
+    sys.exit(1)
+if package_name == 'app-1.0-rev1-linux' and not os.path.exists(os.path.join('..', 'lib', 'package', 'PackageInfo.json')):
+    sys.exit(2) # lib must have been built first
+os.makedirs('package', exist_ok=True)
+with open(os.path.join('package', 'PackageInfo.json'), 'w') as package_info:
+    package_info.write('{"PackageName": "%s", "URL": "https://o3de.org", "License": "MIT", "LicenseFile": "LICENSE.txt"}' % package_name)
+with open(os.path.join('package', 'LICENSE.txt'), 'w') as license_file:
+    license_file.write('built with %s jobs' % os.environ['O3DE_BUILD_JOBS'])
+'''
+
+@pytest.mark.parametrize("packJobs", [0, 2])
+def test_BuildPackages_runs_build_scripts_in_dependency_order(packJobs, monkeypatch):
+    monkeypatch.setattr(FindPackageUtils, 'FindPackageOnServer', lambda *args: None)
+    with tempfile.TemporaryDirectory() as search_path:
+        package_list = {'build_from_source': {}, 'build_from_folder': {},
+                        'build_dependencies': {'app-1.0-rev1-linux': ['lib-1.0-rev1-linux'], 'needs-broken-1.0-rev1-linux': ['broken-1.0-rev1-linux']}}
+        for folder_name in ['app', 'lib', 'broken', 'needs-broken']:
+            package_name = f'{folder_name}-1.0-rev1-linux'
+            os.makedirs(os.path.join(search_path, folder_name))
+            with open(os.path.join(search_path, folder_name, 'build_package_image.py'), 'w') as build_script:
+                build_script.write(build_script_template)
+            package_list['build_from_source'][package_name] = f'{folder_name}/build_package_image.py {package_name}'
+            package_list['build_from_folder'][package_name] = f'{folder_name}/package'
+        # and one package that has no build script
+        os.makedirs(os.path.join(search_path, 'prebuilt', 'package'))
+        with open(os.path.join(search_path, 'prebuilt', 'package', 'PackageInfo.json'), 'w') as package_info:
+            package_info.write('{"PackageName": "prebuilt-1.0-rev1-linux", "URL": "https://o3de.org", "License": "MIT", "LicenseFile": "PackageInfo.json"}')
+        package_list['build_from_folder']['prebuilt-1.0-rev1-linux'] = 'prebuilt/package'
+        with open(os.path.join(search_path, f'package_build_list_host_{CommonUtils.GetPALPlatformName()}.json'), 'w') as package_list_file:
+            json.dump(package_list, package_list_file)
+
+        output_folder = os.path.join(search_path, 'packages')
+        assert build_all_packages.BuildPackages(output_folder, search_path, [], None, compression='fast', build_jobs=2, pack_jobs=packJobs) == 1
+        assert CommonUtils.FindPackagesInFolder(output_folder) == ['app-1.0-rev1-linux', 'lib-1.0-rev1-linux', 'prebuilt-1.0-rev1-linux']
+        assert os.path.exists(os.path.join(output_folder, build_all_packages.build_log_folder_name, 'app-1.0-rev1-linux.log'))
+        with open(os.path.join(search_path, 'lib', 'package', 'LICENSE.txt')) as license_file:
+            assert license_file.read() == f'built with {max(1, (os.cpu_count() or 1) // 2)} jobs'
+        with open(os.path.join(output_folder, f'{build_all_packages.metrics_report_name}.json')) as metrics_file:
+            phases = json.load(metrics_file)['packages']['app-1.0-rev1-linux']
+        assert {'lookup', 'build', 'enumerate', 'compress', 'archive_hash', 'validate', 'move'} <= set(phases.keys())
+        assert os.path.exists(os.path.join(output_folder, f'{build_all_packages.metrics_report_name}.prom'))
+
+def test_BuildPackages_looks_for_each_package_on_the_servers_once(monkeypatch):
+    lookups = []
+    def FakeFindPackageOnServer(package_name, server_urls, aws_profile_name):
+        lookups.append(package_name)
+        return f'https://packages.o3de.org/{package_name}.tar.xz.SHA256SUMS'
+    monkeypatch.setattr(FindPackageUtils, 'FindPackageOnServer', FakeFindPackageOnServer)
+    with tempfile.TemporaryDirectory() as search_path:
+        package_list = {'build_from_source': {'lib-1.0-rev1-linux': 'lib/missing_script.py'},
+                        'build_from_folder': {'lib-1.0-rev1-linux': 'lib/package', 'prebuilt-1.0-rev1-linux': 'prebuilt/package'}}
+        with open(os.path.join(search_path, f'package_build_list_host_{CommonUtils.GetPALPlatformName()}.json'), 'w') as package_list_file:
+            json.dump(package_list, package_list_file)
+
+        output_folder = os.path.join(search_path, 'packages')
+        # everything is already uploaded, so nothing is built or packed, not even the missing build script.
+        assert build_all_packages.BuildPackages(output_folder, search_path, 'https://packages.o3de.org', None, lookup_jobs=4) == 0
+        assert sorted(lookups) == ['lib-1.0-rev1-linux', 'prebuilt-1.0-rev1-linux']
+
+def test_BuildPackages_counts_a_pack_that_raised_as_failed(monkeypatch, capsys):
+    monkeypatch.setattr(FindPackageUtils, 'FindPackageOnServer', lambda *args: None)
+    def FailingGetImageSize(package_abspath):
+        raise OSError(f'Cannot walk {package_abspath}')
+    def FailingPackFolderPackage(package_name, package_abspath, pack_function):
+        raise RuntimeError(f'Cannot pack {package_name}')
+    monkeypatch.setattr(build_all_packages, 'GetImageSize', FailingGetImageSize)
+    monkeypatch.setattr(build_all_packages, '_PackFolderPackage', FailingPackFolderPackage)
+    with tempfile.TemporaryDirectory() as search_path:
+        os.makedirs(os.path.join(search_path, 'prebuilt', 'package'))
+        package_list = {'build_from_source': {}, 'build_from_folder': {'prebuilt-1.0-rev1-linux': 'prebuilt/package'}}
+        with open(os.path.join(search_path, f'package_build_list_host_{CommonUtils.GetPALPlatformName()}.json'), 'w') as package_list_file:
+            json.dump(package_list, package_list_file)
+
+        output_folder = os.path.join(search_path, 'packages')
+        assert build_all_packages.BuildPackages(output_folder, search_path, [], None, pack_jobs=2, memory_budget=512) == 1
+        assert '[FAILED] - prebuilt-1.0-rev1-linux' in capsys.readouterr().out
+        assert os.path.exists(os.path.join(output_folder, f'{build_all_packages.metrics_report_name}.json'))
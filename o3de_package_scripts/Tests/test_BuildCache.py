@@ -0,0 +1,55 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from build_cache import BuildCache
+import tempfile
+import os
+
+def WriteFile(file_path, contents):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as written_file:
+        written_file.write(contents)
+
+def test_BuildCache_only_skips_builds_with_the_same_inputs_and_an_intact_image():
+    with tempfile.TemporaryDirectory() as temp_folder:
+        build_script_path = os.path.join(temp_folder, 'build_package_image.py')
+        image_folder = os.path.join(temp_folder, 'package')
+        dependency_folder = os.path.join(temp_folder, 'dependency', 'package')
+        WriteFile(build_script_path, 'print("building")')
+        WriteFile(os.path.join(image_folder, 'PackageInfo.json'), '{}')
+        WriteFile(os.path.join(dependency_folder, 'lib.a'), 'v1')
+        build_script_cmd = f'{build_script_path} --platform linux'
+
+        build_cache = BuildCache(BuildCache.GetCacheFilePath(temp_folder))
+        build_key = BuildCache.ComputeBuildKey(build_script_cmd, [dependency_folder])
+        assert not build_cache.IsUpToDate('test-1.0-rev1-linux', build_key, image_folder)
+        build_cache.Record('test-1.0-rev1-linux', build_key, image_folder)
+        assert build_cache.IsUpToDate('test-1.0-rev1-linux', build_key, image_folder)
+
+        # the record survives, in a new process
+        build_cache = BuildCache(BuildCache.GetCacheFilePath(temp_folder))
+        assert build_cache.IsUpToDate('test-1.0-rev1-linux', BuildCache.ComputeBuildKey(build_script_cmd, [dependency_folder]), image_folder)
+        assert not build_cache.IsUpToDate('other-1.0-rev1-linux', build_key, image_folder)
+
+        # anything that goes into the build makes it run again
+        assert BuildCache.ComputeBuildKey(f'{build_script_path} --platform mac', [dependency_folder]) != build_key
+        assert BuildCache.ComputeBuildKey(build_script_cmd) != build_key
+        WriteFile(os.path.join(dependency_folder, 'lib.a'), 'v2')
+        assert BuildCache.ComputeBuildKey(build_script_cmd, [dependency_folder]) != build_key
+        WriteFile(os.path.join(dependency_folder, 'lib.a'), 'v1')
+        WriteFile(build_script_path, 'print("building differently")')
+        assert BuildCache.ComputeBuildKey(build_script_cmd, [dependency_folder]) != build_key
+        assert BuildCache.ComputeBuildKey(os.path.join(temp_folder, 'missing.py')) is None
+
+        # and so does a package image that changed, or is gone, since it was built
+        WriteFile(os.path.join(image_folder, 'extra.txt'), 'left over')
+        assert not build_cache.IsUpToDate('test-1.0-rev1-linux', build_key, image_folder)
+        os.remove(os.path.join(image_folder, 'extra.txt'))
+        assert build_cache.IsUpToDate('test-1.0-rev1-linux', build_key, image_folder)
+        os.remove(os.path.join(image_folder, 'PackageInfo.json'))
+        os.rmdir(image_folder)
+        assert not build_cache.IsUpToDate('test-1.0-rev1-linux', build_key, image_folder)
@@ -0,0 +1,58 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from build_metrics import BuildMetrics
+import concurrent.futures
+import tempfile
+import json
+import os
+
+def test_BuildMetrics_totals_phases_per_package():
+    metrics = BuildMetrics()
+    with metrics.Phase('slow-1.0-rev1-linux', 'compress') as phase:
+        phase.byte_count = 1000
+    metrics.Record('slow-1.0-rev1-linux', 'compress', 2.0, 500)
+    metrics.Record('slow-1.0-rev1-linux', 'build', 10.0)
+    metrics.Record('fast-1.0-rev1-linux', 'compress', 1.0, 100)
+
+    report = metrics.GetReport()
+    assert report['packages']['slow-1.0-rev1-linux']['compress']['bytes'] == 1500
+    assert report['packages']['slow-1.0-rev1-linux']['compress']['count'] == 2
+    assert list(report['phases'].keys()) == ['build', 'compress'] # in the order phases happen, leaving out the ones that did not
+    assert report['phases']['compress']['bytes'] == 1600
+    summary = metrics.GetSummary(top=1)
+    assert 'slow-1.0-rev1-linux 12.0s' in summary and 'build 10.0s' in summary and 'fast-1.0-rev1-linux' not in summary
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        metrics.WriteJSONReport(os.path.join(temp_folder, 'build_metrics.json'), 12.5)
+        with open(os.path.join(temp_folder, 'build_metrics.json')) as report_file:
+            assert json.load(report_file)['seconds'] == 12.5
+        metrics.WritePrometheusReport(os.path.join(temp_folder, 'build_metrics.prom'), 12.5)
+        with open(os.path.join(temp_folder, 'build_metrics.prom')) as report_file:
+            prometheus_lines = report_file.read().splitlines()
+        assert 'o3de_package_phase_bytes{package="fast-1.0-rev1-linux",phase="compress"} 100' in prometheus_lines
+        assert 'o3de_package_run_seconds 12.500000' in prometheus_lines
+        assert sorted(os.listdir(temp_folder)) == ['build_metrics.json', 'build_metrics.prom'] # no temporary files left behind
+
+def test_BuildMetrics_writes_every_event_from_every_thread():
+    metrics = BuildMetrics()
+    metrics.Emit('dropped', package='nothing') # no event log yet
+    with tempfile.TemporaryDirectory() as temp_folder:
+        events_path = os.path.join(temp_folder, 'events.jsonl')
+        metrics.EnableEventLog(events_path)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            for index in range(200):
+                executor.submit(metrics.Emit, 'lookup_hit', package=f'package-{index}')
+        metrics.Record('package-0', 'upload', 0.5, 42)
+        metrics.Close()
+
+        with open(events_path) as events_file:
+            events = [json.loads(line) for line in events_file]
+        assert len(events) == 201
+        assert sorted(event['package'] for event in events if event['event'] == 'lookup_hit') == sorted(f'package-{index}' for index in range(200))
+        assert events[-1]['event'] == 'phase' and events[-1]['bytes'] == 42 and events[-1]['phase'] == 'upload'
+        assert all('time' in event for event in events)
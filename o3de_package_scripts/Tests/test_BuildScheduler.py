@@ -0,0 +1,76 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from build_scheduler import DependencyScheduler, MemoryBudget
+import threading
+import functools
+import time
+
+def test_DependencyScheduler_runs_dependencies_first():
+    finished_order = []
+    lock = threading.Lock()
+    def Task(name):
+        def Run():
+            time.sleep(0.01)
+            with lock:
+                finished_order.append(name)
+            return True
+        return Run
+    tasks = {name: Task(name) for name in ['app', 'lib', 'base', 'other']}
+    dependencies = {'app': ['lib', 'not-a-task'], 'lib': ['base']}
+    results = DependencyScheduler(4).Run(tasks, dependencies)
+    assert all(status == DependencyScheduler.succeeded for status in results.values())
+    assert finished_order.index('base') < finished_order.index('lib') < finished_order.index('app')
+
+def test_DependencyScheduler_failures_and_cycles_stop_dependents():
+    tasks = {'broken': lambda: False, 'raises': lambda: 1 / 0, 'needs_broken': lambda: True, 'needs_needs_broken': lambda: True,
+             'cycle_a': lambda: True, 'cycle_b': lambda: True, 'fine': lambda: True, 'needs_missing': lambda: True}
+    dependencies = {'needs_broken': ['broken'], 'needs_needs_broken': ['needs_broken'], 'cycle_a': ['cycle_b'], 'cycle_b': ['cycle_a'],
+                    'needs_missing': ['missing']}
+    results = DependencyScheduler(2).Run(tasks, dependencies, already_failed={'missing'})
+    assert results == {'broken': DependencyScheduler.failed, 'raises': DependencyScheduler.failed,
+                       'needs_broken': DependencyScheduler.dependency_failed, 'needs_needs_broken': DependencyScheduler.dependency_failed,
+                       'cycle_a': DependencyScheduler.cyclic, 'cycle_b': DependencyScheduler.cyclic, 'fine': DependencyScheduler.succeeded,
+                       'needs_missing': DependencyScheduler.dependency_failed}
+
+def test_DependencyScheduler_runs_independent_tasks_concurrently():
+    running = []
+    peak_running = []
+    lock = threading.Lock()
+    def Run():
+        with lock:
+            running.append(1)
+            peak_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return True
+    results = DependencyScheduler(3).Run({f'task{index}': Run for index in range(6)}, {})
+    assert len(results) == 6
+    assert max(peak_running) == 3
+
+def test_MemoryBudget_admits_jobs_only_while_they_fit():
+    memory_budget = MemoryBudget(100)
+    reserved = []
+    peak_reserved = []
+    lock = threading.Lock()
+    def Run(byte_count):
+        with memory_budget.Reserve(byte_count):
+            with lock:
+                reserved.append(byte_count)
+                peak_reserved.append(sum(reserved))
+            time.sleep(0.02)
+            with lock:
+                reserved.remove(byte_count)
+        return True
+    # the 150 job is larger than the whole budget, and still runs, alone.
+    job_sizes = [60, 30, 50, 150, 10, 40]
+    results = DependencyScheduler(len(job_sizes)).Run({f'job{index}': functools.partial(Run, byte_count) for index, byte_count in enumerate(job_sizes)}, {})
+    assert all(status == DependencyScheduler.succeeded for status in results.values())
+    assert 150 in peak_reserved
+    assert max(peak for peak in peak_reserved if peak != 150) <= 100
+    assert memory_budget.peak_reserved_bytes == 150 and memory_budget.reserved_bytes == 0
@@ -0,0 +1,201 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from find_package_on_server import FindPackageUtils, ReadPackageNames, ServerLatencyStats
+from http_pool import HTTPConnectionPool
+import collections
+import http.server
+import threading
+import time
+import io
+import json
+import os
+import tempfile
+import pytest
+
+class FakePackageServer(http.server.ThreadingHTTPServer):
+    ''' Serves the .content.SHA256SUMS of the packages it is given, and counts what it is asked '''
+    def __init__(self, package_names, supports_head = True):
+        self.files = {f'/{package_name}.tar.xz.content.SHA256SUMS' : b'0' * 64 + b' *PackageInfo.json\n' for package_name in package_names}
+        self.files['/moved.tar.xz.content.SHA256SUMS'] = None # redirects to the first package
+        self.supports_head = supports_head
+        self.requests = []
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), FakePackageServerHandler)
+
+class FakePackageServerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def setup(self):
+        self.server.connections += 1
+        super().setup()
+
+    def Respond(self, send_body):
+        self.server.requests.append(self.command)
+        if self.command == 'HEAD' and not self.server.supports_head:
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path in self.server.files and self.server.files[self.path] is None:
+            self.send_response(302)
+            self.send_header('Location', next(path for path, contents in self.server.files.items() if contents))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        contents = self.server.files.get(self.path)
+        self.send_response(200 if contents else 404)
+        self.send_header('Content-Length', str(len(contents or b'')))
+        self.end_headers()
+        if send_body and contents:
+            self.wfile.write(contents)
+
+    def do_HEAD(self):
+        self.Respond(send_body=False)
+
+    def do_GET(self):
+        self.Respond(send_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def fakePackageServer(request):
+    server = FakePackageServer(['found-1.0-rev1-linux'], supports_head=getattr(request, 'param', True))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_HTTPConnectionPool_reuses_connections_and_asks_with_head(fakePackageServer):
+    url = f'http://127.0.0.1:{fakePackageServer.server_port}'
+    http_pool = HTTPConnectionPool(timeout=5)
+    for _ in range(10):
+        assert http_pool.Exists(f'{url}/found-1.0-rev1-linux.tar.xz.content.SHA256SUMS')
+        assert not http_pool.Exists(f'{url}/missing-1.0-rev1-linux.tar.xz.content.SHA256SUMS')
+    assert http_pool.Exists(f'{url}/moved.tar.xz.content.SHA256SUMS')
+    assert set(fakePackageServer.requests) == {'HEAD'}
+    assert fakePackageServer.connections == 1 and http_pool.connections_opened == 1
+    http_pool.Close()
+
+@pytest.mark.parametrize("fakePackageServer", [False], indirect=True)
+def test_HTTPConnectionPool_falls_back_to_get(fakePackageServer):
+    url = f'http://127.0.0.1:{fakePackageServer.server_port}'
+    http_pool = HTTPConnectionPool(timeout=5)
+    assert http_pool.Exists(f'{url}/found-1.0-rev1-linux.tar.xz.content.SHA256SUMS')
+    assert not http_pool.Exists(f'{url}/missing-1.0-rev1-linux.tar.xz.content.SHA256SUMS')
+    assert fakePackageServer.requests == ['HEAD', 'GET', 'HEAD', 'GET']
+    http_pool.Close()
+
+def test_FindPackageOnServer_first_server_with_the_package_wins(fakePackageServer, monkeypatch):
+    monkeypatch.setattr(FindPackageUtils, 'http_pool', HTTPConnectionPool(timeout=5))
+    url = f'http://127.0.0.1:{fakePackageServer.server_port}'
+    # nothing listens on port 9 (discard) of this host, that server just counts as not having anything
+    server_urls = f'http://127.0.0.1:9;{url};{url}/mirror'
+    assert FindPackageUtils.FindPackageOnServer('found-1.0-rev1-linux', server_urls, None) == f'{url}/found-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert FindPackageUtils.FindPackageOnServer('missing-1.0-rev1-linux', server_urls, None) == ''
+
+def test_FindPackagesOnServers_keeps_server_order_and_caps_each_host(monkeypatch):
+    running = collections.Counter()
+    peak_running = collections.Counter()
+    lock = threading.Lock()
+    def FakeIsPackageOnHTTPServer(package_metadata_url):
+        host = package_metadata_url.split('/')[2]
+        with lock:
+            running[host] += 1
+            peak_running[host] = max(peak_running[host], running[host])
+        time.sleep(0.01)
+        with lock:
+            running[host] -= 1
+        # the mirror has everything, the primary only the even packages
+        return host == 'mirror' or int(package_metadata_url.split('package')[1].split('-')[0]) % 2 == 0
+    monkeypatch.setattr(FindPackageUtils, 'IsPackageOnHTTPServer', FakeIsPackageOnHTTPServer)
+    monkeypatch.setattr(FindPackageUtils, 'per_host_lookup_jobs', 2)
+    monkeypatch.setattr(FindPackageUtils, 'per_host_semaphores', collections.defaultdict(lambda: threading.BoundedSemaphore(FindPackageUtils.per_host_lookup_jobs)))
+
+    package_names = [f'package{index}-1.0-rev1-linux' for index in range(20)]
+    found_on_server = FindPackageUtils.FindPackagesOnServers(package_names + package_names[:3], 'https://primary;https://mirror', None, jobs=8)
+    assert list(found_on_server.keys()) == package_names
+    for index, package_name in enumerate(package_names):
+        assert found_on_server[package_name] == f"https://{'primary' if index % 2 == 0 else 'mirror'}/{package_name}.tar.xz.content.SHA256SUMS"
+    assert peak_running['primary'] == 2 and peak_running['mirror'] <= 2
+
+def test_ReadPackageNames_skips_blank_lines_and_comments():
+    package_list = io.StringIO('# packages to check\nfirst-1.0-rev1-linux\n\n  second-1.0-rev1-linux  # trailing comment\n')
+    assert ReadPackageNames(package_list) == ['first-1.0-rev1-linux', 'second-1.0-rev1-linux']
+
+def test_FindPackageOnServer_hedged_waits_for_higher_priority_servers_and_skips_slow_ones(monkeypatch):
+    answer_seconds = {'primary': 0.2, 'mirror': 0.0, 'dead': 0.0}
+    asked = []
+    def FakeIsPackageOnHTTPServer(package_metadata_url):
+        host = package_metadata_url.split('/')[2]
+        asked.append(host)
+        time.sleep(answer_seconds[host])
+        if host == 'dead':
+            FindPackageUtils.server_stats.RecordFailure(host)
+            return False
+        return host == 'mirror' or 'common' in package_metadata_url
+    monkeypatch.setattr(FindPackageUtils, 'IsPackageOnHTTPServer', FakeIsPackageOnHTTPServer)
+    monkeypatch.setattr(FindPackageUtils, 'lookup_mode', 'hedged')
+    monkeypatch.setattr(FindPackageUtils, 'hedge_delay', 0.05)
+    monkeypatch.setattr(FindPackageUtils, 'server_stats', ServerLatencyStats(slow_seconds=0.1))
+
+    # the mirror answers first, but the primary is asked first and has it, so it wins
+    assert FindPackageUtils.FindPackageOnServer('common-1.0-rev1-linux', 'https://primary;https://mirror', None) == 'https://primary/common-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert asked == ['primary', 'mirror']
+    # the primary has been slow, so now the mirror is asked first and wins without asking the primary at all
+    asked.clear()
+    assert FindPackageUtils.FindPackageOnServer('common-1.0-rev1-linux', 'https://primary;https://mirror', None) == 'https://mirror/common-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert asked == ['mirror']
+
+    # a server that fails is asked last, but is still asked when no one else has the package
+    monkeypatch.setattr(FindPackageUtils, 'server_stats', ServerLatencyStats(slow_seconds=0.1))
+    answer_seconds['primary'] = 0.0
+    asked.clear()
+    assert FindPackageUtils.FindPackageOnServer('other-1.0-rev1-linux', 'https://dead;https://primary', None) == ''
+    assert asked == ['dead', 'primary']
+    asked.clear()
+    assert FindPackageUtils.FindPackageOnServer('common-1.0-rev1-linux', 'https://dead;https://primary', None) == 'https://primary/common-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert asked == ['primary']
+    assert FindPackageUtils.server_stats.IsSlow('dead') and not FindPackageUtils.server_stats.IsSlow('primary')
+    assert 'dead 1 in' in FindPackageUtils.server_stats.GetSummary()
+
+def test_FindPackageOnServer_sequential_keeps_the_order_of_slow_servers(monkeypatch):
+    asked = []
+    def FakeIsPackageOnHTTPServer(package_metadata_url):
+        host = package_metadata_url.split('/')[2]
+        asked.append(host)
+        if host == 'flaky' and 'first' in package_metadata_url:
+            FindPackageUtils.server_stats.RecordFailure(host)
+            return False
+        return True
+    monkeypatch.setattr(FindPackageUtils, 'IsPackageOnHTTPServer', FakeIsPackageOnHTTPServer)
+    monkeypatch.setattr(FindPackageUtils, 'lookup_mode', 'sequential')
+    monkeypatch.setattr(FindPackageUtils, 'server_stats', ServerLatencyStats(slow_seconds=2))
+
+    assert FindPackageUtils.FindPackageOnServer('first-1.0-rev1-linux', 'https://flaky;https://mirror', None) == 'https://mirror/first-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert FindPackageUtils.server_stats.IsSlow('flaky')
+    # the first server in the list still wins, however slow it has been
+    assert FindPackageUtils.FindPackageOnServer('second-1.0-rev1-linux', 'https://flaky;https://mirror', None) == 'https://flaky/second-1.0-rev1-linux.tar.xz.content.SHA256SUMS'
+    assert asked == ['flaky', 'mirror', 'flaky']
+
+def test_FindPackagesOnServers_emits_lookup_events(monkeypatch):
+    monkeypatch.setattr(FindPackageUtils, 'IsPackageOnHTTPServer', lambda package_metadata_url: 'found' in package_metadata_url)
+    with tempfile.TemporaryDirectory() as dir:
+        events_file_path = os.path.join(dir, 'events.jsonl')
+        CommonUtils.EnableEvents(events_file_path)
+        try:
+            FindPackageUtils.FindPackagesOnServers(['found-1.0-rev1-linux', 'missing-1.0-rev1-linux'], 'https://primary', None)
+        finally:
+            CommonUtils.metrics.Close()
+        with open(events_file_path) as events_file:
+            events = [json.loads(line) for line in events_file]
+    assert {(event['event'], event.get('package')) for event in events if event['event'].startswith('lookup_')} == {
+        ('lookup_started', 'found-1.0-rev1-linux'), ('lookup_hit', 'found-1.0-rev1-linux'),
+        ('lookup_started', 'missing-1.0-rev1-linux'), ('lookup_miss', 'missing-1.0-rev1-linux')}
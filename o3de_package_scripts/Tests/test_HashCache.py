@@ -0,0 +1,100 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from hash_cache import HashCache
+import tempfile
+import os
+import hashlib
+import threading
+import atexit
+
+def WriteFileWithOldTimestamp(file_path, contents, mtime_ns):
+    with open(file_path, 'wb') as write_file:
+        write_file.write(contents)
+    os.utime(file_path, ns=(mtime_ns, mtime_ns))
+
+def test_HashCache_unchanged_file_is_not_rehashed(monkeypatch):
+    with tempfile.TemporaryDirectory() as dir:
+        hash_cache = HashCache(HashCache.GetCacheFilePath(dir))
+        monkeypatch.setattr(CommonUtils, 'hash_cache', hash_cache)
+        file_path = os.path.join(dir, 'file.txt')
+        WriteFileWithOldTimestamp(file_path, b'original', 1000000000)
+        original_hash = CommonUtils.ComputeHashOfFile(file_path)
+        assert original_hash == hashlib.sha256(b'original').hexdigest()
+
+        # overwrite it without changing size or timestamp, the cache (wrongly, but by design) still wins
+        # which proves the file was not read again.  An in-place rewrite also keeps the inode.
+        with open(file_path, 'r+b') as write_file:
+            write_file.write(b'modified')
+        os.utime(file_path, ns=(1000000000, 1000000000))
+        assert CommonUtils.ComputeHashOfFile(file_path) == original_hash
+        assert CommonUtils.ComputeHashOfFile(file_path, use_hash_cache=False) == hashlib.sha256(b'modified').hexdigest()
+
+        # a changed timestamp invalidates the entry
+        os.utime(file_path, ns=(2000000000, 2000000000))
+        assert CommonUtils.ComputeHashOfFile(file_path) == hashlib.sha256(b'modified').hexdigest()
+
+def test_HashCache_save_and_reload_prunes_stale_entries():
+    with tempfile.TemporaryDirectory() as dir:
+        cache_file_path = HashCache.GetCacheFilePath(dir)
+        kept_file = os.path.join(dir, 'kept.txt')
+        deleted_file = os.path.join(dir, 'deleted.txt')
+        WriteFileWithOldTimestamp(kept_file, b'kept', 1000000000)
+        WriteFileWithOldTimestamp(deleted_file, b'deleted', 1000000000)
+
+        hash_cache = HashCache(cache_file_path)
+        hash_cache.Store(kept_file, os.stat(kept_file), 'a' * 64)
+        hash_cache.Store(deleted_file, os.stat(deleted_file), 'b' * 64)
+        os.remove(deleted_file)
+        hash_cache.Save()
+
+        reloaded_cache = HashCache(cache_file_path)
+        assert reloaded_cache.EntryCount() == 1
+        assert reloaded_cache.Lookup(kept_file, os.stat(kept_file)) == 'a' * 64
+
+def test_HashCache_verify_evicts_wrong_entries():
+    with tempfile.TemporaryDirectory() as dir:
+        file_path = os.path.join(dir, 'file.txt')
+        WriteFileWithOldTimestamp(file_path, b'contents', 1000000000)
+        hash_cache = HashCache(HashCache.GetCacheFilePath(dir))
+        hash_cache.Store(file_path, os.stat(file_path), 'c' * 64)
+
+        assert hash_cache.Verify(10, lambda path: CommonUtils.ComputeHashOfFile(path, use_hash_cache=False)) == [file_path]
+        assert hash_cache.EntryCount() == 0
+
+def test_HashCache_caches_sharing_a_file_can_save_at_the_same_time(monkeypatch):
+    with tempfile.TemporaryDirectory() as dir:
+        cache_file_path = HashCache.GetCacheFilePath(dir)
+        file_path = os.path.join(dir, 'file.txt')
+        WriteFileWithOldTimestamp(file_path, b'contents', 1000000000)
+        hash_caches = [HashCache(cache_file_path) for _ in range(8)]
+        errors = []
+        def Save(hash_cache):
+            try:
+                for _ in range(20):
+                    hash_cache.Store(file_path, os.stat(file_path), 'a' * 64)
+                    hash_cache.Save()
+            except OSError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=Save, args=(hash_cache,)) for hash_cache in hash_caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert HashCache(cache_file_path).EntryCount() == 1
+        assert os.listdir(os.path.dirname(cache_file_path)) == [os.path.basename(cache_file_path)]
+
+        # enabling the cache again, for another folder, still only saves it once at exit
+        registered = []
+        monkeypatch.setattr(atexit, 'register', registered.append)
+        monkeypatch.setattr(CommonUtils, 'hash_cache_saved_at_exit', False)
+        monkeypatch.setattr(CommonUtils, 'hash_cache', None)
+        CommonUtils.EnableHashCache(dir)
+        CommonUtils.EnableHashCache(os.path.join(dir, 'other'))
+        assert registered == [CommonUtils.SaveHashCache]
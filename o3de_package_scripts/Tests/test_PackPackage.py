@@ -0,0 +1,191 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from pack_package import PackageUpFolder, EstimatePackMemory
+from parallel_xz import ParallelXZWriter
+from validation_stamps import ValidationStamps
+from hash_cache import HashCache
+import tempfile
+import os
+import io
+import lzma
+import pytest
+
+package_descriptor_template = '''
+{
+    "PackageName" : "testpackage-1.0-rev1-linux",
+    "URL"         : "https://o3de.org",
+    "License"     : "MIT",
+    "LicenseFile" : "LICENSE.txt"
+}
+'''
+
+def CreatePackageImage(image_folder):
+    ''' Writes a small but non-trivial package image into image_folder '''
+    with open(os.path.join(image_folder, CommonUtils.package_descriptor_name), 'w', encoding='utf-8') as pd:
+        pd.write(package_descriptor_template)
+    with open(os.path.join(image_folder, 'LICENSE.txt'), 'w', encoding='utf-8') as license_file:
+        license_file.write('Permission is hereby granted, free of charge')
+    for folder_index in range(4):
+        subfolder = os.path.join(image_folder, 'include', f'folder{folder_index}')
+        os.makedirs(subfolder)
+        for file_index in range(8):
+            with open(os.path.join(subfolder, f'header{file_index}.h'), 'wb') as header_file:
+                header_file.write(os.urandom(1024 * (file_index + 1)))
+    return 'testpackage-1.0-rev1-linux'
+
+def ReadFile(file_path):
+    with open(file_path, 'rb') as read_file:
+        return read_file.read()
+
+def test_PackageUpFolder_parallel_manifest_matches_serial():
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        content_hash_file = os.path.join(output_folder, package_name + CommonUtils.package_content_hash_extension)
+
+        assert PackageUpFolder(image_folder, output_folder, jobs=1)
+        serial_manifest = ReadFile(content_hash_file)
+
+        assert PackageUpFolder(image_folder, output_folder, jobs=8, force=True)
+        assert ReadFile(content_hash_file) == serial_manifest
+
+def test_PackageUpFolder_unchanged_image_is_not_repacked():
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        archive_file = os.path.join(output_folder, package_name + CommonUtils.package_extension)
+        assert PackageUpFolder(image_folder, output_folder)
+        assert os.path.exists(os.path.join(output_folder, package_name + CommonUtils.package_fingerprint_extension))
+
+        # mark the existing archive so that we can tell whether it was rewritten
+        os.utime(archive_file, ns=(1000000000, 1000000000))
+        assert PackageUpFolder(image_folder, output_folder)
+        assert os.stat(archive_file).st_mtime_ns == 1000000000
+
+        assert PackageUpFolder(image_folder, output_folder, force=True)
+        assert os.stat(archive_file).st_mtime_ns != 1000000000
+
+        os.utime(archive_file, ns=(1000000000, 1000000000))
+        with open(os.path.join(image_folder, 'include', 'folder0', 'header0.h'), 'ab') as header_file:
+            header_file.write(b'// changed')
+        assert PackageUpFolder(image_folder, output_folder)
+        assert os.stat(archive_file).st_mtime_ns != 1000000000
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+def test_PackageUpFolder_archive_corrupted_in_place_is_repacked(monkeypatch):
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        monkeypatch.setattr(CommonUtils, 'hash_cache', HashCache(HashCache.GetCacheFilePath(output_folder)))
+        package_name = CreatePackageImage(image_folder)
+        archive_file = os.path.join(output_folder, package_name + CommonUtils.package_extension)
+        assert PackageUpFolder(image_folder, output_folder)
+        # an old timestamp, so that the hash cache trusts the entry of the archive
+        os.utime(archive_file, ns=(1000000000, 1000000000))
+        CommonUtils.ComputeHashOfFile(archive_file)
+
+        # flip a byte without changing the size, timestamp or inode of the archive
+        archive_stat = os.stat(archive_file)
+        with open(archive_file, 'r+b') as archive:
+            archive.seek(archive_stat.st_size // 2)
+            byte = archive.read(1)
+            archive.seek(archive_stat.st_size // 2)
+            archive.write(bytes([byte[0] ^ 0xff]))
+        os.utime(archive_file, ns=(archive_stat.st_atime_ns, archive_stat.st_mtime_ns))
+
+        assert PackageUpFolder(image_folder, output_folder)
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+def test_PackageUpFolder_parallel_xz_archive_is_valid():
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        # goes through the multi-threaded writer rather than tarfile's own xz compression
+        assert PackageUpFolder(image_folder, output_folder, xz_threads=4, xz_block_size=1)
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+def test_ParallelXZWriter_output_round_trips():
+    data = os.urandom(100000) + b'compressible' * 50000
+    compressed = io.BytesIO()
+    with ParallelXZWriter(compressed, 1, 3, 64 * 1024) as xz_writer:
+        for offset in range(0, len(data), 10000):
+            xz_writer.write(data[offset:offset + 10000])
+    assert lzma.decompress(compressed.getvalue()) == data
+
+def test_PackageUpFolder_compression_profile_change_repacks():
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        archive_file = os.path.join(output_folder, package_name + CommonUtils.package_extension)
+        assert PackageUpFolder(image_folder, output_folder, compression='fast')
+        fast_archive = ReadFile(archive_file)
+        assert PackageUpFolder(image_folder, output_folder, compression='release')
+        assert ReadFile(archive_file) != fast_archive
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+@pytest.mark.parametrize("xzThreads", [1, 2])
+def test_PackageUpFolder_reproducible_archives_are_identical(xzThreads):
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        hash_file = os.path.join(output_folder, package_name + CommonUtils.package_hash_extension)
+        content_hash_file = os.path.join(output_folder, package_name + CommonUtils.package_content_hash_extension)
+
+        assert PackageUpFolder(image_folder, output_folder, xz_threads=xzThreads, reproducible=True)
+        first_archive_hash = ReadFile(hash_file)
+        first_manifest = ReadFile(content_hash_file)
+
+        # things that must not matter: timestamps and the order files were created in.
+        for root, _, filenames in os.walk(image_folder):
+            for name in filenames:
+                os.utime(os.path.join(root, name), ns=(1000000000, 1000000000))
+        with open(os.path.join(image_folder, 'LICENSE.txt'), 'rb') as license_file:
+            license_contents = license_file.read()
+        os.remove(os.path.join(image_folder, 'LICENSE.txt'))
+        with open(os.path.join(image_folder, 'LICENSE.txt'), 'wb') as license_file:
+            license_file.write(license_contents)
+
+        assert PackageUpFolder(image_folder, output_folder, xz_threads=xzThreads, reproducible=True, force=True)
+        assert ReadFile(hash_file) == first_archive_hash
+        assert ReadFile(content_hash_file) == first_manifest
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+@pytest.mark.parametrize("validation,expectFullValidation", [('quick', False), ('full', True)])
+def test_PackageUpFolder_validation_modes(validation, expectFullValidation, monkeypatch):
+    full_validations = []
+    real_fully_validate_package = CommonUtils.FullyValidatePackage
+    monkeypatch.setattr(CommonUtils, 'FullyValidatePackage', lambda *args: full_validations.append(args) or real_fully_validate_package(*args))
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        # the quick check has to understand links as well as files
+        os.symlink('header0.h', os.path.join(image_folder, 'include', 'folder0', 'symlink.h'))
+        os.link(os.path.join(image_folder, 'include', 'folder1', 'header0.h'), os.path.join(image_folder, 'include', 'folder1', 'hardlink.h'))
+        assert PackageUpFolder(image_folder, output_folder, validation=validation)
+        assert bool(full_validations) == expectFullValidation
+        assert real_fully_validate_package(output_folder, package_name)
+
+def test_FullyValidatePackage_validation_stamps(monkeypatch):
+    with tempfile.TemporaryDirectory() as image_folder, tempfile.TemporaryDirectory() as output_folder:
+        package_name = CreatePackageImage(image_folder)
+        assert PackageUpFolder(image_folder, output_folder)
+        monkeypatch.setattr(CommonUtils, 'validation_stamps', ValidationStamps(ValidationStamps.GetStampFilePath(output_folder)))
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+        # the same archive bytes are not checked again, even by a new process
+        monkeypatch.setattr(CommonUtils, 'validation_stamps', ValidationStamps(ValidationStamps.GetStampFilePath(output_folder)))
+        monkeypatch.setattr(CommonUtils, 'VerifyPackageArchive', lambda archive_path: False)
+        assert CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+        # but they are, once the validation rules change
+        monkeypatch.setattr(CommonUtils, 'validator_version', CommonUtils.validator_version + 1)
+        assert not CommonUtils.FullyValidatePackage(output_folder, package_name)
+
+def test_EstimatePackMemory_grows_with_preset_image_size_and_threads():
+    mebibyte = 1024 * 1024
+    # large images need the documented memory of their preset, about 674 MiB for xz -9
+    assert 674 * mebibyte < EstimatePackMemory(1024 * mebibyte, 'release') < 700 * mebibyte
+    assert EstimatePackMemory(1024 * mebibyte, 'fast') < EstimatePackMemory(1024 * mebibyte, 'default') < EstimatePackMemory(1024 * mebibyte, 'release')
+    # small images only touch a fraction of the dictionary
+    assert EstimatePackMemory(mebibyte, 'release') < EstimatePackMemory(8 * mebibyte, 'release') < 100 * mebibyte
+    # every extra compression thread holds a block of its own, until there are more threads than blocks
+    assert EstimatePackMemory(1024 * mebibyte, 'release', 4, 64) > 1.9 * EstimatePackMemory(1024 * mebibyte, 'release', 2, 64)
+    assert EstimatePackMemory(100 * mebibyte, 'release', 4, 64) == EstimatePackMemory(100 * mebibyte, 'release', 2, 64)
@@ -0,0 +1,57 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from spdx_licenses import SPDXLicenseIndex
+import spdx_licenses
+import urllib.request
+import tempfile
+import json
+import os
+import time
+import pytest
+
+@pytest.fixture
+def no_network(monkeypatch):
+    def FailingUrlOpen(*args, **kwargs):
+        raise OSError('no network in this test')
+    monkeypatch.setattr(urllib.request, 'urlopen', FailingUrlOpen)
+
+def WriteLicenseList(file_path, version, license_ids):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w', encoding='utf8') as license_file:
+        json.dump({'licenseListVersion': version, 'licenses': [{'licenseId': license_id} for license_id in license_ids]}, license_file)
+
+def test_SPDXLicenseIndex_bundled_snapshot_is_used_without_a_cache(no_network):
+    license_index = SPDXLicenseIndex()
+    assert license_index.IsKnownLicense('MIT')
+    assert license_index.IsKnownLicense('Apache-2.0')
+    assert not license_index.IsKnownLicense('InvalidLicense')
+    assert license_index.source_path == SPDXLicenseIndex.bundled_snapshot_path
+    assert license_index.GetVersion()
+
+def test_SPDXLicenseIndex_prefers_the_cached_list(no_network):
+    with tempfile.TemporaryDirectory() as output_folder:
+        cache_file_path = SPDXLicenseIndex.GetCacheFilePath(output_folder)
+        WriteLicenseList(cache_file_path, '99.0', ['Only-This-1.0'])
+        license_index = SPDXLicenseIndex(cache_file_path)
+        assert license_index.IsKnownLicense('Only-This-1.0')
+        assert not license_index.IsKnownLicense('MIT')
+        assert license_index.GetVersion() == '99.0'
+
+def test_SPDXLicenseIndex_stale_cache_is_still_used_offline(no_network, monkeypatch, capsys):
+    monkeypatch.setattr(spdx_licenses, 'spdx_auto_refresh', True)
+    with tempfile.TemporaryDirectory() as output_folder:
+        cache_file_path = SPDXLicenseIndex.GetCacheFilePath(output_folder)
+        WriteLicenseList(cache_file_path, '99.0', ['Only-This-1.0'])
+        old_time = time.time() - (spdx_licenses.spdx_ttl_days + 1) * 24 * 60 * 60
+        os.utime(cache_file_path, (old_time, old_time))
+
+        license_index = SPDXLicenseIndex(cache_file_path)
+        assert license_index.IsKnownLicense('Only-This-1.0')
+        output = capsys.readouterr().out
+        assert 'Could not fetch the license list' in output
+        assert 'days old' in output
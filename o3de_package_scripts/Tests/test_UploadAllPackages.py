@@ -0,0 +1,92 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from find_package_on_server import FindPackageUtils
+import upload_all_packages
+import threading
+import tempfile
+import time
+import os
+import pytest
+
+class StubS3Client():
+    ''' Just enough of a boto3 S3 client to list and upload to a bucket, counting how many uploads run at once '''
+    def __init__(self, keys, failing_keys = ()):
+        self.keys = list(keys)
+        self.failing_keys = failing_keys
+        self.running = 0
+        self.peak_running = 0
+        self.lock = threading.Lock()
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix = ''):
+        with self.lock:
+            page_keys = sorted(key for key in self.keys if key.startswith(Prefix))
+        yield {'Contents': [{'Key': key} for key in page_keys]} if page_keys else {}
+
+    def upload_file(self, file_path, bucket_name, key, ExtraArgs = None):
+        with self.lock:
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        time.sleep(0.05 if key.endswith('.tar.xz') else 0.01)
+        with self.lock:
+            self.running -= 1
+            if key in self.failing_keys:
+                raise OSError(f'Could not upload {key}')
+            self.keys.append(key)
+
+class StubS3Session():
+    profile_name = None
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+        self.clients_made = 0
+
+    def client(self, service_name, config = None):
+        self.clients_made += 1
+        return self.s3_client
+
+def MakePackages(package_folder, package_names):
+    for package_name in package_names:
+        for package_part in CommonUtils.GetPackageParts(package_name):
+            with open(os.path.join(package_folder, package_part), 'w') as part_file:
+                part_file.write(package_part)
+
+@pytest.fixture
+def stubBucketInventories(monkeypatch):
+    monkeypatch.setattr(FindPackageUtils, 'bucket_inventories', {})
+    monkeypatch.setattr(CommonUtils, 'FullyValidatePackage', lambda package_folder, package_name: not package_name.startswith('invalid'))
+
+def test_UploadPackages_uploads_at_the_same_time_and_the_marker_last(stubBucketInventories):
+    package_names = [f'package{index}-1.0-rev1-linux' for index in range(8)]
+    s3_client = StubS3Client(list(CommonUtils.GetPackageParts('uploaded-1.0-rev1-linux')))
+    session = StubS3Session(s3_client)
+    with tempfile.TemporaryDirectory() as package_folder:
+        MakePackages(package_folder, package_names + ['uploaded-1.0-rev1-linux', 'invalid-1.0-rev1-linux'])
+        upload_times = upload_all_packages.UploadPackages(None, 'packages', package_folder, upload_jobs=4, session=session)
+
+    assert sorted(upload_times.keys()) == package_names
+    assert all(seconds > 0 and package_bytes > 0 for seconds, package_bytes in upload_times.values())
+    assert s3_client.peak_running == 4
+    # one client for listing the bucket, and the one shared by every upload
+    assert session.clients_made == 2
+    for package_name in package_names:
+        package_keys = [key for key in s3_client.keys if key.startswith(package_name)]
+        assert package_keys == list(CommonUtils.GetPackageParts(package_name))
+    assert not any(key.startswith('invalid') for key in s3_client.keys)
+
+def test_UploadPackages_never_uploads_the_marker_of_a_package_that_failed(stubBucketInventories):
+    s3_client = StubS3Client([], failing_keys=['broken-1.0-rev1-linux.tar.xz'])
+    with tempfile.TemporaryDirectory() as package_folder:
+        MakePackages(package_folder, ['broken-1.0-rev1-linux', 'fine-1.0-rev1-linux'])
+        with pytest.raises(OSError):
+            upload_all_packages.UploadPackages(None, 'packages', package_folder, upload_jobs=2, session=StubS3Session(s3_client))
+    assert not any(key.startswith('broken') for key in s3_client.keys)
+    assert s3_client.keys == list(CommonUtils.GetPackageParts('fine-1.0-rev1-linux'))
@@ -9,6 +9,8 @@ from common import CommonUtils
 import tempfile
 import os
 import tarfile
+import io
+import hashlib
 import pytest
 
 def test_FullyValidatePackage_nonexistent_returns_false():
@@ -18,6 +20,16 @@ def test_commonutils_ComputeHashOfFile_nonexistent_file_errors():
     with pytest.raises(FileNotFoundError):
         CommonUtils.ComputeHashOfFile("nothing")
 
+@pytest.mark.parametrize("mmapThreshold", [0, 1])
+def test_commonutils_ComputeHashOfFile_large_file_matches_hashlib(mmapThreshold, monkeypatch):
+    monkeypatch.setattr(CommonUtils, 'hash_mmap_threshold', mmapThreshold)
+    with tempfile.TemporaryDirectory() as dir:
+        file_path = os.path.join(dir, 'largefile.bin')
+        file_contents = os.urandom(CommonUtils.hash_chunk_size * 2 + 17)
+        with open(file_path, 'wb') as large_file:
+            large_file.write(file_contents)
+        assert CommonUtils.ComputeHashOfFile(file_path) == hashlib.sha256(file_contents).hexdigest()
+
 def test_FullyValidatePackage_foldereExists_no_package_returns_false():
     with tempfile.TemporaryDirectory() as dir:
         assert not CommonUtils.FullyValidatePackage(dir, "emptypackage")
@@ -65,6 +77,83 @@ def test_FullyValidatePackage_bogus_required_parts_returns_false():
                 tf.add(element[0])
         assert not CommonUtils.FullyValidatePackage(dir, "mypackage")
 
+streamed_package_descriptor = b'''
+{
+    "PackageName" : "streamed-1.0-rev1-linux",
+    "URL"         : "https://o3de.org",
+    "License"     : "custom",
+    "LicenseFile" : "LICENSE.txt"
+}
+'''
+
+def WriteArchive(archive_path, members):
+    ''' Writes a package archive from a list of (name, contents or None for a symlink, link target, mode).
+    The SHA256SUMS member is generated from the regular files, following symlinks to files by name. '''
+    file_contents = {name: contents for name, contents, _, _ in members if contents is not None}
+    sums = ''
+    for name, contents, link_target, _ in members:
+        if contents is None:
+            target_name = os.path.normpath(os.path.join(os.path.dirname(name), link_target))
+            if any(file_name.startswith(target_name + '/') for file_name in file_contents.keys()):
+                continue # a symlink to a folder is not a file of the package
+            contents = file_contents.get(target_name, b'')
+        sums += f"{hashlib.sha256(contents).hexdigest()} *{os.path.normpath(name)}\n"
+    members = members + [(CommonUtils.package_root_hash_file_name, sums.encode('utf8'), None, 0o644)]
+    with tarfile.open(archive_path, mode='w:xz') as tf:
+        for name, contents, link_target, mode in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.mode = mode
+            if contents is None:
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = link_target
+                tf.addfile(tarinfo)
+            else:
+                tarinfo.size = len(contents)
+                tf.addfile(tarinfo, io.BytesIO(contents))
+
+@pytest.mark.parametrize("extraMember,expectedResult", [
+        (None, True), # package is good
+        (("./include/header.h", b"#pragma once", None, 0o644), True), # names may start with ./
+        (("include/link.h", None, "../LICENSE.txt", 0o777), True), # symlinks are hashed as what they point at
+        (("include/header.h", b"#pragma once", None, 0o444), False), # read-only file
+        (("include/link.h", None, "../../outside.txt", 0o777), False), # symlink leaving the package
+        (("include/link.h", None, "link.h", 0o777), False), # symlink to itself
+        ([("include/header.h", b"#pragma once", None, 0o644), ("headers", None, "include", 0o777)], True), # symlink to a folder
+    ])
+def test_commonutils_VerifyPackageArchive_streams_members(extraMember, expectedResult):
+    with tempfile.TemporaryDirectory() as dir:
+        archive_path = os.path.join(dir, 'streamed' + CommonUtils.package_extension)
+        members = [(CommonUtils.package_descriptor_name, streamed_package_descriptor, None, 0o644),
+                   ("LICENSE.txt", b"All rights reserved", None, 0o644)]
+        if extraMember:
+            members += extraMember if isinstance(extraMember, list) else [extraMember]
+        WriteArchive(archive_path, members)
+        assert CommonUtils.VerifyPackageArchive(archive_path) == expectedResult
+        assert os.listdir(dir) == [os.path.basename(archive_path)] # nothing was extracted
+
+def test_commonutils_VerifyPackageArchive_truncated_archive_returns_false():
+    with tempfile.TemporaryDirectory() as dir:
+        archive_path = os.path.join(dir, 'streamed' + CommonUtils.package_extension)
+        WriteArchive(archive_path, [(CommonUtils.package_descriptor_name, streamed_package_descriptor, None, 0o644),
+                                    ("LICENSE.txt", os.urandom(100000), None, 0o644)])
+        with open(archive_path, 'rb+') as archive_file:
+            archive_file.truncate(os.path.getsize(archive_path) // 2)
+        assert not CommonUtils.VerifyPackageArchive(archive_path)
+
+def test_commonutils_WalkPackageImage_finds_hidden_files_and_symlinks():
+    with tempfile.TemporaryDirectory() as dir:
+        os.makedirs(os.path.join(dir, 'include', '.hidden'))
+        for relpath in ['top.txt', '.dotfile', 'include/header.h', 'include/.hidden/inner.h']:
+            with open(os.path.join(dir, relpath), 'w') as f:
+                f.write(relpath)
+        os.symlink('header.h', os.path.join(dir, 'include', 'link.h'))
+        os.symlink('..', os.path.join(dir, 'include', 'parent')) # a cycle, must not be followed
+
+        walked = {relpath: (abspath, is_symlink) for relpath, abspath, _, is_symlink in CommonUtils.WalkPackageImage(dir)}
+        assert sorted(walked.keys()) == ['.dotfile', 'include/.hidden/inner.h', 'include/header.h', 'include/link.h', 'top.txt']
+        assert walked['include/link.h'] == (os.path.join(dir, 'include', 'link.h'), True)
+        assert walked['top.txt'] == (os.path.join(dir, 'top.txt'), False)
+
 @pytest.mark.parametrize("folderName,expectedResult", [
         # the tuple is (folder name, expected outcome of FullyValidatePackage)
         ("extra_content_file", False), # package contains an unexpected file
@@ -0,0 +1,80 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+from common import CommonUtils
+from pack_package import PackageUpFolder
+from validate_packages import ValidatePackages
+from validation_stamps import ValidationStamps
+import validate_packages
+import tempfile
+import os
+import time
+import multiprocessing
+import pytest
+
+package_descriptor_template = '''
+{{
+    "PackageName" : "{}",
+    "URL"         : "https://o3de.org",
+    "License"     : "MIT",
+    "LicenseFile" : "LICENSE.txt"
+}}
+'''
+
+def CreatePackages(output_folder, package_names):
+    ''' Packs a tiny package for each of package_names into output_folder '''
+    for package_name in package_names:
+        with tempfile.TemporaryDirectory() as image_folder:
+            with open(os.path.join(image_folder, CommonUtils.package_descriptor_name), 'w', encoding='utf-8') as pd:
+                pd.write(package_descriptor_template.format(package_name))
+            with open(os.path.join(image_folder, 'LICENSE.txt'), 'w', encoding='utf-8') as license_file:
+                license_file.write(f'license of {package_name}')
+            assert PackageUpFolder(image_folder, output_folder, compression='fast')
+
+def test_ValidatePackages_reports_each_package():
+    with tempfile.TemporaryDirectory() as output_folder:
+        CreatePackages(output_folder, ['good-1.0-rev1-linux', 'bad-1.0-rev1-linux'])
+        os.remove(os.path.join(output_folder, 'bad-1.0-rev1-linux' + CommonUtils.package_hash_extension))
+
+        results = ValidatePackages(output_folder, jobs=2)
+        assert list(results.keys()) == ['bad-1.0-rev1-linux', 'good-1.0-rev1-linux']
+        assert results['good-1.0-rev1-linux']['status'] == 'valid'
+        assert results['bad-1.0-rev1-linux']['status'] == 'invalid'
+        assert 'Expected package part is missing' in results['bad-1.0-rev1-linux']['output']
+
+def test_ValidatePackages_stop_on_failure_skips_the_rest():
+    with tempfile.TemporaryDirectory() as output_folder:
+        CreatePackages(output_folder, ['a-1.0-rev1-linux', 'b-1.0-rev1-linux', 'c-1.0-rev1-linux'])
+        os.remove(os.path.join(output_folder, 'a-1.0-rev1-linux' + CommonUtils.package_hash_extension))
+
+        results = ValidatePackages(output_folder, jobs=1, stop_on_failure=True)
+        assert [result['status'] for result in results.values()] == ['invalid', 'skipped', 'skipped']
+
+@pytest.mark.parametrize("startMethod", multiprocessing.get_all_start_methods())
+def test_ValidatePackages_second_run_skips_archives_that_passed(startMethod, monkeypatch):
+    with tempfile.TemporaryDirectory() as output_folder:
+        CreatePackages(output_folder, ['stamped-1.0-rev1-linux'])
+        # workers must set the stamps up themselves, whether they are forked or spawned
+        monkeypatch.setattr(validate_packages, 'process_context', multiprocessing.get_context(startMethod))
+        monkeypatch.setattr(CommonUtils, 'validation_stamps', ValidationStamps(ValidationStamps.GetStampFilePath(output_folder)))
+
+        first_results = ValidatePackages(output_folder, jobs=1)
+        assert first_results['stamped-1.0-rev1-linux']['status'] == 'valid'
+        assert 'skipping the contents check' not in first_results['stamped-1.0-rev1-linux']['output']
+        assert os.path.exists(ValidationStamps.GetStampFilePath(output_folder))
+
+        second_results = ValidatePackages(output_folder, jobs=1)
+        assert second_results['stamped-1.0-rev1-linux']['status'] == 'valid'
+        assert 'skipping the contents check' in second_results['stamped-1.0-rev1-linux']['output']
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='the slow validation is patched in, which needs forked workers')
+def test_ValidatePackages_timeout(monkeypatch):
+    with tempfile.TemporaryDirectory() as output_folder:
+        CreatePackages(output_folder, ['slow-1.0-rev1-linux'])
+        monkeypatch.setattr(CommonUtils, 'FullyValidatePackage', lambda *args: time.sleep(60))
+        results = ValidatePackages(output_folder, jobs=1, timeout=0.5)
+        assert results['slow-1.0-rev1-linux']['status'] == 'timeout'
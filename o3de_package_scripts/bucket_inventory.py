@@ -0,0 +1,121 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import json
+import time
+import threading
+
+from common import CommonUtils
+from hash_cache import HashCache
+
+"""This module implements an inventory of the packages in an S3 bucket, so that asking whether a bucket has
+a package costs one listing of the whole bucket per run, instead of one request per package.
+
+A package counts as in the bucket once its PackageInfo.json is, since that is always the last part uploaded.
+
+The inventory can also be kept on disk, in the output folder, and reused by later runs for up to
+PACKAGE_inventory_max_age seconds (0, the default, always lists the bucket again).  A snapshot may miss
+packages uploaded since it was taken, so anything that writes to the bucket double checks with S3 first.
+"""
+
+# seconds for which an inventory snapshot on disk may be used instead of listing the bucket again.  0 never uses one.
+inventory_max_age = float(os.environ.get("PACKAGE_inventory_max_age", default = 0))
+
+class BucketInventory():
+    ''' The set of names of the packages in an S3 bucket, listed lazily on first use.
+    All methods are safe to call from multiple threads.
+    '''
+    snapshot_version = 1
+
+    def __init__(self, session, bucket_name, snapshot_path = None, max_age = None):
+        self.session = session
+        self.bucket_name = bucket_name
+        self.snapshot_path = snapshot_path
+        self.max_age = inventory_max_age if max_age is None else max_age
+        self.package_names = None # listed lazily on first use
+        self.listed_at = None
+        self.list_requests = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def GetSnapshotPath(output_folder, bucket_name):
+        return os.path.join(output_folder, HashCache.cache_folder_name, f'inventory_{bucket_name}.json')
+
+    def _ReadSnapshot(self):
+        ''' Returns (package names, time listed) from a snapshot that is still fresh enough, otherwise (None, None) '''
+        if not self.snapshot_path or self.max_age <= 0 or not os.path.exists(self.snapshot_path):
+            return None, None
+        try:
+            with open(self.snapshot_path, encoding='utf8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            if snapshot['version'] != BucketInventory.snapshot_version or snapshot['bucket_name'] != self.bucket_name:
+                return None, None
+            if time.time() - snapshot['listed_at'] > self.max_age:
+                return None, None
+            return set(snapshot['package_names']), snapshot['listed_at']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def _WriteSnapshot(self):
+        # must be called with the lock held.
+        if not self.snapshot_path:
+            return
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        # a temp file of its own, since another run may be writing a snapshot of the same bucket at the same time
+        temp_file_path = f'{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file_path, 'w', encoding='utf8') as snapshot_file:
+            json.dump({'version': BucketInventory.snapshot_version, 'bucket_name': self.bucket_name, 'listed_at': self.listed_at,
+                       'package_names': sorted(self.package_names)}, snapshot_file)
+        os.replace(temp_file_path, self.snapshot_path)
+
+    def _ListBucket(self):
+        ''' Returns the names of every package in the bucket, going through every page of the listing '''
+        package_descriptor_extension = '.' + CommonUtils.package_descriptor_name
+        package_names = set()
+        paginator = self.session.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name):
+            self.list_requests += 1
+            # an empty bucket, or the last page of one, has no Contents at all
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+                if key.endswith(package_descriptor_extension):
+                    package_names.add(key[:-len(package_descriptor_extension)])
+        return package_names
+
+    def _EnsureListed(self):
+        # must be called with the lock held.
+        if self.package_names is not None:
+            return
+        self.package_names, self.listed_at = self._ReadSnapshot()
+        if self.package_names is not None:
+            print(f"    - Using the inventory of bucket '{self.bucket_name}' from {self.snapshot_path}, {time.time() - self.listed_at:.0f}s old")
+            return
+        print(f"    - Listing the packages in bucket '{self.bucket_name}'...")
+        self.listed_at = time.time()
+        self.package_names = self._ListBucket()
+        print(f"    - Found {len(self.package_names)} packages in bucket '{self.bucket_name}' with {self.list_requests} requests")
+        CommonUtils.metrics.Emit('bucket_listed', bucket=self.bucket_name, packages=len(self.package_names), requests=self.list_requests)
+        self._WriteSnapshot()
+
+    def GetPackageNames(self):
+        with self.lock:
+            self._EnsureListed()
+            return set(self.package_names)
+
+    def Contains(self, package_name):
+        with self.lock:
+            self._EnsureListed()
+            return package_name in self.package_names
+
+    def Add(self, package_name):
+        ''' Records that package_name was just uploaded to the bucket '''
+        with self.lock:
+            self._EnsureListed()
+            if package_name not in self.package_names:
+                self.package_names.add(package_name)
+                self._WriteSnapshot()
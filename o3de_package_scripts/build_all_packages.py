@@ -10,35 +10,167 @@ import subprocess
 import argparse
 import sys
 import traceback
+import functools
+import time
+import concurrent.futures
 
 from common import CommonUtils
 from find_package_on_server import FindPackageUtils
-from pack_package import PackageUpFolder
+from pack_package import PackageUpFolder, AddPackArgs, EstimatePackMemory, GetImageSize, GetPeakMemoryUsage
+from build_scheduler import DependencyScheduler, MemoryBudget
+from build_cache import BuildCache, AddBuildCacheArgs
+import build_cache
 
-def BuildPackages(output_folder, search_paths, server_urls, aws_profile_name):
+# number of build scripts to run at the same time.  The cores of the machine are split evenly between them,
+# and each is told its share in the O3DE_BUILD_JOBS environment variable.
+default_build_jobs = int(os.environ.get("PACKAGE_build_jobs", default = 1))
+# when running more than one build script at a time, the output of each goes to a log file in this folder of the output folder.
+build_log_folder_name = 'build_logs'
+# number of packages to pack at the same time.  0 packs them one at a time once every build script is done.  Anything more
+# packs each package as soon as it is ready - right away if it has no build script - alongside the build scripts still running.
+default_pack_jobs = int(os.environ.get("PACKAGE_pack_jobs", default = 0))
+# MiB of memory that the packages being packed at the same time may need between them, by estimate.  0 means no limit.
+default_memory_budget = int(os.environ.get("PACKAGE_memory_budget", default = 0))
+# where to write the timing report, as .json and .prom (for the Prometheus textfile collector).  Defaults to build_metrics in the output folder.
+default_metrics_report = os.environ.get("PACKAGE_metrics_report", default = None)
+metrics_report_name = 'build_metrics'
+
+def _RunBuildScript(package_name, build_script_cmd, build_environment, build_log_folder):
+    ''' Runs the build script of a package, with its output going to a log file in build_log_folder if given.
+    Returns True if it succeeded.
+    '''
+    build_script_folder = os.path.dirname(build_script_cmd.split(' ')[0])
+    cmd = [sys.executable, '-s'] + build_script_cmd.split(' ')
+    if not build_log_folder:
+        print(f"Calling build script: \"{build_script_cmd}\"...")
+        return subprocess.run(cmd, cwd=build_script_folder, env=build_environment).returncode == 0
+
+    os.makedirs(build_log_folder, exist_ok=True)
+    build_log_path = os.path.join(build_log_folder, f'{package_name}.log')
+    print(f"Calling build script: \"{build_script_cmd}\", logging to {build_log_path}...")
+    with open(build_log_path, 'wb') as build_log:
+        return subprocess.run(cmd, cwd=build_script_folder, env=build_environment, stdout=build_log, stderr=subprocess.STDOUT).returncode == 0
+
+def _PackFolderPackageWithinBudget(package_name, package_abspath, pack_function, memory_budget, compression, xz_threads, xz_block_size):
+    ''' Same as _PackFolderPackage, once memory_budget has room for the memory that packing the image is estimated
+    to need with those compression settings.
+    Returns (whether it packed, estimated bytes, seconds waited, peak memory of the process once it was done).
+    '''
+    pack_memory = 0
+    # estimating walks the whole image, which is only worth it when there is a budget to keep to
+    if memory_budget.budget_bytes and os.path.isdir(package_abspath):
+        try:
+            pack_memory = EstimatePackMemory(GetImageSize(package_abspath), compression, xz_threads, xz_block_size)
+        except OSError as e:
+            # packing will run into the same problem, and report it
+            print(f"Error:  could not estimate the memory needed to pack {package_name}: {e}")
+    with memory_budget.Reserve(pack_memory) as waited_seconds:
+        CommonUtils.metrics.Record(package_name, 'queue', waited_seconds)
+        CommonUtils.metrics.Emit('pack_started', package=package_name, estimated_memory=pack_memory, waited_seconds=waited_seconds)
+        packed = _PackFolderPackage(package_name, package_abspath, pack_function)
+    return packed, pack_memory, waited_seconds, GetPeakMemoryUsage()
+
+def _BuildPackageImage(package_name, build_script_cmd, build_environment, build_log_folder, package_build_cache, image_folder, dependency_image_folders, jobs):
+    ''' Runs the build script of a package like _RunBuildScript, unless package_build_cache (if given) says that
+    its last successful build had the same inputs and its package image in image_folder is still intact.
+    Returns True if it succeeded.
+    '''
+    build_key = None
+    if package_build_cache:
+        build_key = BuildCache.ComputeBuildKey(build_script_cmd, dependency_image_folders, jobs)
+        if package_build_cache.IsUpToDate(package_name, build_key, image_folder, jobs):
+            print(f"    - Build script for package {package_name} skipped, since its last build with the same inputs is still intact in {image_folder}")
+            CommonUtils.metrics.Emit('build_skipped', package=package_name)
+            return True
+    CommonUtils.metrics.Emit('build_started', package=package_name, command=build_script_cmd)
+    with CommonUtils.metrics.Phase(package_name, 'build'):
+        succeeded = _RunBuildScript(package_name, build_script_cmd, build_environment, build_log_folder)
+    CommonUtils.metrics.Emit('build_finished', package=package_name, succeeded=succeeded)
+    if succeeded and package_build_cache:
+        package_build_cache.Record(package_name, build_key, image_folder, jobs)
+    return succeeded
+
+def _PackFolderPackage(package_name, package_abspath, pack_function):
+    ''' Packs the package image of package_name found in package_abspath with pack_function (PackageUpFolder with
+    the packing options bound).  Returns True if it succeeded.
+    '''
+    package_info_file_path = os.path.join(package_abspath, CommonUtils.package_descriptor_name)
+    # over here we'd sync the folder, if necessary, using p4 or git or whatever.
+    # for now we assume its all fetched.
+    if not os.path.exists(package_info_file_path):
+        print(f"Error: Package info file not found: {package_info_file_path} ... skipping")
+        return False
+    try:
+        data = CommonUtils.ReadPackageInfo(package_info_file_path)
+        if data['PackageName'] != package_name:
+            raise KeyError(f"Package {package_name} has a PackageInfo.json that claims its {data['PackageName']} instead.")
+    
+        # build it:
+        if not pack_function(package_abspath):
+            print(f"Error:  {package_name} failed to package up correctly.")
+            return False
+
+    except Exception as e:
+        print(f"Error:  {package_name} {e}") 
+        traceback.print_exc()
+        return False
+    return True
+
+def _GetPackResult(package_name, pack_result):
+    ''' Returns the result of a future of _PackFolderPackageWithinBudget, counting one that raised as a failed pack '''
+    try:
+        return pack_result.result()
+    except Exception as e:
+        print(f"Error:  {package_name} {e}")
+        traceback.print_exception(type(e), e, e.__traceback__)
+        return False, 0, 0.0, None
+
+def _PrintPackingMemorySummary(pack_results, memory_budget):
+    ''' Prints, for every package packed, the memory it was estimated to need, how long it waited for it, and the peak memory of the process after it '''
+    mebibyte = 1024 * 1024
+    name_width = max([len('PACKAGE')] + [len(package_name) for package_name in pack_results.keys()])
+    print(f"| {'PACKAGE':<{name_width}} | ESTIMATE (MiB) | WAIT (s) | PEAK RSS (MiB) |")
+    print(f"|-{'-' * name_width}-|----------------|----------|----------------|")
+    for package_name, (_, pack_memory, waited_seconds, peak_memory) in pack_results.items():
+        peak_text = f"{peak_memory / mebibyte:>14.0f}" if peak_memory else f"{'n/a':>14}"
+        print(f"| {package_name:<{name_width}} | {pack_memory / mebibyte:>14.0f} | {waited_seconds:>8.2f} | {peak_text} |")
+    budget_text = f"{memory_budget.budget_bytes / mebibyte:.0f} MiB" if memory_budget.budget_bytes else 'no limit'
+    print(f"Most memory reserved for packing at once: {memory_budget.peak_reserved_bytes / mebibyte:.0f} MiB (budget: {budget_text})")
+
+def BuildPackages(output_folder, search_paths, server_urls, aws_profile_name, jobs = None, xz_threads = None, xz_block_size = None, force = None, compression = None, reproducible = None, validation = None, build_jobs = None, pack_jobs = None, lookup_jobs = None, no_build_cache = None, metrics_report = None, memory_budget = None):
     ''' BuildPackages is essentially the main function.
     Given an output_folder, paths to search for trees of json files, 
     and urls of servers to contact, it will build all missing packages
     to the output folder, including invoking build scripts as necessary.
+    build_jobs is the number of build scripts to run at the same time (defaults to the module setting).
+    pack_jobs, if more than 0, is the number of packages to pack at the same time, starting as soon as each
+    package is ready instead of after all build scripts finished (defaults to the module setting).
+    lookup_jobs is the number of packages to look for on the servers at the same time (defaults to FindPackageUtils.lookup_jobs).
+    no_build_cache runs every build script, even those whose last build with the same inputs is still intact (defaults to the build_cache setting).
+    metrics_report is where to write how long each phase of each package took, as .json and .prom files (defaults to the module setting).
+    memory_budget is how many MiB the packages packed at the same time may need between them, by estimate, 0 for no limit (defaults to the module setting).
     '''
-    
+    start_time = time.perf_counter()
+    CommonUtils.metrics.Clear()
+
     data = CommonUtils.LoadPackageLists(search_paths)
     CommonUtils.PrintPackageList(data)
 
     failed_source_packages = []
-    failed_folder_packages = []
-    exitCode = 0
 
     source_packages = data['build_from_source']
     folder_packages = data['build_from_folder']
 
+    # find out what is already uploaded, once for every package, before doing anything else
+    found_on_server = FindPackageUtils.FindPackagesOnServers(list(source_packages.keys()) + list(folder_packages.keys()), server_urls, aws_profile_name, lookup_jobs)
     packages_already_found_on_server = []
+    build_script_cmds = {} # map of package name -> build script command, for those that need to be built
 
     print("Building packages from source...")
     # first, find out which packages, if any, need to be built from source
     for package_name in source_packages.keys():
         print(f"    Package: '{package_name}'...")
-        found = FindPackageUtils.FindPackageOnServer(package_name, server_urls, aws_profile_name)
+        found = found_on_server[package_name]
         if found:
             # we dont attempt to build packages already present on the package servers.
             print(f"    - {package_name} already found at {found}")
@@ -46,28 +178,82 @@ def BuildPackages(output_folder, search_paths, server_urls, aws_profile_name):
             continue
         build_script_cmd = source_packages[package_name]
         build_script_path = build_script_cmd.split(' ')[0]
-        build_script_folder = os.path.dirname(build_script_path)
         # fetch and then execute the build script
         if not os.path.exists(build_script_path):
             print(f"Error: build script at {build_script_path} for package {package_name} not found!")
             failed_source_packages.append(package_name)
-            exitCode = 1
             continue
 
         if package_name not in folder_packages:
             print(f"Error: {package_name} specified in the source packages, but not the folder packages!")
             failed_source_packages.append(package_name)
-            exitCode = 1
             continue
 
-        print(f"Calling build script: \"{build_script_cmd}\"...")
-        cmd = [sys.executable, '-s'] + build_script_cmd.split(' ')
-        output = subprocess.run(cmd, cwd=build_script_folder)
-        if output.returncode != 0:
+        build_script_cmds[package_name] = build_script_cmd
+
+    # then run the build scripts, as many at a time as allowed, each after the build scripts it depends on.
+    build_jobs = max(1, build_jobs or default_build_jobs)
+    build_log_folder = os.path.join(output_folder, build_log_folder_name) if build_jobs > 1 else None
+    build_environment = os.environ.copy()
+    build_environment['O3DE_BUILD_JOBS'] = str(max(1, (os.cpu_count() or 1) // build_jobs))
+    if build_script_cmds:
+        print(f"Running {len(build_script_cmds)} build scripts, {build_jobs} at a time, each with O3DE_BUILD_JOBS={build_environment['O3DE_BUILD_JOBS']}")
+
+    dependencies = data['build_dependencies']
+    if no_build_cache is None:
+        no_build_cache = build_cache.no_build_cache
+    package_build_cache = None if no_build_cache else BuildCache(BuildCache.GetCacheFilePath(output_folder))
+    pack_jobs = default_pack_jobs if pack_jobs is None else pack_jobs
+    pack_function = functools.partial(PackageUpFolder, output_folder=output_folder, jobs=jobs, xz_threads=xz_threads, xz_block_size=xz_block_size,
+                                      force=force, compression=compression, reproducible=reproducible, validation=validation)
+    pack_executor = concurrent.futures.ThreadPoolExecutor(max_workers=pack_jobs) if pack_jobs > 0 else None
+    memory_budget = MemoryBudget((default_memory_budget if memory_budget is None else memory_budget) * 1024 * 1024)
+    pack_results = {} # map of package name -> result of _PackFolderPackageWithinBudget, or a future of it
+
+    def PackFolderPackage(package_name):
+        print(f"    Package: '{package_name}'...")
+        found = found_on_server[package_name]
+        if found:
+            print(f"    - {package_name} already at {found}.")
+            packages_already_found_on_server.append(package_name)
+            return
+        if pack_executor:
+            print(f"    - Queued {package_name} for packing.")
+            pack_results[package_name] = pack_executor.submit(_PackFolderPackageWithinBudget, package_name, folder_packages[package_name], pack_function,
+                                                              memory_budget, compression, xz_threads, xz_block_size)
+        else:
+            pack_results[package_name] = _PackFolderPackageWithinBudget(package_name, folder_packages[package_name], pack_function,
+                                                                        memory_budget, compression, xz_threads, xz_block_size)
+
+    if pack_executor:
+        # packages that do not need building can be packed while the build scripts run
+        budget_text = f", within {memory_budget.budget_bytes // (1024 * 1024)} MiB" if memory_budget.budget_bytes else ''
+        print(f"Packing packages {pack_jobs} at a time{budget_text}, as soon as they are ready...")
+        for package_name in folder_packages.keys():
+            if package_name not in source_packages:
+                PackFolderPackage(package_name)
+
+    def OnBuildScriptFinished(package_name, status):
+        if status == DependencyScheduler.succeeded:
+            print(f"    - Build script for package {package_name} succeeded.")
+            if pack_executor:
+                PackFolderPackage(package_name)
+        elif status == DependencyScheduler.failed:
             print(f"Build script for package {package_name} failed, will not attempt to create package for it")
+        elif status == DependencyScheduler.cyclic:
+            print(f"Build script for package {package_name} was not run, since its build_dependencies form a cycle")
+        else:
+            print(f"Build script for package {package_name} was not run, since one of its build_dependencies {dependencies[package_name]} failed")
+        if status != DependencyScheduler.succeeded:
             failed_source_packages.append(package_name)
-            exitCode = 1
-            
+
+    build_tasks = {package_name: functools.partial(_BuildPackageImage, package_name, build_script_cmd, build_environment, build_log_folder,
+                                                   package_build_cache, folder_packages[package_name],
+                                                   [folder_packages[dependency] for dependency in dependencies.get(package_name, []) if dependency in folder_packages], jobs)
+                   for package_name, build_script_cmd in build_script_cmds.items()}
+    # packages that could not even start building count as failed dependencies too
+    DependencyScheduler(build_jobs).Run(build_tasks, dependencies, OnBuildScriptFinished, set(failed_source_packages))
+
     print("Building packages from folders...")
     for package_name in folder_packages.keys():
         if package_name in failed_source_packages:
@@ -78,39 +264,17 @@ def BuildPackages(output_folder, search_paths, server_urls, aws_profile_name):
             print(f"    Package: '{package_name}' skipped since its already uploaded.")
             continue
 
-        print(f"    Package: '{package_name}'...")
-        found = FindPackageUtils.FindPackageOnServer(package_name, server_urls, aws_profile_name)
-        if found:
-            print(f"    - {package_name} already at {found}.")
-            packages_already_found_on_server.append(package_name)
-        
-        if not package_name in packages_already_found_on_server:
-            package_abspath = folder_packages[package_name]
-            package_info_file_path = os.path.join(package_abspath, CommonUtils.package_descriptor_name)
-            # over here we'd sync the folder, if necessary, using p4 or git or whatever.
-            # for now we assume its all fetched.
-            if not os.path.exists(package_info_file_path):
-                print(f"Error: Package info file not found: {package_info_file_path} ... skipping")
-                failed_folder_packages.append(package_name)
-                exitCode = 1
-                continue
-            try:
-                data = CommonUtils.ReadPackageInfo(package_info_file_path)
-                if data['PackageName'] != package_name:
-                    raise KeyError(f"Package {package_name} has a PackageInfo.json that claims its {data['PackageName']} instead.")
-            
-                # build it:
-                if not PackageUpFolder(package_abspath, output_folder):
-                    print(f"Error:  {package_name} failed to package up correctly.")
-                    exitCode = 1
-                    failed_folder_packages.append(package_name)
-
-            except Exception as e:
-                print(f"Error:  {package_name} {e}") 
-                exitCode = 1
-                failed_folder_packages.append(package_name)
-                traceback.print_exc()
-                continue
+        if package_name not in pack_results:
+            PackFolderPackage(package_name)
+
+    if pack_executor:
+        # wait for everything queued, in the order it was queued
+        pack_executor.shutdown(wait=True)
+        pack_results = {package_name: _GetPackResult(package_name, pack_result) for package_name, pack_result in pack_results.items()}
+    failed_folder_packages = [package_name for package_name, pack_result in pack_results.items() if not pack_result[0]]
+
+    if pack_results and (pack_executor or memory_budget.budget_bytes):
+        _PrintPackingMemorySummary(pack_results, memory_budget)
 
     if packages_already_found_on_server:
         print("The following packages were skipped as they were already on the server(s)")
@@ -126,15 +290,33 @@ def BuildPackages(output_folder, search_paths, server_urls, aws_profile_name):
         print("WARNING: These packages failed to build from folder:")
         for package_name in failed_folder_packages:
             print(f"   [FAILED] - {package_name}")
-    
-    return exitCode
+
+    total_seconds = time.perf_counter() - start_time
+    metrics_report = metrics_report or default_metrics_report or os.path.join(output_folder, metrics_report_name)
+    CommonUtils.metrics.WriteJSONReport(metrics_report + '.json', total_seconds)
+    CommonUtils.metrics.WritePrometheusReport(metrics_report + '.prom', total_seconds)
+    print(f"Wrote timing report to {metrics_report}.json and {metrics_report}.prom")
+    print(f"Finished in {total_seconds:.1f}s.  {CommonUtils.metrics.GetSummary()}")
+
+    return 1 if failed_source_packages or failed_folder_packages else 0
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Builds any missing packages into the packages folder, based on package list json files.')
     CommonUtils.AddCommonArgs(parser)
     FindPackageUtils.AddServerArgs(parser)
+    AddPackArgs(parser)
+    parser.add_argument('--build_jobs', type=int, action='store', default=default_build_jobs,
+                        help='Number of build scripts to run at the same time, splitting the cores between them.  Build scripts that depend on each other (build_dependencies in the package lists) still run in order.  Can also use PACKAGE_build_jobs')
+    parser.add_argument('--memory_budget', type=int, action='store', default=default_memory_budget,
+                        help='MiB of memory the packages being packed at the same time may need between them, going by an estimate from their size and the compression settings.  0 for no limit.  Can also use PACKAGE_memory_budget')
+    parser.add_argument('--pack_jobs', type=int, action='store', default=default_pack_jobs,
+                        help='Pack up to this many packages at the same time, each as soon as it is ready, while build scripts are still running.  0 packs one at a time after all build scripts.  Can also use PACKAGE_pack_jobs')
+    AddBuildCacheArgs(parser)
+    parser.add_argument('--metrics_report', action='store', default=default_metrics_report,
+                        help=f'Where to write how long each phase of each package took, with .json and .prom (Prometheus textfile collector) added.  Defaults to {metrics_report_name} in the output folder.  Can also use PACKAGE_metrics_report')
     args = parser.parse_args()
     CommonUtils.PostArgParse(args)
+    FindPackageUtils.PostServerArgParse(args)
 
     if args.profile_name:
         print(f"Using AWS profile: {args.profile_name}")
@@ -144,5 +326,5 @@ if __name__ == "__main__":
         print("Either set LY_PACKAGE_SERVER_URLS (semi colon list) or specify it in the command line in --server_urls (semi colon list)")
         sys.exit(1)
 
-    exitCode = BuildPackages(args.output_folder, args.search_path, args.server_urls, args.profile_name)
+    exitCode = BuildPackages(args.output_folder, args.search_path, args.server_urls, args.profile_name, args.jobs, args.xz_threads, args.xz_block_size, args.force, args.compression, args.reproducible, args.validation, args.build_jobs, args.pack_jobs, args.lookup_jobs, args.no_build_cache, args.metrics_report, args.memory_budget)
     sys.exit(exitCode)
@@ -0,0 +1,130 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import sys
+import json
+import hashlib
+import threading
+
+from common import CommonUtils
+from hash_cache import HashCache
+from pack_package import _DescribeImageFile
+
+"""This module implements a local record of build scripts that already ran successfully, so that running
+the same build script again, with the same inputs, can be skipped while the package image it produced
+is still exactly as it left it.
+
+A build is recorded under a key covering the contents of the build script file, the arguments it is given
+in the package list, the platform, the python running it, the environment variables listed in
+PACKAGE_build_cache_environment and the package images of its build_dependencies.  Along with it goes a digest
+of the package image it produced.  Files the build script reads other than itself (helper scripts next to it,
+patches, downloads) are not part of the key, so use --no_build_cache to run a build script regardless.
+
+Records are appended to a JSON lines file, and the last one for a package wins.  Delete the file to forget every build.
+"""
+
+# set PACKAGE_no_build_cache to 1 to always run build scripts, even when their last successful build is still intact
+no_build_cache = os.environ.get("PACKAGE_no_build_cache", default = '0') not in ['', '0']
+# semicolon-separated environment variables that build scripts are expected to react to
+build_cache_environment = os.environ.get("PACKAGE_build_cache_environment", default = 'CC;CXX;CFLAGS;CXXFLAGS;LDFLAGS;CMAKE_GENERATOR;MACOSX_DEPLOYMENT_TARGET')
+# bump this whenever the build key or image digest start covering something new, so that old records stop counting.
+build_cache_version = 1
+
+class BuildCache():
+    ''' The record of { package name : (build key, image digest) } of builds that succeeded.
+    All methods are safe to call from multiple threads.
+    '''
+    cache_file_name = 'build_cache.jsonl'
+
+    def __init__(self, cache_file_path):
+        self.cache_file_path = cache_file_path
+        self.builds = None # loaded lazily on first use
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def GetCacheFilePath(output_folder):
+        return os.path.join(output_folder, HashCache.cache_folder_name, BuildCache.cache_file_name)
+
+    @staticmethod
+    def ComputeImageDigest(image_folder, jobs = None):
+        ''' Returns a hash of everything about the package image in image_folder that would end up in its package,
+        or None if there is no such folder.
+        '''
+        if not os.path.isdir(image_folder):
+            return None
+        image_files = list(CommonUtils.WalkPackageImage(image_folder))
+        file_hashes = CommonUtils.ComputeHashesOfFiles([abspath for _, abspath, _, _ in image_files], jobs,
+                                                       stat_results=[stat_result for _, _, stat_result, _ in image_files])
+        image_records = [[relpath] + _DescribeImageFile(abspath, stat_result, file_hash)
+                         for (relpath, abspath, stat_result, _), file_hash in zip(image_files, file_hashes)]
+        return hashlib.sha256(json.dumps(image_records).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def ComputeBuildKey(build_script_cmd, dependency_image_folders = (), jobs = None):
+        ''' Returns a hash of everything that goes into running build_script_cmd (the build script path followed
+        by its arguments, as in the package lists), given the image folders of the packages it depends on.
+        Returns None if the build script does not exist.
+        '''
+        build_script_path = build_script_cmd.split(' ')[0]
+        if not os.path.isfile(build_script_path):
+            return None
+        key_records = [build_cache_version,
+                       CommonUtils.ComputeHashOfFile(build_script_path),
+                       build_script_cmd.split(' ')[1:],
+                       CommonUtils.GetPALPlatformName(),
+                       sys.version,
+                       {name: os.environ.get(name) for name in build_cache_environment.split(';') if name},
+                       [BuildCache.ComputeImageDigest(image_folder, jobs) for image_folder in dependency_image_folders]]
+        return hashlib.sha256(json.dumps(key_records).encode('utf8')).hexdigest()
+
+    def _EnsureLoaded(self):
+        # must be called with the lock held.
+        if self.builds is not None:
+            return
+        self.builds = {}
+        if not os.path.exists(self.cache_file_path):
+            return
+        with open(self.cache_file_path, encoding='utf8') as cache_file:
+            for line in cache_file:
+                try:
+                    build = json.loads(line)
+                    self.builds[build['package_name']] = (build['build_key'], build['image_digest'])
+                except (ValueError, KeyError):
+                    pass # a partially written line, that package just gets built again.
+
+    def IsUpToDate(self, package_name, build_key, image_folder, jobs = None):
+        ''' Returns True if the last successful build of package_name had build_key, and the package image
+        it produced in image_folder has not changed since.
+        '''
+        if not build_key:
+            return False
+        with self.lock:
+            self._EnsureLoaded()
+            build = self.builds.get(package_name)
+        if not build or build[0] != build_key:
+            return False
+        return BuildCache.ComputeImageDigest(image_folder, jobs) == build[1]
+
+    def Record(self, package_name, build_key, image_folder, jobs = None):
+        ''' Records that the build script of package_name succeeded with build_key, producing image_folder '''
+        image_digest = BuildCache.ComputeImageDigest(image_folder, jobs)
+        if not build_key or not image_digest:
+            return
+        with self.lock:
+            self._EnsureLoaded()
+            if self.builds.get(package_name) == (build_key, image_digest):
+                return
+            self.builds[package_name] = (build_key, image_digest)
+            os.makedirs(os.path.dirname(self.cache_file_path), exist_ok=True)
+            # a single short append, which does not interleave with appends from other processes.
+            with open(self.cache_file_path, 'a', encoding='utf8') as cache_file:
+                cache_file.write(json.dumps({'package_name': package_name, 'build_key': build_key, 'image_digest': image_digest}) + '\n')
+
+def AddBuildCacheArgs(argparser):
+    argparser.add_argument('--no_build_cache', action='store_true', default=no_build_cache,
+                           help='Run build scripts even if their last successful build, with the same inputs, is still intact.  Can also use PACKAGE_no_build_cache')
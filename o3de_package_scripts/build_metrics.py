@@ -0,0 +1,179 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import json
+import time
+import queue
+import threading
+import contextlib
+import collections
+
+"""This module implements the instrumentation of the package scripts: how long each phase of producing each
+package took, and how many bytes it went through, plus an optional stream of lifecycle events.
+
+Phases are timed as they run and can be written out at the end as a JSON report and as a snippet for the
+Prometheus node exporter's textfile collector.  Events are written, one JSON object per line, to the file
+given with --events, by a background thread, so that emitting one never waits on the disk.
+"""
+
+class EventLog():
+    ''' Writes events, one JSON object per line, to a file on a background thread.
+    Emit is safe to call from multiple threads and never blocks.
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.pending_events = queue.SimpleQueue()
+        self.owner_pid = os.getpid()
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self.event_file = open(file_path, 'a', encoding='utf8')
+        self.writer_thread = threading.Thread(target=self._WriteEvents, name='EventLog', daemon=True)
+        self.writer_thread.start()
+
+    def _WriteEvents(self):
+        while True:
+            event = self.pending_events.get()
+            if event is None:
+                break
+            self.event_file.write(json.dumps(event) + '\n')
+            if self.pending_events.empty():
+                self.event_file.flush() # caught up, let readers see everything so far
+        self.event_file.close()
+
+    def Emit(self, event):
+        # a process forked from the one that opened the log has no writer thread, so its events are dropped.
+        if os.getpid() == self.owner_pid:
+            self.pending_events.put(event)
+
+    def Close(self):
+        ''' Writes out every event emitted so far and closes the file '''
+        if os.getpid() == self.owner_pid and self.writer_thread.is_alive():
+            self.pending_events.put(None)
+            self.writer_thread.join()
+
+class BuildMetrics():
+    ''' Wall time and bytes of every phase of every package, plus the event log, if enabled.
+    All methods are safe to call from multiple threads.
+    '''
+    # the phases of producing a package, in the order they happen
+    phases = ['lookup', 'build', 'queue', 'enumerate', 'hash', 'compress', 'archive_hash', 'validate', 'move', 'upload']
+    metric_prefix = 'o3de_package'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase_totals = collections.OrderedDict() # map of (package name, phase) -> [seconds, bytes, count]
+        self.event_log = None
+
+    def EnableEventLog(self, file_path):
+        ''' Makes Emit write events to file_path, until Close is called. '''
+        self.Close()
+        self.event_log = EventLog(file_path)
+        print(f"Writing events to '{file_path}'")
+
+    def Close(self):
+        if self.event_log:
+            self.event_log.Close()
+            self.event_log = None
+
+    def Emit(self, event_name, **fields):
+        ''' Sends an event with the given fields to the event log, if there is one.  Returns right away. '''
+        event_log = self.event_log
+        if event_log:
+            event = {'time': time.time(), 'event': event_name}
+            event.update(fields)
+            event_log.Emit(event)
+
+    def Record(self, package_name, phase, seconds, byte_count = 0):
+        ''' Adds seconds and byte_count to the totals of that phase of that package, and emits a phase event '''
+        with self.lock:
+            totals = self.phase_totals.setdefault((package_name, phase), [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += byte_count
+            totals[2] += 1
+        self.Emit('phase', package=package_name, phase=phase, seconds=seconds, bytes=byte_count)
+
+    @contextlib.contextmanager
+    def Phase(self, package_name, phase):
+        ''' Times the body of a with statement as that phase of that package.  Set byte_count on the
+        object it gives to record how many bytes the phase went through.
+        '''
+        timed_phase = _TimedPhase()
+        start_time = time.perf_counter()
+        try:
+            yield timed_phase
+        finally:
+            self.Record(package_name, phase, time.perf_counter() - start_time, timed_phase.byte_count)
+
+    def Clear(self):
+        with self.lock:
+            self.phase_totals.clear()
+
+    def GetReport(self):
+        ''' Returns { 'packages' : { package name : { phase : {seconds, bytes, count} } }, 'phases' : { phase : {seconds, bytes, count} } } '''
+        with self.lock:
+            phase_totals = [(key, list(totals)) for key, totals in self.phase_totals.items()]
+        packages = collections.OrderedDict()
+        phases = collections.OrderedDict((phase, {'seconds': 0.0, 'bytes': 0, 'count': 0}) for phase in BuildMetrics.phases)
+        for (package_name, phase), (seconds, byte_count, count) in phase_totals:
+            packages.setdefault(package_name, collections.OrderedDict())[phase] = {'seconds': seconds, 'bytes': byte_count, 'count': count}
+            phase_sums = phases.setdefault(phase, {'seconds': 0.0, 'bytes': 0, 'count': 0})
+            phase_sums['seconds'] += seconds
+            phase_sums['bytes'] += byte_count
+            phase_sums['count'] += count
+        return {'packages': packages, 'phases': collections.OrderedDict((phase, sums) for phase, sums in phases.items() if sums['count'])}
+
+    def GetSummary(self, top = 3):
+        ''' Returns a single line naming the slowest packages and phases '''
+        report = self.GetReport()
+        package_seconds = sorted(((sum(phase['seconds'] for phase in package.values()), package_name) for package_name, package in report['packages'].items()), reverse=True)
+        phase_seconds = sorted(((phase['seconds'], phase_name) for phase_name, phase in report['phases'].items()), reverse=True)
+        slowest_packages = ', '.join(f"{package_name} {seconds:.1f}s" for seconds, package_name in package_seconds[:top]) or 'none'
+        slowest_phases = ', '.join(f"{phase_name} {seconds:.1f}s" for seconds, phase_name in phase_seconds[:top]) or 'none'
+        return f"Slowest packages: {slowest_packages} | Slowest phases: {slowest_phases}"
+
+    def WriteJSONReport(self, report_path, total_seconds = None):
+        report = self.GetReport()
+        report['seconds'] = total_seconds
+        _WriteFileAtomically(report_path, json.dumps(report, indent=4))
+
+    def WritePrometheusReport(self, report_path, total_seconds = None):
+        ''' Writes the totals in the Prometheus text format, for the node exporter's textfile collector '''
+        prefix = BuildMetrics.metric_prefix
+        lines = [f'# HELP {prefix}_phase_seconds Wall time spent in a phase of producing a package, in the last run.',
+                 f'# TYPE {prefix}_phase_seconds gauge']
+        report = self.GetReport()
+        for package_name, package in report['packages'].items():
+            for phase, totals in package.items():
+                lines.append(f'{prefix}_phase_seconds{{package="{_EscapeLabel(package_name)}",phase="{phase}"}} {totals["seconds"]:.6f}')
+        lines += [f'# HELP {prefix}_phase_bytes Bytes a phase of producing a package went through, in the last run.',
+                  f'# TYPE {prefix}_phase_bytes gauge']
+        for package_name, package in report['packages'].items():
+            for phase, totals in package.items():
+                lines.append(f'{prefix}_phase_bytes{{package="{_EscapeLabel(package_name)}",phase="{phase}"}} {totals["bytes"]}')
+        if total_seconds is not None:
+            lines += [f'# HELP {prefix}_run_seconds Wall time of the last run.',
+                      f'# TYPE {prefix}_run_seconds gauge',
+                      f'{prefix}_run_seconds {total_seconds:.6f}']
+        lines += [f'# HELP {prefix}_run_timestamp_seconds When the last run finished.',
+                  f'# TYPE {prefix}_run_timestamp_seconds gauge',
+                  f'{prefix}_run_timestamp_seconds {time.time():.0f}']
+        _WriteFileAtomically(report_path, '\n'.join(lines) + '\n')
+
+class _TimedPhase():
+    def __init__(self):
+        self.byte_count = 0
+
+def _EscapeLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _WriteFileAtomically(file_path, contents):
+    # the textfile collector may read the file at any moment, so it must never see half of it.
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    temp_file_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_file_path, 'w', encoding='utf8') as report_file:
+        report_file.write(contents)
+    os.replace(temp_file_path, file_path)
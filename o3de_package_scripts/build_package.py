@@ -12,7 +12,9 @@ import argparse
 import traceback
 
 from common import CommonUtils
-from pack_package import PackageUpFolder
+from pack_package import PackageUpFolder, AddPackArgs
+from build_cache import BuildCache, AddBuildCacheArgs
+import build_cache
 
 """This module creates the package specified on the command line, based on the package config files.
 If the package has a build script, it will execute the build script, and then pack the package afterwards,
@@ -21,7 +23,7 @@ otherwise, it will invoke just the packing process.
 Does not attempt to upload the package, and does not attempt to verify that its already uploaded.  Used
 as a development tool.  
 """
-def BuildPackage(package_name, output_folder, search_path):
+def BuildPackage(package_name, output_folder, search_path, jobs = None, xz_threads = None, xz_block_size = None, force = None, compression = None, reproducible = None, validation = None, no_build_cache = None):
     data = CommonUtils.LoadPackageLists(search_path)
 
     source_packages = data['build_from_source']
@@ -50,17 +52,31 @@ def BuildPackage(package_name, output_folder, search_path):
             print(f"Error: {package_name} specified in the source packages, but not the folder packages!")
             return 1
 
+        # skip the build script if its last successful build, with the same inputs, is still intact
+        if no_build_cache is None:
+            no_build_cache = build_cache.no_build_cache
+        package_build_cache = None if no_build_cache else BuildCache(BuildCache.GetCacheFilePath(output_folder))
+        dependency_image_folders = [folder_packages[dependency] for dependency in data['build_dependencies'].get(package_name, []) if dependency in folder_packages]
+        build_key = BuildCache.ComputeBuildKey(build_script_cmd, dependency_image_folders, jobs) if package_build_cache else None
+
         # Put the package_name in an environment variable so that the build script
         # can reference it if desired
         subprocess_env = os.environ.copy()
         subprocess_env["O3DE_PACKAGE_NAME"] = package_name
-
-        print(f"Calling build script: \"{build_script_cmd}\"...")
-        cmd = [sys.executable, '-s', build_script_path] + build_script_cmd.split(' ')[1:]
-        output = subprocess.run(cmd, cwd=build_script_folder, env=subprocess_env)
-        if output.returncode != 0:
-            print(f"Package {package_name} failed to build from source.")
-            return 1
+        # and let it use every core, since it is the only one running
+        subprocess_env["O3DE_BUILD_JOBS"] = str(os.cpu_count() or 1)
+
+        if package_build_cache and package_build_cache.IsUpToDate(package_name, build_key, folder_packages[package_name], jobs):
+            print(f"Skipping build script: \"{build_script_cmd}\", its last build with the same inputs is still intact - Override with --no_build_cache")
+        else:
+            print(f"Calling build script: \"{build_script_cmd}\"...")
+            cmd = [sys.executable, '-s', build_script_path] + build_script_cmd.split(' ')[1:]
+            output = subprocess.run(cmd, cwd=build_script_folder, env=subprocess_env)
+            if output.returncode != 0:
+                print(f"Package {package_name} failed to build from source.")
+                return 1
+            if package_build_cache:
+                package_build_cache.Record(package_name, build_key, folder_packages[package_name], jobs)
 
     # now pack it up...
     package_abspath = folder_packages[package_name]
@@ -76,7 +92,7 @@ def BuildPackage(package_name, output_folder, search_path):
             raise KeyError(f"Package {package_name} has a PackageInfo.json that calls itself {data['PackageName']} instead.")
 
         # build it:
-        PackageUpFolder(package_abspath, output_folder)
+        PackageUpFolder(package_abspath, output_folder, jobs, xz_threads, xz_block_size, force, compression, reproducible, validation)
     except Exception as e:
         print(f"Error:  {package_name} {e}")
         traceback.print_exc()
@@ -89,8 +105,10 @@ if __name__ == "__main__":
     parser.add_argument('package_name', help='The name of the package to build as it appears in the json config files.')
     
     CommonUtils.AddCommonArgs(parser)
+    AddPackArgs(parser)
+    AddBuildCacheArgs(parser)
     args = parser.parse_args()
     CommonUtils.PostArgParse(args)
 
-    sys.exit(BuildPackage(args.package_name, args.output_folder, args.search_path))
+    sys.exit(BuildPackage(args.package_name, args.output_folder, args.search_path, args.jobs, args.xz_threads, args.xz_block_size, args.force, args.compression, args.reproducible, args.validation, args.no_build_cache))
 
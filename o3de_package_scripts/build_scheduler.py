@@ -0,0 +1,134 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import time
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+"""This module implements a small scheduler that runs a set of tasks on a pool of threads, starting each task
+only once every task it depends on has succeeded.  Tasks are meant to spend their time waiting on other
+processes (build scripts, compressors), so threads are enough to keep many of them going at once.
+
+It also implements a memory budget, which holds back jobs that would not fit in memory next to the ones running.
+"""
+
+class DependencyScheduler():
+    ''' Runs tasks on up to max_workers threads, in dependency order.
+    Results are one of the status constants below, for every task.
+    '''
+    succeeded = 'succeeded'
+    failed = 'failed'                       # the task ran, and returned False or raised
+    dependency_failed = 'dependency_failed' # the task did not run because something it depends on did not succeed
+    cyclic = 'cyclic'                       # the task did not run because it (indirectly) depends on itself
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+
+    def Run(self, tasks, dependencies, on_finished = None, already_failed = ()):
+        ''' tasks is a map of name -> callable returning True on success, run in the order given whenever there is a choice.
+        dependencies is a map of name -> names of the tasks it needs first.  Names of things that are not tasks are ignored.
+        on_finished(name, status) is called, on the calling thread, as each task's status becomes known.
+        already_failed names things that are not tasks, but count as failed dependencies.
+        Returns a map of name -> status.
+        '''
+        remaining_dependencies = {}
+        dependents = collections.defaultdict(list)
+        for name in tasks.keys():
+            needed = set(dependency for dependency in dependencies.get(name, []) if (dependency in tasks or dependency in already_failed) and dependency != name)
+            remaining_dependencies[name] = needed
+            for dependency in needed:
+                dependents[dependency].append(name)
+            if name in dependencies.get(name, []):
+                remaining_dependencies[name].add(name) # can never become ready
+
+        results = {}
+        def Finish(name, status):
+            results[name] = status
+            if on_finished:
+                on_finished(name, status)
+            if status != DependencyScheduler.succeeded:
+                # nothing downstream can run now
+                for dependent in dependents[name]:
+                    if dependent not in results:
+                        Finish(dependent, DependencyScheduler.dependency_failed)
+                return
+            for dependent in dependents[name]:
+                remaining_dependencies[dependent].discard(name)
+
+        def RunTask(name):
+            try:
+                return bool(tasks[name]())
+            except Exception as e:
+                print(f"Error: {name} {e}")
+                return False
+
+        for failed_name in already_failed:
+            for dependent in dependents[failed_name]:
+                if dependent not in results:
+                    Finish(dependent, DependencyScheduler.dependency_failed)
+
+        running = {} # map of future -> name
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for name in tasks.keys():
+                    if len(running) >= self.max_workers:
+                        break
+                    if name not in results and name not in running.values() and not remaining_dependencies[name]:
+                        running[executor.submit(RunTask, name)] = name
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    Finish(name, DependencyScheduler.succeeded if future.result() else DependencyScheduler.failed)
+
+        # anything that never became ready is waiting on itself, through some cycle.
+        for name in tasks.keys():
+            if name not in results:
+                results[name] = DependencyScheduler.cyclic
+                if on_finished:
+                    on_finished(name, DependencyScheduler.cyclic)
+        return {name: results[name] for name in tasks.keys()}
+
+class MemoryBudget():
+    ''' Admits jobs, in the order they ask, while the memory they are estimated to need fits in budget_bytes.
+    A job needing more than the whole budget is admitted once nothing else is running.  A budget of 0 admits everything.
+    All methods are safe to call from multiple threads.
+    '''
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes or 0
+        self.reserved_bytes = 0
+        self.peak_reserved_bytes = 0
+        self.waiting = collections.deque() # tickets of the jobs waiting to be admitted, in order
+        self.condition = threading.Condition()
+
+    def _Fits(self, byte_count):
+        return not self.budget_bytes or not self.reserved_bytes or self.reserved_bytes + byte_count <= self.budget_bytes
+
+    @contextlib.contextmanager
+    def Reserve(self, byte_count):
+        ''' Waits until byte_count fits in the budget, and holds it for the body of a with statement.
+        Gives the number of seconds it waited.
+        '''
+        start_time = time.perf_counter()
+        ticket = object()
+        with self.condition:
+            self.waiting.append(ticket)
+            # first come, first served, so that a big job is not starved by a stream of small ones.
+            self.condition.wait_for(lambda: self.waiting[0] is ticket and self._Fits(byte_count))
+            self.waiting.popleft()
+            self.reserved_bytes += byte_count
+            self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+            self.condition.notify_all() # the next one in line may fit too
+        try:
+            yield time.perf_counter() - start_time
+        finally:
+            with self.condition:
+                self.reserved_bytes -= byte_count
+                self.condition.notify_all()
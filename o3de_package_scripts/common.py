@@ -10,12 +10,19 @@ import stat
 import pathlib
 import json
 import platform
-import tempfile
 import tarfile
+import lzma
+import posixpath
 import hashlib
-import ssl
-import certifi
-import urllib.request 
+import mmap
+import concurrent.futures
+import atexit
+import time
+
+from hash_cache import HashCache
+from validation_stamps import ValidationStamps
+from spdx_licenses import SPDXLicenseIndex
+from build_metrics import BuildMetrics
 
 class InvalidHashFormatException(Exception):
     '''Raised when a hash file (SHA256SUMS file) being parsed has a bad format'''
@@ -29,10 +36,18 @@ class CommonUtils():
     package_extension                = '.tar.xz'
     package_hash_extension           = '.tar.xz.SHA256SUMS'
     package_content_hash_extension   = '.tar.xz.content.SHA256SUMS'
+    package_fingerprint_extension    = '.tar.xz.fingerprint' # not a package part, never uploaded
     package_root_hash_file_name      = 'SHA256SUMS'
     package_descriptor_name          = "PackageInfo.json"
     package_info_required_fields     = ['URL', 'PackageName', 'License', 'LicenseFile']
-    spdx_license_list                = None
+    # the SPDX license identifiers licenses are checked against.  Uses the cached list in the output folder once PostArgParse ran.
+    spdx_license_index               = SPDXLicenseIndex()
+
+    # files are hashed in chunks of this size so that memory use does not grow with file size
+    hash_chunk_size                  = 1024 * 1024
+    # files at least this large (in bytes) are hashed through mmap instead of a read buffer.
+    # 0 disables the mmap path.  Override with PACKAGE_hash_mmap_threshold.
+    hash_mmap_threshold              = int(os.environ.get("PACKAGE_hash_mmap_threshold", default = 0))
 
     # default folders
     script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -44,25 +59,36 @@ class CommonUtils():
 
     # update default parameters with environment vars:
     output_folder = os.environ.get("PACKAGE_output_folder", default = default_output_folder)
+    # number of worker threads used to hash package contents.  hashlib releases the GIL
+    # while hashing, so threads scale well here.
+    jobs = int(os.environ.get("PACKAGE_jobs", default = os.cpu_count() or 1))
+    # set PACKAGE_no_hash_cache to 1 to stop file hashes from being cached between runs
+    no_hash_cache = os.environ.get("PACKAGE_no_hash_cache", default = '0') not in ['', '0']
+    # the persistent hash cache, once enabled by EnableHashCache
+    hash_cache = None
+    hash_cache_saved_at_exit = False # whether SaveHashCache is registered to run at exit yet
+    # set PACKAGE_no_validation_stamps to 1 to fully validate archives even if the same bytes passed before
+    no_validation_stamps = os.environ.get("PACKAGE_no_validation_stamps", default = '0') not in ['', '0']
+    # the record of archives that passed full validation, once enabled by EnableValidationStamps
+    validation_stamps = None
+    # bump this whenever FullyValidatePackage starts checking something new, so that old stamps stop counting.
+    validator_version = 1
+    # where to write the JSON lines event stream, if anywhere
+    events = os.environ.get("PACKAGE_events", default = None)
+    # timing of each phase of each package, and the event stream once enabled with --events
+    metrics = BuildMetrics()
 
     @staticmethod
     def GetSPDXLicenseList():
-        if not CommonUtils.spdx_license_list:
-            # get the list from the official site
-            try:
-                context = ssl.create_default_context(cafile=certifi.where())
-                with urllib.request.urlopen("https://spdx.org/licenses/licenses.json", context=context) as url:
-                    data = json.loads(url.read().decode())
-                    # validate that its actually the right content
-                    if 'licenses' in data:
-                        CommonUtils.spdx_license_list = data
-                    else:
-                        print("Invalid license format from spdx.org, see whats at https://spdx.org/licenses/licenses.json")
-            except Exception as e:
-                print("ERROR: Could not fetch the license list from  https://spdx.org/licenses/licenses.json, license validation unavailable")
-                print(str(e))
+        ''' Returns the SPDX license list, in the format of the official licenses.json, or None if it is unavailable.
+        Never goes to the network, see spdx_licenses.py.
+        '''
+        return CommonUtils.spdx_license_index.GetLicenseList()
 
-        return CommonUtils.spdx_license_list or None
+    @staticmethod
+    def GetSPDXLicenseListVersion():
+        ''' Returns the version of the SPDX license list licenses are checked against, or None if it is unavailable '''
+        return CommonUtils.spdx_license_index.GetVersion()
 
     @staticmethod
     def GetPALPlatformName():
@@ -85,6 +111,10 @@ class CommonUtils():
     def AddCommonArgs(argparser):
         argparser.add_argument('-o', '--output_folder', action='store', default=CommonUtils.output_folder, help='The folder to store the package in')
         argparser.add_argument('--search_path', type=str, required=True, action='store', help='Folder to search for package host list files')
+        argparser.add_argument('-j', '--jobs', type=int, action='store', default=CommonUtils.jobs, help='Number of worker threads to use when hashing package contents')
+        argparser.add_argument('--no_hash_cache', action='store_true', default=CommonUtils.no_hash_cache, help='Do not reuse or record file hashes in the hash cache in the output folder')
+        argparser.add_argument('--no_validation_stamps', action='store_true', default=CommonUtils.no_validation_stamps, help='Fully validate every package, even one whose exact archive already passed before')
+        CommonUtils.AddEventsArg(argparser)
         argparser.epilog = 'Note: You can set environment variables in the form\nPACKAGE_<paramname>\n to pass from env instead of command line'
 
     @staticmethod
@@ -97,22 +127,75 @@ class CommonUtils():
         args.output_folder = os.path.join(args.search_path, args.output_folder)
         print(f"Output folder for packages is '{args.output_folder}' - Override with --output_folder")
 
+        CommonUtils.spdx_license_index = SPDXLicenseIndex(SPDXLicenseIndex.GetCacheFilePath(args.output_folder))
+
+        if not args.no_hash_cache:
+            CommonUtils.EnableHashCache(args.output_folder)
+
+        if not args.no_validation_stamps:
+            CommonUtils.EnableValidationStamps(args.output_folder)
+
+        if args.events:
+            CommonUtils.EnableEvents(args.events)
+
+    @staticmethod
+    def AddEventsArg(argparser):
+        argparser.add_argument('--events', action='store', default=CommonUtils.events, metavar='FILE', help='Write one JSON object per line to FILE for every lookup, build, pack phase, validation and upload, as they happen')
+
+    @staticmethod
+    def EnableEvents(events_file_path):
+        ''' Makes CommonUtils.metrics write events to events_file_path, until the process exits '''
+        CommonUtils.metrics.EnableEventLog(events_file_path)
+        atexit.register(CommonUtils.metrics.Close)
+
+    @staticmethod
+    def EnableHashCache(output_folder):
+        ''' Makes ComputeHashOfFile reuse hashes recorded in (and record new ones to) the hash cache
+        kept in the given output folder.  The cache is written back when the process exits.
+        '''
+        if CommonUtils.hash_cache:
+            CommonUtils.hash_cache.Save()
+        CommonUtils.hash_cache = HashCache(HashCache.GetCacheFilePath(output_folder))
+        if not CommonUtils.hash_cache_saved_at_exit:
+            atexit.register(CommonUtils.SaveHashCache)
+            CommonUtils.hash_cache_saved_at_exit = True
+        print(f"Using hash cache '{CommonUtils.hash_cache.cache_file_path}' - Disable with --no_hash_cache")
+
+    @staticmethod
+    def SaveHashCache():
+        ''' Writes the hash cache in use, if any, back to disk '''
+        if CommonUtils.hash_cache:
+            CommonUtils.hash_cache.Save()
+
+    @staticmethod
+    def EnableValidationStamps(output_folder):
+        ''' Makes FullyValidatePackage skip archives whose exact bytes already passed full validation, going by
+        (and adding to) the record kept in the given output folder.
+        '''
+        CommonUtils.validation_stamps = ValidationStamps(ValidationStamps.GetStampFilePath(output_folder))
+        print(f"Using validation stamps '{CommonUtils.validation_stamps.stamp_file_path}' - Disable with --no_validation_stamps")
+
     @staticmethod
     def ReadPackageInfo(package_descriptor_file_path):
         ''' Given a json file that should contain a package descriptor file
         Will read it and throw an exception if something is wrong
         '''
         with open(package_descriptor_file_path, encoding='utf8') as json_file:
-            data = json.load(json_file)
-            for required_field in CommonUtils.package_info_required_fields:
-                if required_field not in data:
-                    raise KeyError("Required field {} is missing from {}".format(required_field, data))
-                if not data[required_field]:
-                    raise KeyError("Required field {} is empty or invalid in {}".format(required_field, data))
-                if len(data[required_field]) < 1:
-                    raise KeyError("Required field {} is empty or invalid in {}".format(required_field, data))
-    
-            return data
+            return CommonUtils.ParsePackageInfo(json_file.read())
+
+    @staticmethod
+    def ParsePackageInfo(package_descriptor_contents):
+        ''' Same as ReadPackageInfo, but for the contents of a package descriptor file '''
+        data = json.loads(package_descriptor_contents)
+        for required_field in CommonUtils.package_info_required_fields:
+            if required_field not in data:
+                raise KeyError("Required field {} is missing from {}".format(required_field, data))
+            if not data[required_field]:
+                raise KeyError("Required field {} is empty or invalid in {}".format(required_field, data))
+            if len(data[required_field]) < 1:
+                raise KeyError("Required field {} is empty or invalid in {}".format(required_field, data))
+
+        return data
 
     @staticmethod
     def GetPackageParts(package_name):
@@ -127,16 +210,28 @@ class CommonUtils():
         for element in known_addons:
             yield package_name + element
 
+    @staticmethod
+    def FindPackagesInFolder(package_folder):
+        ''' Returns the names of all of the packages in a folder (such as the output folder), sorted,
+        going by their archives.  The other parts of each package are not checked for.'''
+        package_names = []
+        for existing_file in os.listdir(package_folder):
+            if existing_file.endswith(CommonUtils.package_extension) and os.path.isfile(os.path.join(package_folder, existing_file)):
+                package_names.append(existing_file[:-len(CommonUtils.package_extension)])
+        return sorted(package_names)
+
     @staticmethod
     def ParseSHA256SumsFile(path_to_file):
         ''' Parse a SHA256 Sums file.  Returns a dictionary:
         { name of file : expected hash}
         '''
-        return_dict = {}
-        lines = []
         with open(path_to_file, encoding='utf8') as shasums_file:
-            lines = shasums_file.readlines()
+            return CommonUtils.ParseSHA256Sums(shasums_file.readlines(), path_to_file)
 
+    @staticmethod
+    def ParseSHA256Sums(lines, path_to_file):
+        ''' Same as ParseSHA256SumsFile, but for the lines of a SHA256 Sums file which was read from path_to_file '''
+        return_dict = {}
         for line in lines:
             line = line.strip()
             space_pos = line.find(' ')
@@ -155,18 +250,52 @@ class CommonUtils():
             return_dict[hash_filename] = hash_code
         return return_dict
     
+    @staticmethod
+    def WalkPackageImage(package_image_folder):
+        ''' Yields (relative path, absolute path, lstat result, is_symlink) for every file in a package image,
+        hidden files included, with relative paths in posix form.  Folders are not yielded, but symlinks to folders
+        are followed like glob does, except into a folder that contains them.
+        Built on os.scandir so that, on most platforms, telling files from folders costs no extra syscalls.
+        '''
+        package_image_folder = os.path.abspath(package_image_folder)
+        folder_stat = os.stat(package_image_folder)
+        pending_folders = [(package_image_folder, '', ((folder_stat.st_dev, folder_stat.st_ino),))]
+        while pending_folders:
+            folder_abspath, folder_relpath, folder_ids = pending_folders.pop()
+            subfolders = []
+            with os.scandir(folder_abspath) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subfolders.append(entry)
+                    else:
+                        yield folder_relpath + entry.name, entry.path, entry.stat(follow_symlinks=False), entry.is_symlink()
+
+            # subfolders are walked after the files in the folder, in the order they were found.
+            for entry in reversed(subfolders):
+                # not entry.stat(), which has no inode on windows
+                folder_stat = os.stat(entry.path)
+                folder_id = (folder_stat.st_dev, folder_stat.st_ino)
+                if folder_id not in folder_ids:
+                    pending_folders.append((entry.path, folder_relpath + entry.name + '/', folder_ids + (folder_id,)))
+
     @staticmethod 
-    def ComputeHashOfFile(file_path):
+    def ComputeHashOfFile(file_path, use_hash_cache = True, stat_result = None):
+        ''' Returns the sha256 of the contents of file_path, following symlinks.
+        If the hash cache is enabled and use_hash_cache is set, an unchanged file is not re-read.
+        stat_result may be passed in when the caller already has the lstat of file_path, to save a syscall.
+        '''
         file_path = os.path.normpath(file_path)
         original_folder = os.path.dirname(file_path)
         hasher = hashlib.sha256()
         hash_result = None
+        if stat_result is not None and stat.S_ISLNK(stat_result.st_mode):
+            stat_result = None
         
         # if its a symlink we'll follow the link.  Note that this is what allows
         # the system to work in terms of a windows machine uploading packages made on
         # linux or MacOS.
         paths_considered = []
-        while (os.path.islink(file_path)):
+        while stat_result is None and os.path.islink(file_path):
             resolved_path = os.readlink(file_path)
             if not os.path.isabs(resolved_path):
                 resolved_path = os.path.join(original_folder, resolved_path)
@@ -178,20 +307,64 @@ class CommonUtils():
             paths_considered.append(resolved_path)
             file_path = resolved_path
 
+        hash_cache = CommonUtils.hash_cache if use_hash_cache else None
+        if hash_cache:
+            file_path = os.path.abspath(file_path)
+            stat_result = stat_result or os.stat(file_path)
+            hash_result = hash_cache.Lookup(file_path, stat_result)
+            if hash_result:
+                return hash_result
+            hashed_at_ns = time.time_ns()
+
         with open(file_path, 'rb') as afile:
-            buf = afile.read()
-            hasher.update(buf)
+            file_size = os.fstat(afile.fileno()).st_size
+            if CommonUtils.hash_mmap_threshold and file_size >= CommonUtils.hash_mmap_threshold:
+                # large files are mapped instead of copied through a read buffer.  The map
+                # is fed to the hasher in chunks so that only a window of it is touched at a time.
+                with mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                    with memoryview(mapped_file) as mapped_view:
+                        for offset in range(0, file_size, CommonUtils.hash_chunk_size):
+                            hasher.update(mapped_view[offset:offset + CommonUtils.hash_chunk_size])
+            else:
+                # stream the file through a single reusable buffer so that memory use stays
+                # flat no matter how large the file is.
+                buf = bytearray(CommonUtils.hash_chunk_size)
+                view = memoryview(buf)
+                bytes_read = afile.readinto(buf)
+                while bytes_read:
+                    hasher.update(view[:bytes_read])
+                    bytes_read = afile.readinto(buf)
             hash_result = hasher.hexdigest()
-        
+
+        if hash_cache:
+            hash_cache.Store(file_path, stat_result, hash_result, hashed_at_ns)
+
         return hash_result
+
+    @staticmethod
+    def ComputeHashesOfFiles(file_paths, jobs = None, use_hash_cache = True, stat_results = None):
+        ''' Computes the hash of every file in file_paths using a bounded pool of worker threads.
+        stat_results, if given, is the lstat of each file in file_paths, as yielded by WalkPackageImage.
+        Returns a list of hashes in the same order as file_paths.
+        '''
+        file_paths = list(file_paths)
+        stat_results = list(stat_results) if stat_results is not None else [None] * len(file_paths)
+        jobs = max(1, min(jobs or CommonUtils.jobs, len(file_paths)))
+        hash_function = lambda file_path, stat_result: CommonUtils.ComputeHashOfFile(file_path, use_hash_cache, stat_result)
+        if jobs == 1:
+            return [hash_function(file_path, stat_result) for file_path, stat_result in zip(file_paths, stat_results)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(hash_function, file_paths, stat_results))
     
     @staticmethod
-    def VerifyPackageImage(package_image_folder):
+    def VerifyPackageImage(package_image_folder, use_hash_cache = True):
         '''Returns True if the folder contains an unpacked, valid package.
             - must contain the package descriptor file
             - must have the content hash file
             - must hash match every file
             - no extra files allowed.
+        use_hash_cache should be cleared for temporary folders, whose hashes are never worth keeping.
         '''
         expected_package_hash_file = os.path.join(package_image_folder, CommonUtils.package_root_hash_file_name)
         expected_package_json_file = os.path.join(package_image_folder, CommonUtils.package_descriptor_name)
@@ -205,30 +378,24 @@ class CommonUtils():
             package_sums = CommonUtils.ParseSHA256SumsFile(expected_package_hash_file)
             # make sure that the files on disk are the expected files:
             expected_files = sorted(package_sums.keys())
-            actual_files = []
-            for root, _, filenames in os.walk(package_image_folder):
-                for name in filenames:
-                    file_abspath = os.path.join(root, name)
-                    relpath_from_folder = str(pathlib.Path(file_abspath).relative_to(package_image_folder).as_posix())
+            actual_files = {} # map of 'relative path' -> (absolute path, lstat result)
+            for relpath_from_folder, file_abspath, stat_result, is_symlink in CommonUtils.WalkPackageImage(package_image_folder):
+                # files may not be read only inside the archive.
+                if not is_symlink and not stat_result.st_mode & stat.S_IWUSR:
+                    print(f"ERROR, Files are read-only in the archive: {relpath_from_folder}")
+                    os.chmod(file_abspath, stat_result.st_mode | stat.S_IWUSR)
 
-                    # files may not be read only inside the archive.
-                    if not os.access(file_abspath, os.W_OK):
-                        print(f"ERROR, Files are read-only in the archive: {relpath_from_folder}")
-                        st = os.stat(file_abspath)
-                        os.chmod(file_abspath, st.st_mode | stat.S_IWUSR)
+                    # we dont bail immediately because we need to actually set all of these
+                    # to be writable by user or else removing the temp dir will fail
+                    found_readonly_files = True
 
-                        # we dont bail immediately because we need to actually set all of these
-                        # to be writable by user or else removing the temp dir will fail
-                        found_readonly_files = True
-                    
-                    if relpath_from_folder != CommonUtils.package_root_hash_file_name: #ignore the SHA256SUMS file itself
-                        actual_files.append(relpath_from_folder)
+                if relpath_from_folder != CommonUtils.package_root_hash_file_name: #ignore the SHA256SUMS file itself
+                    actual_files[relpath_from_folder] = (file_abspath, stat_result)
 
-            actual_files = set(actual_files)
             expected_files = set(expected_files)
             
-            missing_files = expected_files - actual_files
-            unexpected_files = actual_files - expected_files
+            missing_files = expected_files - actual_files.keys()
+            unexpected_files = actual_files.keys() - expected_files
 
             if len(missing_files) > 0:
                 print(f"Files are missing from the package: {missing_files}")
@@ -239,8 +406,8 @@ class CommonUtils():
                 return False
 
             # all files accounted for.  Hash them now
-            for file_to_hash in actual_files:
-                actual_hash = CommonUtils.ComputeHashOfFile(os.path.join(package_image_folder, file_to_hash))
+            for file_to_hash, (file_abspath, stat_result) in actual_files.items():
+                actual_hash = CommonUtils.ComputeHashOfFile(file_abspath, use_hash_cache, stat_result)
                 if actual_hash != package_sums[file_to_hash]:
                     print(f"Hash of file is not correct: {file_to_hash}")
                     return False
@@ -255,6 +422,163 @@ class CommonUtils():
 
         return CommonUtils.ValidatePackageLicense(package_image_folder)
 
+    @staticmethod
+    def _ResolveArchiveMember(relpath, symlink_targets):
+        ''' Follows symlinks inside a package archive (given as 'relative path' -> link target) until
+        relpath names something that is not a symlink.  Returns None if the link leaves the package
+        or is cyclic.
+        '''
+        paths_considered = []
+        while relpath in symlink_targets:
+            link_target = symlink_targets[relpath]
+            if posixpath.isabs(link_target):
+                return None
+            relpath = posixpath.normpath(posixpath.join(posixpath.dirname(relpath), link_target))
+            if relpath.startswith('../') or relpath == '..' or relpath in paths_considered:
+                return None
+            paths_considered.append(relpath)
+        return relpath
+
+    @staticmethod
+    def VerifyPackageArchive(archive_path):
+        '''Returns True if the archive contains a valid package, by the same rules as VerifyPackageImage.
+        The archive is read once, as a stream, hashing every member as it goes by, without extracting
+        anything to disk.
+        '''
+        file_hashes = {} # map of 'relative path' -> sha256sum, for regular files
+        symlink_targets = {} # map of 'relative path' -> where the link points, relative to the link
+        folders = set(['.'])
+        small_file_contents = {} # the SHA256SUMS and package descriptor, kept in memory to be parsed
+        found_readonly_files = False
+        found_invalid_members = False
+
+        try:
+            with tarfile.open(archive_path, mode="r|xz") as archive_file:
+                buf = bytearray(CommonUtils.hash_chunk_size)
+                view = memoryview(buf)
+                for member in archive_file:
+                    relpath = posixpath.normpath(member.name)
+                    if posixpath.isabs(relpath) or relpath == '..' or relpath.startswith('../'):
+                        print(f"ERROR, Archive member is outside of the package: {member.name}")
+                        found_invalid_members = True
+                        continue
+
+                    parent_folder = posixpath.dirname(relpath)
+                    while parent_folder not in folders and parent_folder:
+                        folders.add(parent_folder)
+                        parent_folder = posixpath.dirname(parent_folder)
+
+                    if member.isdir():
+                        folders.add(relpath)
+                        continue
+
+                    if member.issym():
+                        symlink_targets[relpath] = member.linkname
+                        continue
+
+                    # files may not be read only inside the archive.
+                    if not member.mode & stat.S_IWUSR:
+                        print(f"ERROR, Files are read-only in the archive: {relpath}")
+                        found_readonly_files = True
+
+                    if member.islnk():
+                        # a hard link is a second name for a member that came before it
+                        link_target = posixpath.normpath(member.linkname)
+                        if link_target not in file_hashes:
+                            print(f"ERROR, Archive member {relpath} is a hard link to a file that is not in the archive: {member.linkname}")
+                            found_invalid_members = True
+                            continue
+                        file_hashes[relpath] = file_hashes[link_target]
+                        continue
+
+                    if not member.isreg():
+                        print(f"ERROR, Archive member is not a file, folder or link: {relpath}")
+                        found_invalid_members = True
+                        continue
+
+                    keep_contents = relpath in [CommonUtils.package_root_hash_file_name, CommonUtils.package_descriptor_name]
+                    contents = bytearray()
+                    hasher = hashlib.sha256()
+                    with archive_file.extractfile(member) as member_file:
+                        bytes_read = member_file.readinto(buf)
+                        while bytes_read:
+                            hasher.update(view[:bytes_read])
+                            if keep_contents:
+                                contents += view[:bytes_read]
+                            bytes_read = member_file.readinto(buf)
+                    file_hashes[relpath] = hasher.hexdigest()
+                    if keep_contents:
+                        small_file_contents[relpath] = bytes(contents)
+        except (tarfile.TarError, lzma.LZMAError, EOFError) as e:
+            print(f"Package archive {archive_path} could not be read: {e}")
+            return False
+
+        for required_file in [CommonUtils.package_root_hash_file_name, CommonUtils.package_descriptor_name]:
+            if required_file not in small_file_contents:
+                print(f"Package is missing a file: {required_file}")
+                return False
+
+        # symlinks stand for the file they point at, just like they do once extracted.  Symlinks to folders are
+        # not followed, the files in the folder are checked under their own names.
+        for relpath in symlink_targets.keys():
+            resolved_relpath = CommonUtils._ResolveArchiveMember(relpath, symlink_targets)
+            if resolved_relpath in folders:
+                continue
+            if resolved_relpath not in file_hashes:
+                print(f"ERROR, Symlink does not point at a file or folder inside the package: {relpath} -> {symlink_targets[relpath]}")
+                found_invalid_members = True
+                continue
+            file_hashes[relpath] = file_hashes[resolved_relpath]
+
+        try:
+            package_sums = CommonUtils.ParseSHA256Sums(small_file_contents[CommonUtils.package_root_hash_file_name].decode('utf8').splitlines(),
+                                                       f"{archive_path}/{CommonUtils.package_root_hash_file_name}")
+        except InvalidHashFormatException as e:
+            print(f"Hash file parse failed: {e}")
+            return False
+
+        # make sure that the files in the archive are the expected files:
+        actual_files = file_hashes.keys() - set([CommonUtils.package_root_hash_file_name]) #ignore the SHA256SUMS file itself
+        expected_files = set(package_sums.keys())
+
+        missing_files = expected_files - actual_files
+        unexpected_files = actual_files - expected_files
+
+        if len(missing_files) > 0:
+            print(f"Files are missing from the package: {missing_files}")
+            return False
+
+        if len(unexpected_files) > 0:
+            print(f"Unexpected files found in package but not in hash set: {unexpected_files}")
+            return False
+
+        for file_to_check in sorted(actual_files):
+            if file_hashes[file_to_check] != package_sums[file_to_check]:
+                print(f"Hash of file is not correct: {file_to_check}")
+                return False
+
+        if found_readonly_files:
+            print(f"Found read-only files in the archive, this is not ok.")
+            return False
+
+        if found_invalid_members:
+            print(f"Found archive members that would not extract into the package folder, this is not ok.")
+            return False
+
+        try:
+            package_info = CommonUtils.ParsePackageInfo(small_file_contents[CommonUtils.package_descriptor_name].decode('utf8'))
+        except KeyError as e:
+            print(f"Package information was invalid: {e}")
+            return False
+
+        # make sure the stated license file is present:
+        license_relpath = CommonUtils._ResolveArchiveMember(posixpath.normpath(package_info['LicenseFile']), symlink_targets)
+        if license_relpath not in file_hashes and license_relpath not in folders:
+            print(f"License is not found where PackageInfo.json stated: {package_info['LicenseFile']}")
+            return False
+
+        return CommonUtils.ValidatePackageLicenseTag(package_info)
+
     @staticmethod
     def ValidatePackageLicense(unpackaged_package_path):
         '''  Makes sure that the license file is present where the package descriptor says it is.
@@ -274,16 +598,21 @@ class CommonUtils():
         if not os.path.exists(relpath_to_license):
             print(f"License is not found where PackageInfo.json stated: {relpath_to_license}")
             return False
-        
+
+        return CommonUtils.ValidatePackageLicenseTag(package_info)
+
+    @staticmethod
+    def ValidatePackageLicenseTag(package_info):
+        '''  Makes sure that the license named in a package descriptor is a SPDX license, or 'custom'.
+        '''
         # make sure its an actual valid SPDX license tag.
-        licenses = CommonUtils.GetSPDXLicenseList()
+        license_index = CommonUtils.spdx_license_index
         license_is_spdx_compliant = True
         license_is_ok = True
 
-        if licenses:
+        if license_index.GetLicenseList():
             spdx_license_tag = package_info['License']
-            official_license_names = [license['licenseId'] for license in licenses['licenses']]
-            if spdx_license_tag not in official_license_names:
+            if not license_index.IsKnownLicense(spdx_license_tag):
                 license_is_spdx_compliant = False
                 if spdx_license_tag.lower() != 'custom':
                     print(f'    - ERROR: "License" : "{spdx_license_tag}" in PackageInfo.json is not a valid SPDX LicenseId.')
@@ -303,8 +632,9 @@ class CommonUtils():
     @staticmethod
     def FullyValidatePackage(package_folder, package_name):
         '''Given a folder containing a package SHA256SUMS file, JSON file, and all other parts
-        Will actually untar (to temp), test all the contents, and ensure the entire package
+        Will actually read through the archive, test all the contents, and ensure the entire package
         matches requirements/expectations.
+        If validation stamps are enabled, an archive whose exact bytes already passed is only hashed.
         '''
         print(f"    - Validating package: {package_name} in folder {package_folder}....")
         for expected_file in CommonUtils.GetPackageParts(package_name):
@@ -317,7 +647,10 @@ class CommonUtils():
         archive_path        = os.path.join(package_folder, package_name + CommonUtils.package_extension)
         archive_hash_path   = os.path.join(package_folder, package_name + CommonUtils.package_hash_extension)
 
-        hash_result = CommonUtils.ComputeHashOfFile(archive_path)
+        # always re-read the archive itself, validation is meant to catch the bytes on disk changing.
+        with CommonUtils.metrics.Phase(package_name, 'archive_hash') as phase:
+            phase.byte_count = os.path.getsize(archive_path)
+            hash_result = CommonUtils.ComputeHashOfFile(archive_path, use_hash_cache=False)
         
         try:
         # parse the SHA256UMS file:
@@ -338,15 +671,23 @@ class CommonUtils():
             print(f"Hash file parse failed for package: {e}")
             return False
 
-        all_ok = False
-
-        # unzip it to a temp space, and then verify the actual contents
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            with tarfile.open(archive_path) as archive_file:
-                archive_file.extractall(tmpdirname)
-                all_ok = CommonUtils.VerifyPackageImage(tmpdirname)
+        # an archive with these exact bytes may already have passed, under the same rules.
+        validation_stamps = CommonUtils.validation_stamps
+        if validation_stamps:
+            license_list_version = CommonUtils.GetSPDXLicenseListVersion()
+            if validation_stamps.IsValidated(hash_result, CommonUtils.validator_version, license_list_version):
+                print(f"        - This exact archive already passed validation, skipping the contents check.")
+                return True
+
+        # verify the actual contents, straight out of the archive
+        with CommonUtils.metrics.Phase(package_name, 'validate') as phase:
+            phase.byte_count = os.path.getsize(archive_path)
+            if not CommonUtils.VerifyPackageArchive(archive_path):
+                return False
 
-        return all_ok
+        if validation_stamps:
+            validation_stamps.Record(hash_result, CommonUtils.validator_version, license_list_version)
+        return True
 
     @staticmethod
     def IngestPackageList(source_file_path, source_root_path, target_dictionary):
@@ -358,11 +699,14 @@ class CommonUtils():
         Results in a target dictionary being populated with two keys, 
         target_dictionary['build_from_source'] = map[packagename] -> folder path containing build script
         target_dictionary['build_from_folder'] = map[packagename] -> folder path containing built package image
+        target_dictionary['build_dependencies'] = map[packagename] -> names of packages whose build scripts must run before its own
         '''
         if not 'build_from_source' in target_dictionary:
             target_dictionary['build_from_source'] = {}
         if not 'build_from_folder' in target_dictionary:
             target_dictionary['build_from_folder'] = {}
+        if not 'build_dependencies' in target_dictionary:
+            target_dictionary['build_dependencies'] = {}
 
         if not os.path.exists(source_file_path):
             return
@@ -394,6 +738,10 @@ class CommonUtils():
                     package_folder = os.path.normpath(package_folder)
                 target_dictionary['build_from_folder'][package_name] = package_folder
 
+        if 'build_dependencies' in data:
+            for package_name in data['build_dependencies'].keys():
+                target_dictionary['build_dependencies'][package_name] = list(data['build_dependencies'][package_name])
+
     @staticmethod
     def LoadPackageLists(folder, platform_override = None):
         '''Reads a series of package list files from the given set of folders.
@@ -421,7 +769,8 @@ class CommonUtils():
         print("   Packages to build from source:")
         for package_name in data['build_from_source'].keys():
             package_folder = data['build_from_source'][package_name]
-            print(f"        '{package_name}' in '{package_folder}'")
+            build_dependencies = data.get('build_dependencies', {}).get(package_name)
+            print(f"        '{package_name}' in '{package_folder}'" + (f" after {build_dependencies}" if build_dependencies else ''))
 
         print("   Packages to build from folders (after building from source):")
         for package_name in data['build_from_folder'].keys():
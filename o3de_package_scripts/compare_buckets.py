@@ -5,7 +5,6 @@
 #
 #
 
-import boto3
 import argparse
 import sys
 import functools
@@ -23,21 +22,7 @@ def GetAllPackagesInBucket(aws_profile_name, bucket_name):
     ''' given a server URL (s3 bucket)
         Returns contents of the server.
         '''
-    # make sure a package with that name is not already present:
-    packages_found = []
-    session =  boto3.session.Session(profile_name=aws_profile_name)
-    package_descriptor_extension = '.' + CommonUtils.package_descriptor_name
-    package_descriptor_extension_length = len(package_descriptor_extension)
-
-    paginator = session.client('s3').get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=bucket_name):
-        contents = page["Contents"]
-        for obj in contents:
-            key = obj["Key"]
-            if (key.endswith(package_descriptor_extension)):
-                packages_found.append(key[:-package_descriptor_extension_length])
-
-    return packages_found
+    return sorted(FindPackageUtils.GetBucketInventory(bucket_name, aws_profile_name).GetPackageNames())
 
 def CompareBuckets(aws_profile_name, package_list_data, bucket1, bucket2):
     packages_in_bucket1 = GetAllPackagesInBucket(aws_profile_name, bucket1)
@@ -93,6 +78,7 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     CommonUtils.PostArgParse(args)
+    FindPackageUtils.EnableInventorySnapshots(args.output_folder)
 
     if not args.bucket1 or not args.bucket2:
         print("Missing bucket arguments - need exactly 2 buckets")
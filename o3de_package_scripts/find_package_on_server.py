@@ -6,13 +6,77 @@
 #
 
 import os
+import sys
+import json
+import time
+import argparse
 import urllib
-import urllib.request
-import ssl
-import certifi
+import urllib.error
+import http.client
 import tempfile
+import threading
+import collections
+import concurrent.futures
 import boto3
 from common import CommonUtils
+from http_pool import HTTPConnectionPool
+from bucket_inventory import BucketInventory
+
+class ServerLatencyStats():
+    ''' How long lookups on each package server host took, and how many of them failed, over the run.
+    A host whose lookups are slow, or mostly fail, is slow.  All methods are safe to call from multiple threads.
+    '''
+    # weight of the latest lookup in the moving average of a host's lookup times
+    smoothing = 0.3
+
+    def __init__(self, slow_seconds):
+        self.slow_seconds = slow_seconds
+        self.hosts = collections.OrderedDict() # map of host -> {lookups, failures, seconds, max_seconds, average_seconds}
+        self.lock = threading.Lock()
+
+    def _GetHost(self, host):
+        # must be called with the lock held.
+        return self.hosts.setdefault(host, {'lookups': 0, 'failures': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'average_seconds': None})
+
+    def _IsSlow(self, host_stats):
+        # must be called with the lock held.
+        if host_stats['lookups'] and host_stats['failures'] * 2 > host_stats['lookups']:
+            return True
+        return host_stats['average_seconds'] is not None and host_stats['average_seconds'] > self.slow_seconds
+
+    def Record(self, host, seconds):
+        with self.lock:
+            host_stats = self._GetHost(host)
+            was_slow = self._IsSlow(host_stats)
+            host_stats['lookups'] += 1
+            host_stats['seconds'] += seconds
+            host_stats['max_seconds'] = max(host_stats['max_seconds'], seconds)
+            if host_stats['average_seconds'] is None:
+                host_stats['average_seconds'] = seconds
+            else:
+                host_stats['average_seconds'] += ServerLatencyStats.smoothing * (seconds - host_stats['average_seconds'])
+            became_slow = not was_slow and self._IsSlow(host_stats)
+            average_seconds = host_stats['average_seconds']
+        if became_slow:
+            print(f"    - Server '{host}' is slow to answer, hedged lookups will ask it last from now on")
+            CommonUtils.metrics.Emit('server_deprioritized', host=host, average_seconds=average_seconds)
+
+    def RecordFailure(self, host):
+        with self.lock:
+            self._GetHost(host)['failures'] += 1
+
+    def IsSlow(self, host):
+        with self.lock:
+            return host in self.hosts and self._IsSlow(self.hosts[host])
+
+    def GetSummary(self):
+        ''' Returns a single line with the lookup times of every host, or the empty string if nothing was looked up '''
+        with self.lock:
+            host_summaries = [f"{host} {host_stats['lookups']} in {host_stats['seconds'] / host_stats['lookups']:.3f}s avg, {host_stats['max_seconds']:.3f}s max"
+                              + (f", {host_stats['failures']} failed" if host_stats['failures'] else '')
+                              + (' (slow)' if self._IsSlow(host_stats) else '')
+                              for host, host_stats in self.hosts.items() if host_stats['lookups']]
+        return ('Server lookups: ' + ' | '.join(host_summaries)) if host_summaries else ''
 
 class FindPackageUtils():
     # built in defaults:
@@ -29,6 +93,176 @@ class FindPackageUtils():
     if not aws_profile_name: 
         aws_profile_name = None # this will turn '' into None
 
+    # seconds to wait for a package server to connect or answer a lookup
+    lookup_timeout = float(os.environ.get("PACKAGE_lookup_timeout", default = 10))
+    # number of packages FindPackagesOnServers looks for at the same time
+    lookup_jobs = int(os.environ.get("PACKAGE_lookup_jobs", default = 16))
+    # number of lookups sent to any one server at the same time
+    per_host_lookup_jobs = int(os.environ.get("PACKAGE_per_host_lookup_jobs", default = 8))
+    per_host_semaphores = collections.defaultdict(lambda: threading.BoundedSemaphore(FindPackageUtils.per_host_lookup_jobs))
+    per_host_semaphores_lock = threading.Lock()
+    # 'sequential' asks the servers one after the other, 'hedged' asks them at the same time, see FindPackageOnServer
+    lookup_modes = ['sequential', 'hedged']
+    lookup_mode = os.environ.get("PACKAGE_lookup_mode", default = 'sequential')
+    # in hedged mode, seconds to wait for an answer before asking the next server as well.  0 asks them all at once.
+    hedge_delay = float(os.environ.get("PACKAGE_hedge_delay", default = 0.2))
+    # a server whose lookups take longer than this on average is asked last, for the rest of the run, in hedged mode
+    slow_server_seconds = float(os.environ.get("PACKAGE_slow_server_seconds", default = 2))
+    server_stats = ServerLatencyStats(slow_server_seconds)
+    # runs the lookups of hedged mode
+    hedge_executor = None
+    hedge_executor_lock = threading.Lock()
+    # keep-alive connections to the http(s) package servers, shared by every lookup
+    http_pool = None
+    http_pool_lock = threading.Lock()
+    # inventories of the s3 buckets looked at so far, by (aws profile, bucket name)
+    bucket_inventories = {}
+    bucket_inventories_lock = threading.Lock()
+    # where bucket inventory snapshots are kept, if anywhere, see EnableInventorySnapshots
+    inventory_snapshot_folder = None
+
+    @staticmethod
+    def EnableInventorySnapshots(output_folder):
+        ''' Keeps a snapshot of the inventory of every bucket listed in the output folder, for later runs to reuse '''
+        FindPackageUtils.inventory_snapshot_folder = output_folder
+
+    @staticmethod
+    def GetBucketInventory(bucket_name, aws_profile_name, session = None):
+        ''' Returns the BucketInventory of bucket_name, which is only listed once per run '''
+        with FindPackageUtils.bucket_inventories_lock:
+            inventory_key = (aws_profile_name, bucket_name)
+            if inventory_key not in FindPackageUtils.bucket_inventories:
+                session = session or boto3.session.Session(profile_name=aws_profile_name)
+                snapshot_path = BucketInventory.GetSnapshotPath(FindPackageUtils.inventory_snapshot_folder, bucket_name) if FindPackageUtils.inventory_snapshot_folder else None
+                FindPackageUtils.bucket_inventories[inventory_key] = BucketInventory(session, bucket_name, snapshot_path)
+            return FindPackageUtils.bucket_inventories[inventory_key]
+
+    @staticmethod
+    def GetHTTPPool():
+        with FindPackageUtils.http_pool_lock:
+            if not FindPackageUtils.http_pool:
+                FindPackageUtils.http_pool = HTTPConnectionPool(FindPackageUtils.lookup_timeout)
+            return FindPackageUtils.http_pool
+
+    @staticmethod
+    def IsPackageOnHTTPServer(package_metadata_url):
+        ''' Returns True if the http(s) server has the file at package_metadata_url.  A server that
+        cannot be reached counts as not having it, like a 404 does.
+        '''
+        try:
+            return FindPackageUtils.GetHTTPPool().Exists(package_metadata_url)
+        except (OSError, http.client.HTTPException) as e:
+            print(f"    - Could not reach {package_metadata_url}: {e}")
+            FindPackageUtils.server_stats.RecordFailure(FindPackageUtils._GetHost(package_metadata_url))
+            return False
+
+    @staticmethod
+    def _GetHost(package_server):
+        return package_server.split('://', 1)[-1].split('/', 1)[0]
+
+    @staticmethod
+    def _GetHostSemaphore(package_server):
+        ''' Returns the semaphore that limits how many lookups go to the host of package_server at the same time '''
+        with FindPackageUtils.per_host_semaphores_lock:
+            return FindPackageUtils.per_host_semaphores[FindPackageUtils._GetHost(package_server)]
+
+    @staticmethod
+    def _GetHedgeExecutor():
+        with FindPackageUtils.hedge_executor_lock:
+            if not FindPackageUtils.hedge_executor:
+                FindPackageUtils.hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, FindPackageUtils.lookup_jobs) * 4, thread_name_prefix='lookup')
+            return FindPackageUtils.hedge_executor
+
+    @staticmethod
+    def FindPackagesOnServers(package_names, server_urls, aws_profile_name, jobs = None):
+        ''' The same as FindPackageOnServer, for many packages at once.  Looks for up to jobs packages at the same time
+        (defaults to lookup_jobs), sending no more than per_host_lookup_jobs lookups to any one server at a time.
+        Each package is still looked for on the servers in the order given, and the first one that has it wins.
+        Returns a map of package name -> the server it was found at, or the empty string.
+        '''
+        package_names = list(dict.fromkeys(package_names)) # each only once, in order
+        jobs = max(1, jobs or FindPackageUtils.lookup_jobs)
+        print(f"Looking for {len(package_names)} packages on the server(s), {jobs} at a time...")
+        def FindPackageOnServer(package_name):
+            with CommonUtils.metrics.Phase(package_name, 'lookup'):
+                return FindPackageUtils.FindPackageOnServer(package_name, server_urls, aws_profile_name)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            lookups = [executor.submit(FindPackageOnServer, package_name) for package_name in package_names]
+            found_on_server = {package_name: lookup.result() or '' for package_name, lookup in zip(package_names, lookups)}
+        server_summary = FindPackageUtils.server_stats.GetSummary()
+        if server_summary:
+            print(server_summary)
+        return found_on_server
+
+    @staticmethod
+    def _LookupOnServer(package_name, package_server, aws_profile_name):
+        ''' Returns the url of the package on package_server, or the empty string if it is not there '''
+        print(f"    - Searching for package '{package_name}' on server '{package_server}'...")
+        CommonUtils.metrics.Emit('lookup_started', package=package_name, server=package_server)
+        package_metadata_url = package_server + "/" + package_name + CommonUtils.package_content_hash_extension
+        found = False
+        with FindPackageUtils._GetHostSemaphore(package_server):
+            start_time = time.perf_counter()
+            try:
+                if package_server.startswith("s3://"):
+                    # its an s3 url, we'll use boto to fetch
+                    # s3 urls are s3://bucket-name/key-name
+                    bucket_name = package_server[len("s3://"):]
+                    slash_pos = bucket_name.find('/')
+                    if slash_pos != -1:
+                        bucket_name = bucket_name[:slash_pos]
+
+                    if FindPackageUtils.GetBucketInventory(bucket_name, aws_profile_name).Contains(package_name):
+                        print(f"    - Package '{package_name}' is in bucket '{bucket_name}'")
+                        found = True
+                elif FindPackageUtils.IsPackageOnHTTPServer(package_metadata_url):
+                    found = True
+            except urllib.error.URLError:
+                pass
+            FindPackageUtils.server_stats.Record(FindPackageUtils._GetHost(package_server), time.perf_counter() - start_time)
+        return package_metadata_url if found else ''
+
+    @staticmethod
+    def _LookupOnServersHedged(package_name, server_list, aws_profile_name):
+        ''' Asks the servers for the package at the same time, starting with the first and asking each next one
+        hedge_delay seconds later, or as soon as all the ones before it have said no.  Slow servers are asked last,
+        and lose their priority.  Returns the url on the first server, in that order, that has the package, as soon as
+        every server before it has said no, or the empty string.
+        '''
+        # sorting is stable, so the servers keep their order otherwise
+        server_list = sorted(server_list, key=lambda package_server: FindPackageUtils.server_stats.IsSlow(FindPackageUtils._GetHost(package_server)))
+        executor = FindPackageUtils._GetHedgeExecutor()
+        lookups = []
+        def AskNextServer():
+            lookups.append(executor.submit(FindPackageUtils._LookupOnServer, package_name, server_list[len(lookups)], aws_profile_name))
+        try:
+            while True:
+                # the first server, in order, that has not said no yet decides
+                for lookup in lookups:
+                    if not lookup.done():
+                        break
+                    if lookup.result():
+                        return lookup.result()
+                else:
+                    if len(lookups) == len(server_list):
+                        return '' # every server said no
+                    AskNextServer() # every server asked so far said no
+                    continue
+                found_index = next((index for index, lookup in enumerate(lookups) if lookup.done() and lookup.result()), None)
+                if found_index is not None or len(lookups) == len(server_list):
+                    # a later server has it, or there is no one left to ask, so only the servers still asking before it matter
+                    pending = [lookup for lookup in lookups[:found_index] if not lookup.done()]
+                    concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    continue
+                pending = [lookup for lookup in lookups if not lookup.done()]
+                done, _ = concurrent.futures.wait(pending, timeout=FindPackageUtils.hedge_delay, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    AskNextServer() # no answer in time, hedge with the next server
+        finally:
+            # lookups that have not started yet are not needed anymore.  Ones already running finish on their own.
+            for lookup in lookups:
+                lookup.cancel()
+
     @staticmethod
     def FindPackageOnServer(package_name, server_urls, aws_profile_name):
         ''' given a public server URL list (semicolon-seperated), 
@@ -37,52 +271,48 @@ class FindPackageUtils():
             side and thus will also check buckets if s3:// urls are given
             and will stop at the first one it finds.
 
+            In hedged mode (lookup_mode), the servers are asked at the same time instead of one after the other,
+            see _LookupOnServersHedged.  Only hedged mode asks servers that have been slow so far in the run
+            (see ServerLatencyStats) last, sequential mode always keeps the order given.
+
             Returns the server it was found at, or the empty string.
          '''
         # make sure a package with that name is not already present:
         if not server_urls:
             print(f"Server url list is empty - will always build all packages.  Consider setting server_urls")
-        package_found_on_servers = []
-        session = None
-        server_list = server_urls.split(';')
-        for package_server in server_list:
-            if not package_server:
-                continue
-            print(f"    - Searching for package '{package_name}' on server '{package_server}'...")
-            package_metadata_url = package_server + "/" + package_name + CommonUtils.package_content_hash_extension
-            try:
-                if package_server.startswith("s3://"):
-                    # its an s3 url, we'll use boto to fetch
-                    # s3 urls are s3://bucket-name/key-name
-                    if not session:
-                        session = boto3.session.Session(profile_name=aws_profile_name)
-
-                    bucket_name = package_server[len("s3://"):]
-                    slash_pos = bucket_name.find('/')
-                    if slash_pos != -1:
-                        bucket_name = bucket_name[:slash_pos]
-                    
-                    if FindPackageUtils.IsPackageAlreadyInS3Bucket(package_name, session, bucket_name):
-                        package_found_on_servers.append(package_metadata_url)
-                else:
-                    context = ssl.create_default_context(cafile=certifi.where())
-                    with urllib.request.urlopen(package_metadata_url, context=context):
-                        # it will throw a URLError (below) if the server does not have it
-                        # so if we get here, we have found it.
-                        package_found_on_servers.append(package_metadata_url)
-            except urllib.error.URLError:
-                pass
-            
-            if package_found_on_servers:
-                break
+        server_list = [package_server for package_server in server_urls.split(';') if package_server]
+        found_at = ''
+        if FindPackageUtils.lookup_mode == 'hedged' and len(server_list) > 1:
+            found_at = FindPackageUtils._LookupOnServersHedged(package_name, server_list, aws_profile_name)
+        else:
+            for package_server in server_list:
+                found_at = FindPackageUtils._LookupOnServer(package_name, package_server, aws_profile_name)
+                if found_at:
+                    break
 
-        return ";".join(package_found_on_servers)
+        if found_at:
+            CommonUtils.metrics.Emit('lookup_hit', package=package_name, url=found_at)
+        else:
+            CommonUtils.metrics.Emit('lookup_miss', package=package_name)
+        return found_at
 
     @staticmethod
     def IsPackageAlreadyInS3Bucket(package_name, session, bucket_name):
-        ''' given a Boto3 session, make sure the package is not there.  Note that we always assume
-        that the final file uploaded is the packagename + . + package_descriptor_name so its the marker! '''
-        paginator = session.client('s3').get_paginator('list_objects_v2')
+        ''' given a Boto3 session, make sure the package is not there, going by the inventory of the bucket.
+        Note that we always assume that the final file uploaded is the packagename + . + package_descriptor_name so its the marker!
+        '''
+        if FindPackageUtils.GetBucketInventory(bucket_name, session.profile_name, session).Contains(package_name):
+            print(f"    - Package '{package_name}' is in bucket '{bucket_name}'")
+            return True
+        return False
+
+    @staticmethod
+    def IsPackageInS3BucketNow(package_name, session, bucket_name, s3_client = None):
+        ''' Same as IsPackageAlreadyInS3Bucket, but asks S3 directly instead of going by the inventory,
+        which may be older than an upload someone else just made.  Pass s3_client to ask through
+        it rather than a new client, for example from several threads, which must not share a session.
+        '''
+        paginator = (s3_client or session.client('s3')).get_paginator('list_objects_v2')
     
         for page in paginator.paginate(Bucket=bucket_name, Prefix=package_name + '.' + CommonUtils.package_descriptor_name):
             try:
@@ -108,5 +338,84 @@ class FindPackageUtils():
         argparser.add_argument('-b', '--bucket_name',
                 action='store', default = FindPackageUtils.bucket_name, 
                 help='(optional) The S3 Bucket where packages live.  You can also use env var PACKAGE_bucket_name')
+        argparser.add_argument('--lookup_jobs', type=int, action='store', default=FindPackageUtils.lookup_jobs,
+                help='(optional) Number of packages to look for on the servers at the same time.  You can also use env var PACKAGE_lookup_jobs')
+        argparser.add_argument('--per_host_lookup_jobs', type=int, action='store', default=FindPackageUtils.per_host_lookup_jobs,
+                help='(optional) Number of lookups to send to any one server at the same time.  You can also use env var PACKAGE_per_host_lookup_jobs')
+        argparser.add_argument('--lookup_timeout', type=float,
+                action='store', default = FindPackageUtils.lookup_timeout,
+                help='(optional) Seconds to wait for a package server to answer before counting the package as not there.  You can also use env var PACKAGE_lookup_timeout')
+        argparser.add_argument('--lookup_mode', choices=FindPackageUtils.lookup_modes,
+                action='store', default = FindPackageUtils.lookup_mode,
+                help='(optional) sequential asks the servers one after the other.  hedged asks them at the same time, and takes the first one in order that has the package, asking slow servers last.  You can also use env var PACKAGE_lookup_mode')
+        argparser.add_argument('--hedge_delay', type=float,
+                action='store', default = FindPackageUtils.hedge_delay,
+                help='(optional) In hedged mode, seconds to wait for a server to answer before also asking the next one.  0 asks them all at once.  You can also use env var PACKAGE_hedge_delay')
+        argparser.add_argument('--slow_server_seconds', type=float,
+                action='store', default = FindPackageUtils.slow_server_seconds,
+                help='(optional) In hedged mode, servers whose lookups take longer than this on average are asked last for the rest of the run.  You can also use env var PACKAGE_slow_server_seconds')
+
+    @staticmethod
+    def PostServerArgParse(args):
+        ''' Applies the server args that change how lookups are made '''
+        FindPackageUtils.lookup_timeout = args.lookup_timeout
+        FindPackageUtils.lookup_jobs = args.lookup_jobs
+        FindPackageUtils.per_host_lookup_jobs = args.per_host_lookup_jobs
+        FindPackageUtils.lookup_mode = args.lookup_mode
+        FindPackageUtils.hedge_delay = max(0.0, args.hedge_delay)
+        FindPackageUtils.server_stats.slow_seconds = args.slow_server_seconds
+        if getattr(args, 'output_folder', None):
+            FindPackageUtils.EnableInventorySnapshots(args.output_folder)
+
+
+
+def ReadPackageNames(package_list_file):
+    ''' Returns the package names in a file, one per line, leaving out blank lines and # comments '''
+    package_names = []
+    for line in package_list_file:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            package_names.append(line)
+    return package_names
+
+"""A CLI utility to find out which of a list of packages are already on the package servers."""
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Looks for packages on the package servers, many at a time, and prints where each one was found.  Exits with 1 if any were not found.')
+    FindPackageUtils.AddServerArgs(parser)
+    CommonUtils.AddEventsArg(parser)
+    parser.add_argument('-o', '--output_folder', action='store', default=None,
+                        help='(optional) Keep the inventories of the s3 buckets looked at in this folder, for later runs to reuse, see PACKAGE_inventory_max_age')
+    parser.add_argument('package_names', nargs='*', help='Names of the packages to look for')
+    parser.add_argument('--package_list', action='store', default=None, metavar='FILE',
+                        help='Also look for the packages named in FILE, one per line.  Use - to read them from stdin')
+    parser.add_argument('--json', action='store', default=None, metavar='FILE',
+                        help='Also write the results to FILE, as a JSON map of package name to the url it was found at, or the empty string')
+    parser.epilog = 'Note: You can set environment variables in the form\nPACKAGE_<paramname>\n to pass from env instead of command line'
+    args = parser.parse_args()
+    if args.events:
+        CommonUtils.EnableEvents(args.events)
+    FindPackageUtils.PostServerArgParse(args)
+
+    package_names = list(args.package_names)
+    if args.package_list == '-':
+        package_names += ReadPackageNames(sys.stdin)
+    elif args.package_list:
+        with open(args.package_list, encoding='utf8') as package_list_file:
+            package_names += ReadPackageNames(package_list_file)
+    if not package_names:
+        print("No package names given, pass them on the command line or with --package_list")
+        sys.exit(1)
+
+    found_on_server = FindPackageUtils.FindPackagesOnServers(package_names, args.server_urls, args.profile_name, args.lookup_jobs)
+
+    name_width = max([len('PACKAGE')] + [len(package_name) for package_name in found_on_server.keys()])
+    print(f"| {'PACKAGE':<{name_width}} | FOUND AT")
+    print(f"|-{'-' * name_width}-|---------")
+    for package_name, found in found_on_server.items():
+        print(f"| {package_name:<{name_width}} | {found or 'NOT FOUND'}")
 
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as json_file:
+            json.dump(found_on_server, json_file, indent=4)
 
+    sys.exit(0 if all(found_on_server.values()) else 1)
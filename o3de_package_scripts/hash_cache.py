@@ -0,0 +1,185 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import sys
+import argparse
+import json
+import random
+import threading
+import time
+
+"""This module implements a persistent cache of file content hashes, so that re-packing or re-verifying
+an unchanged package image only costs a stat call per file instead of re-reading every byte.
+
+Entries are keyed on the absolute path of the file and are only trusted while the file's size,
+modification time (in nanoseconds) and inode all still match what was recorded when it was hashed.
+
+Can also be run from the command line to inspect, verify, prune or clear the cache.
+"""
+
+class HashCache():
+    ''' An on-disk cache of { absolute path : (size, mtime_ns, inode, sha256) } stored as JSON lines.
+    All methods are safe to call from multiple threads.
+    '''
+    cache_folder_name = '.cache'
+    cache_file_name = 'hash_cache.jsonl'
+
+    # files modified less than this long before they were hashed are not cached, since
+    # a second write landing in the same timestamp tick would not change their mtime.
+    racy_window_ns = 2 * 1000 * 1000 * 1000
+
+    def __init__(self, cache_file_path):
+        self.cache_file_path = cache_file_path
+        self.entries = None # loaded lazily on first use
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def GetCacheFilePath(output_folder):
+        return os.path.join(output_folder, HashCache.cache_folder_name, HashCache.cache_file_name)
+
+    @staticmethod
+    def MakeKey(stat_result):
+        return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+    def _EnsureLoaded(self):
+        # must be called with the lock held.
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not os.path.exists(self.cache_file_path):
+            return
+        with open(self.cache_file_path, encoding='utf8') as cache_file:
+            for line in cache_file:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['path']] = ((entry['size'], entry['mtime_ns'], entry['inode']), entry['sha256'])
+                except (ValueError, KeyError):
+                    # a partially written or hand-edited line, just re-hash that file next time.
+                    self.dirty = True
+
+    def EntryCount(self):
+        with self.lock:
+            self._EnsureLoaded()
+            return len(self.entries)
+
+    def Lookup(self, file_path, stat_result):
+        ''' Returns the cached hash for file_path if its stat_result still matches, otherwise None '''
+        with self.lock:
+            self._EnsureLoaded()
+            entry = self.entries.get(file_path)
+            if entry and entry[0] == HashCache.MakeKey(stat_result):
+                return entry[1]
+        return None
+
+    def Store(self, file_path, stat_result, hash_result, hashed_at_ns = None):
+        ''' Records hash_result for file_path.  stat_result must be taken before the file was hashed. '''
+        hashed_at_ns = hashed_at_ns or time.time_ns()
+        if hashed_at_ns - stat_result.st_mtime_ns < HashCache.racy_window_ns:
+            return
+        with self.lock:
+            self._EnsureLoaded()
+            self.entries[file_path] = (HashCache.MakeKey(stat_result), hash_result)
+            self.dirty = True
+
+    def Evict(self, file_path):
+        with self.lock:
+            self._EnsureLoaded()
+            if self.entries.pop(file_path, None):
+                self.dirty = True
+
+    def PruneStaleEntries(self):
+        ''' Drops every entry whose file no longer exists or no longer matches its recorded stat.
+        Returns the number of entries removed.'''
+        with self.lock:
+            self._EnsureLoaded()
+            stale_paths = []
+            for file_path, (key, _) in self.entries.items():
+                try:
+                    if HashCache.MakeKey(os.stat(file_path)) != key:
+                        stale_paths.append(file_path)
+                except OSError:
+                    stale_paths.append(file_path)
+            for file_path in stale_paths:
+                del self.entries[file_path]
+            if stale_paths:
+                self.dirty = True
+            return len(stale_paths)
+
+    def Verify(self, sample_size, hash_function):
+        ''' Re-hashes a random sample of up-to-date entries with hash_function(path) and evicts any
+        entry whose hash no longer matches.  Returns the list of paths that did not match.'''
+        with self.lock:
+            self._EnsureLoaded()
+            candidates = list(self.entries.keys())
+        mismatched_paths = []
+        for file_path in random.sample(candidates, min(sample_size, len(candidates))):
+            with self.lock:
+                key, cached_hash = self.entries[file_path]
+            try:
+                if HashCache.MakeKey(os.stat(file_path)) != key:
+                    continue # stale, not wrong.  Pruning will take care of it.
+                actual_hash = hash_function(file_path)
+            except OSError:
+                continue
+            if actual_hash != cached_hash:
+                mismatched_paths.append(file_path)
+                self.Evict(file_path)
+        return mismatched_paths
+
+    def Clear(self):
+        with self.lock:
+            self.entries = {}
+            self.dirty = True
+
+    def Save(self):
+        ''' Prunes stale entries and writes the cache back to disk, if anything changed.'''
+        if not self.dirty:
+            return
+        self.PruneStaleEntries()
+        with self.lock:
+            os.makedirs(os.path.dirname(self.cache_file_path), exist_ok=True)
+            # a temp file of its own, since other processes may be saving the same cache at the same time
+            temp_file_path = f'{self.cache_file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_file_path, 'w', encoding='utf8') as cache_file:
+                for file_path, (key, hash_result) in self.entries.items():
+                    size, mtime_ns, inode = key
+                    cache_file.write(json.dumps({'path': file_path, 'size': size, 'mtime_ns': mtime_ns, 'inode': inode, 'sha256': hash_result}) + '\n')
+            os.replace(temp_file_path, self.cache_file_path)
+            self.dirty = False
+
+if __name__ == "__main__":
+    from common import CommonUtils
+
+    parser = argparse.ArgumentParser(description='Inspects and maintains the persistent content hash cache kept in the output folder')
+    CommonUtils.AddCommonArgs(parser)
+    parser.add_argument('--verify', type=int, default=0, metavar='N', help='Re-hash N randomly chosen cache entries and evict any that do not match')
+    parser.add_argument('--prune', action='store_true', help='Remove entries for files that were deleted or changed')
+    parser.add_argument('--clear', action='store_true', help='Remove every entry from the cache')
+    args = parser.parse_args()
+    CommonUtils.PostArgParse(args)
+
+    hash_cache = CommonUtils.hash_cache or HashCache(HashCache.GetCacheFilePath(args.output_folder))
+    print(f"Hash cache '{hash_cache.cache_file_path}' has {hash_cache.EntryCount()} entries")
+
+    if args.clear:
+        hash_cache.Clear()
+        print("    - Cleared")
+
+    if args.prune:
+        print(f"    - Pruned {hash_cache.PruneStaleEntries()} stale entries")
+
+    mismatched_paths = []
+    if args.verify:
+        mismatched_paths = hash_cache.Verify(args.verify, lambda file_path: CommonUtils.ComputeHashOfFile(file_path, use_hash_cache=False))
+        for file_path in mismatched_paths:
+            print(f"    - ERROR: cached hash was wrong for {file_path}, evicted it")
+        print(f"    - Verified {args.verify} entries, {len(mismatched_paths)} mismatched")
+
+    hash_cache.Save()
+    sys.exit(1 if mismatched_paths else 0)
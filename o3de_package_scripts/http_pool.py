@@ -0,0 +1,119 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import sys
+import ssl
+import certifi
+import threading
+import collections
+import http.client
+import urllib.parse
+import urllib.request
+import urllib.error
+
+"""This module implements a small pool of keep-alive HTTP(S) connections, for asking package servers
+whether they have a file without downloading it.
+
+Every connection shares one SSL context, so the CA bundle is only parsed once, and connections are
+kept open between requests, so each host only costs one TCP connection and TLS handshake per thread
+that talks to it at the same time.  Servers reached through a proxy (the usual http_proxy / https_proxy
+environment variables) go through urllib instead, which knows how to talk to proxies.
+"""
+
+class HTTPConnectionPool():
+    ''' Keep-alive connections to HTTP(S) servers, reused across requests.  All methods are safe to call from multiple threads. '''
+    max_redirects = 5
+    redirect_statuses = [301, 302, 303, 307, 308]
+    # servers that do not support HEAD are asked with GET instead
+    head_not_supported_statuses = [405, 501]
+    user_agent = f'Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}'
+
+    def __init__(self, timeout, max_idle_connections_per_host = 16):
+        self.timeout = timeout
+        self.max_idle_connections_per_host = max_idle_connections_per_host
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.idle_connections = collections.defaultdict(list) # map of (scheme, host, port) -> connections not in use
+        self.connections_opened = 0
+        self.lock = threading.Lock()
+
+    def _GetConnection(self, host_key):
+        ''' Returns (connection, whether it was used before) '''
+        with self.lock:
+            if self.idle_connections[host_key]:
+                return self.idle_connections[host_key].pop(), True
+            self.connections_opened += 1
+        scheme, host, port = host_key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _ReturnConnection(self, host_key, connection):
+        with self.lock:
+            if len(self.idle_connections[host_key]) < self.max_idle_connections_per_host:
+                self.idle_connections[host_key].append(connection)
+                return
+        connection.close()
+
+    def _RequestThroughProxy(self, method, url):
+        request = urllib.request.Request(url, method=method, headers={'User-Agent': HTTPConnectionPool.user_agent})
+        try:
+            with urllib.request.urlopen(request, context=self.ssl_context, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _RequestOnce(self, method, url):
+        ''' Returns (status, location header) of a single request, without following redirects '''
+        url_parts = urllib.parse.urlsplit(url)
+        proxies = urllib.request.getproxies()
+        if url_parts.scheme in proxies and not urllib.request.proxy_bypass(url_parts.hostname):
+            return self._RequestThroughProxy(method, url), None
+
+        host_key = (url_parts.scheme, url_parts.hostname, url_parts.port)
+        path = (url_parts.path or '/') + ('?' + url_parts.query if url_parts.query else '')
+        while True:
+            connection, reused = self._GetConnection(host_key)
+            try:
+                connection.request(method, path, headers={'User-Agent': HTTPConnectionPool.user_agent})
+                response = connection.getresponse()
+                response.read() # the connection can only be reused once the body is consumed.  HEAD has none.
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if reused:
+                    continue # the server closed it while it sat idle, try again on another one
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._ReturnConnection(host_key, connection)
+            return response.status, response.getheader('Location')
+
+    def Request(self, method, url):
+        ''' Sends a request, following redirects, and returns the final status.
+        Raises OSError or http.client.HTTPException if the server cannot be reached.
+        '''
+        for _ in range(HTTPConnectionPool.max_redirects + 1):
+            status, location = self._RequestOnce(method, url)
+            if status not in HTTPConnectionPool.redirect_statuses or not location:
+                return status
+            url = urllib.parse.urljoin(url, location)
+        raise http.client.HTTPException(f'Too many redirects for {url}')
+
+    def Exists(self, url):
+        ''' Returns True if the server has the file at url, asking with HEAD first so that nothing is downloaded '''
+        status = self.Request('HEAD', url)
+        if status in HTTPConnectionPool.head_not_supported_statuses:
+            status = self.Request('GET', url)
+        return 200 <= status < 300
+
+    def Close(self):
+        with self.lock:
+            idle_connections = [connection for connections in self.idle_connections.values() for connection in connections]
+            self.idle_connections.clear()
+        for connection in idle_connections:
+            connection.close()
@@ -7,14 +7,21 @@
 
 import os
 import tarfile
-import pathlib
 import argparse
 import lzma
 import stat
 import shutil
-from glob import glob
+import contextlib
+import hashlib
+import time
+import json
+import sys
+import multiprocessing
+import concurrent.futures
+import random
 
-from common import CommonUtils
+from common import CommonUtils, InvalidHashFormatException
+from parallel_xz import ParallelXZWriter
 
 # this module will pack up a folder given a folder name, essentially a zip file creator
 # and validator.
@@ -22,14 +29,336 @@ from common import CommonUtils
 
 _archive_buffer_size = 1024 * 1024 * 10 # 10mb buffer
 
+# named xz presets.  'release' is what packages meant for upload must be packed with, the others
+# trade archive size for speed while iterating locally.
+compression_profiles = {
+    'fast'    : 1,
+    'default' : 6,
+    # using LZMA yields overall best compression for packages tested:
+    'release' : lzma.PRESET_EXTREME|9,
+}
+default_compression = os.environ.get("PACKAGE_compression", default = 'release')
+
+# number of threads to compress the archive with.  1 produces the classic single-block archive,
+# more than 1 splits the archive into independently compressed xz blocks, like 'xz -T' does.
+default_xz_threads = int(os.environ.get("PACKAGE_xz_threads", default = 1))
+# uncompressed size of each xz block when compressing on more than one thread, in MiB.
+# each worker needs roughly twice this on top of the compressor memory of the preset.
+default_xz_block_size = int(os.environ.get("PACKAGE_xz_block_size", default = 192))
+# set PACKAGE_force to 1 to always repack, even if the package image did not change.
+default_force = os.environ.get("PACKAGE_force", default = '0') not in ['', '0']
+# set PACKAGE_reproducible to 1 to make packing the same image always produce the exact same archive bytes.
+default_reproducible = os.environ.get("PACKAGE_reproducible", default = '0') not in ['', '0']
+# how the archive is checked after packing it.  'quick' checks the archive hash and that the archive lists exactly the
+# files that were packed, with their sizes.  'full' also re-hashes every file in it, like FullyValidatePackage does
+# for anything downloaded.  'sampled' does a full validation for a random PACKAGE_full_validation_rate of the packages.
+validation_modes = ['quick', 'sampled', 'full']
+default_validation = os.environ.get("PACKAGE_validation", default = 'quick')
+full_validation_rate = float(os.environ.get("PACKAGE_full_validation_rate", default = 0.1))
+# the timestamp given to every file in a reproducible archive.  Honors the usual SOURCE_DATE_EPOCH convention.
+reproducible_mtime = int(os.environ.get("SOURCE_DATE_EPOCH", default = 0))
+
+# bump this whenever a change to the packing code would produce different archives from the same image.
+_fingerprint_version = 1
+
+# dictionary size, compressor memory and decompressor memory of each xz preset level, in MiB, as documented by xz.
+# the extreme variants use the same memory.
+_xz_preset_memory = {
+    0 : (0.25, 3, 1),
+    1 : (1, 9, 2),
+    2 : (2, 17, 3),
+    3 : (4, 32, 5),
+    4 : (4, 48, 5),
+    5 : (8, 94, 9),
+    6 : (8, 94, 9),
+    7 : (16, 186, 17),
+    8 : (32, 370, 33),
+    9 : (64, 674, 65),
+}
+
+def AddPackArgs(argparser):
+    argparser.add_argument('--compression', choices=compression_profiles.keys(), default=default_compression,
+                            help='Compression profile to pack with.  Use release for anything that will be uploaded.  Can also use PACKAGE_compression')
+    argparser.add_argument('--xz_threads', type=int, action='store', default=default_xz_threads,
+                            help='Threads to compress the archive with.  More than 1 writes a multi-block archive (like xz -T).  Can also use PACKAGE_xz_threads')
+    argparser.add_argument('--xz_block_size', type=int, action='store', default=default_xz_block_size,
+                            help='Uncompressed MiB per xz block when using more than one xz thread.  Memory per thread is roughly twice this plus the compressor itself.  Can also use PACKAGE_xz_block_size')
+    argparser.add_argument('--force', action='store_true', default=default_force,
+                            help='Repack packages even if their image has not changed since they were last packed.  Can also use PACKAGE_force=1')
+    argparser.add_argument('--reproducible', action='store_true', default=default_reproducible,
+                            help='Sort the archive and normalize timestamps, owners and modes so that packing the same image always gives the same bytes.  Can also use PACKAGE_reproducible=1')
+    argparser.add_argument('--validation', choices=validation_modes, default=default_validation,
+                            help='How to check each archive after packing it.  full re-hashes every file in it, sampled does that for a fraction (PACKAGE_full_validation_rate) of the packages.  Can also use PACKAGE_validation')
+
+class _HashingReader():
+    ''' Wraps a file opened for reading and hashes everything that is read through it '''
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size = -1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+class _HashingWriter():
+    ''' Wraps a file opened for writing and hashes everything that is written through it '''
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+def _DescribeImageFile(file_abspath, stat_result, file_hash):
+    ''' Returns the fingerprint record of a single file in a package image, given its lstat result,
+    which captures everything about it that ends up in the archive.
+    '''
+    if stat.S_ISLNK(stat_result.st_mode):
+        return ['link', os.readlink(file_abspath), file_hash]
+    return ['file', stat.S_IMODE(stat_result.st_mode) | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH, stat_result.st_size, file_hash]
+
+def _ComputeImageFingerprint(files_to_add, image_stats, file_hashes, pack_settings):
+    ''' Given the files of an image ('absolute path' -> relative path), their lstat results and their hashes (relative path -> hash)
+    returns a hash that changes whenever packing that image with those settings would produce a different package.
+    '''
+    fingerprint_records = [_fingerprint_version, pack_settings]
+    for file_abspath, file_relpath in files_to_add.items():
+        fingerprint_records.append([file_relpath] + _DescribeImageFile(file_abspath, image_stats[file_abspath], file_hashes[file_relpath]))
+    return hashlib.sha256(json.dumps(fingerprint_records).encode('utf8')).hexdigest()
+
+def _IsPackageUpToDate(output_folder, package_name, files_to_add, image_stats, pack_settings, jobs):
+    ''' Returns True if the output folder already contains a package packed from exactly this image,
+    with these settings, and the archive still matches its recorded hash.
+    '''
+    fingerprint_file_path = os.path.join(output_folder, package_name + CommonUtils.package_fingerprint_extension)
+    if not os.path.exists(fingerprint_file_path):
+        return False
+    for expected_file in CommonUtils.GetPackageParts(package_name):
+        if not os.path.exists(os.path.join(output_folder, expected_file)):
+            return False
+
+    with open(fingerprint_file_path, encoding='utf8') as fingerprint_file:
+        previous_fingerprint = fingerprint_file.read().strip()
+
+    # with the hash cache, hashing an unchanged image is mostly stat calls.
+    file_hashes = dict(zip(files_to_add.values(), CommonUtils.ComputeHashesOfFiles(files_to_add.keys(), jobs, stat_results=image_stats.values())))
+    if _ComputeImageFingerprint(files_to_add, image_stats, file_hashes, pack_settings) != previous_fingerprint:
+        return False
+
+    package_file_name = package_name + CommonUtils.package_extension
+    try:
+        package_sums = CommonUtils.ParseSHA256SumsFile(os.path.join(output_folder, package_name + CommonUtils.package_hash_extension))
+    except InvalidHashFormatException:
+        return False
+    # always re-read the archive itself, a stat match in the hash cache says nothing about bytes changed in place.
+    return package_sums.get(package_file_name) == CommonUtils.ComputeHashOfFile(os.path.join(output_folder, package_file_name), use_hash_cache=False)
+
+def GetImageSize(package_folder_path):
+    ''' Returns the total size of the regular files in a package image '''
+    return sum(stat_result.st_size for _, _, stat_result, _ in CommonUtils.WalkPackageImage(package_folder_path) if stat.S_ISREG(stat_result.st_mode))
+
+def EstimatePackMemory(image_size, compression = None, xz_threads = None, xz_block_size = None):
+    ''' Returns roughly how many bytes of memory PackageUpFolder needs at its peak to pack an image of image_size bytes
+    with those settings (which default to the module settings), including reading the archive back to validate it.
+    liblzma only touches as much of its dictionary and match finder as the data it has seen, so small images need
+    far less than the documented memory of their preset.
+    '''
+    compression = compression or default_compression
+    xz_threads = xz_threads or default_xz_threads
+    xz_block_size = (xz_block_size or default_xz_block_size) * 1024 * 1024
+    dictionary_size, compressor_memory, decompressor_memory = [mebibytes * 1024 * 1024 for mebibytes in _xz_preset_memory[compression_profiles[compression] & ~lzma.PRESET_EXTREME]]
+    minimum_compressor_memory = _xz_preset_memory[0][1] * 1024 * 1024
+
+    def ScaledToInput(memory, input_size):
+        return max(minimum_compressor_memory, memory * min(1.0, input_size / dictionary_size))
+
+    if xz_threads > 1:
+        # every worker compresses a block of its own, holding both the block and its compressed copy
+        block_input_size = min(image_size, xz_block_size)
+        workers = max(1, min(xz_threads, -(-image_size // xz_block_size)))
+        pack_memory = workers * (ScaledToInput(compressor_memory, block_input_size) + 2 * block_input_size)
+    else:
+        pack_memory = ScaledToInput(compressor_memory, image_size)
+    pack_memory += _archive_buffer_size
+    # validation happens after packing, so only the larger of the two counts
+    return int(max(pack_memory, ScaledToInput(decompressor_memory, image_size)))
+
 def _NoReadOnlyTarFileFilter(tarinfo):
     # remove any readonly flags from any given tar element
     tarinfo.mode = tarinfo.mode | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
     return tarinfo
 
-def PackageUpFolder(package_folder_path, output_folder):
+def _FindImageFiles(package_folder_path):
+    ''' Returns a map of 'absolute path' -> relative path from the package root, for every file in a package image,
+    and a map of 'absolute path' -> lstat result for the same files.
+    '''
+    files_to_add = {}
+    image_stats = {}
+    for individual_relpath, individual_abspath, stat_result, _ in CommonUtils.WalkPackageImage(package_folder_path):
+        files_to_add[individual_abspath] = individual_relpath
+        image_stats[individual_abspath] = stat_result
+    return files_to_add, image_stats
+
+def _HashSymlinkTargets(image_stats, jobs):
+    ''' Returns a map of 'absolute path' -> hash of the target, for every symlink in image_stats.
+    Regular files are hashed as they are streamed into the archive, but symlinks go into
+    the archive as links while the manifest wants the hash of what they point at, so those
+    targets are hashed up front, on worker threads.
+    '''
+    symlinks_to_hash = [individual_abspath for individual_abspath, stat_result in image_stats.items() if stat.S_ISLNK(stat_result.st_mode)]
+    return dict(zip(symlinks_to_hash, CommonUtils.ComputeHashesOfFiles(symlinks_to_hash, jobs)))
+
+def _ReproducibleTarFileFilter(tarinfo):
+    # strip everything about a tar element that depends on when and by whom it was packed,
+    # keeping only whether it is executable.  Files stay writable, like _NoReadOnlyTarFileFilter.
+    tarinfo.mtime = reproducible_mtime
+    tarinfo.uid = 0
+    tarinfo.gid = 0
+    tarinfo.uname = ''
+    tarinfo.gname = ''
+    if not tarinfo.issym():
+        tarinfo.mode = 0o755 if tarinfo.isdir() or tarinfo.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) else 0o644
+    return tarinfo
+
+def _WritePackageArchive(archive_path, manifest_path, files_to_add, symlink_hashes, compression_level, xz_threads, xz_block_size, reproducible = False):
+    ''' Writes every file in files_to_add ('absolute path' -> relative path) into a new archive at archive_path,
+    followed by their manifest, which is also saved to manifest_path.  Each file is only read once.
+    symlink_hashes must map every symlink in files_to_add to the hash of its target.
+    If reproducible is set, members are sorted and their metadata normalized.
+    Returns (map of 'relative path' -> sha256sum, sha256sum of the archive)
+    '''
+    file_hashes = {} # map of 'relative path' -> sha256sum
+    tar_filter = _NoReadOnlyTarFileFilter
+    if reproducible:
+        # both the archive and the manifest follow the order of files_to_add.
+        files_to_add = dict(sorted(files_to_add.items(), key=lambda item: item[1]))
+        tar_filter = _ReproducibleTarFileFilter
+    with contextlib.ExitStack() as archive_stack:
+        # every compressed byte is hashed on its way to disk, so the archive never has to be read back
+        archive_file = _HashingWriter(archive_stack.enter_context(open(archive_path, "wb")))
+        if xz_threads > 1:
+            # the tar is streamed into a writer which compresses blocks of it on multiple threads.
+            print(f'    Compressing with {xz_threads} threads, {xz_block_size} MiB blocks')
+            xz_writer = archive_stack.enter_context(ParallelXZWriter(archive_file, compression_level, xz_threads, xz_block_size * 1024 * 1024))
+            tar = archive_stack.enter_context(tarfile.open(mode="w|", fileobj=xz_writer, bufsize=_archive_buffer_size))
+        else:
+            tar = archive_stack.enter_context(tarfile.open(fileobj=archive_file, mode="w:xz", preset=compression_level))
+        tar.copybufsize = CommonUtils.hash_chunk_size
+
+        print('    Adding files to: "{}"'.format(archive_path))
+        for individual_file in files_to_add.keys():
+            individual_relpath = files_to_add[individual_file]
+            tarinfo = tar_filter(tar.gettarinfo(str(individual_file), arcname=individual_relpath))
+            if tarinfo.isreg():
+                # read each file exactly once, feeding both the archive and the content hash
+                with open(individual_file, "rb") as source_file:
+                    stat_result = os.fstat(source_file.fileno())
+                    hashed_at_ns = time.time_ns()
+                    hashing_reader = _HashingReader(source_file)
+                    tar.addfile(tarinfo, hashing_reader)
+                file_hashes[individual_relpath] = hashing_reader.hexdigest()
+                if CommonUtils.hash_cache:
+                    CommonUtils.hash_cache.Store(str(individual_file), stat_result, file_hashes[individual_relpath], hashed_at_ns)
+            else:
+                tar.addfile(tarinfo)
+                file_hashes[individual_relpath] = symlink_hashes[individual_file] if individual_file in symlink_hashes else CommonUtils.ComputeHashOfFile(individual_file)
+
+        # the manifest can only be written once everything has been hashed, so it goes in last.
+        individual_file_hashes_string = ''
+        for hash_key in file_hashes.keys():
+            individual_file_hashes_string += "{} *{}\n".format(file_hashes[hash_key], hash_key)
+
+        # save the contents hash to root
+        with open(manifest_path, "wb") as manifest_file:
+            manifest_file.write(individual_file_hashes_string.encode('utf8'))
+
+        tar.add(manifest_path, arcname=CommonUtils.package_root_hash_file_name, filter=tar_filter)
+
+    return file_hashes, archive_file.hexdigest()
+
+def _QuickVerifyPackedArchive(package_name, archive_path, archive_hash, files_to_add, image_stats, manifest_path):
+    ''' A cheap check of an archive that was just packed from files_to_add, which trusts the hashes computed while packing.
+    Makes sure that the archive on disk still has the hash it was written with, and that decompressing it lists exactly
+    the files that were packed, with the right types and sizes, and none of them read-only.  Nothing is extracted.
+    '''
+    print(f"    - Verifying package: {archive_path}....")
+    archive_size = os.path.getsize(archive_path)
+    with CommonUtils.metrics.Phase(package_name, 'archive_hash') as phase:
+        phase.byte_count = archive_size
+        archive_hash_matches = CommonUtils.ComputeHashOfFile(archive_path, use_hash_cache=False) == archive_hash
+    if not archive_hash_matches:
+        print(f"        - FAILED!  The archive on disk does not have the hash it was written with.")
+        return False
+
+    with CommonUtils.metrics.Phase(package_name, 'validate') as phase:
+        phase.byte_count = archive_size
+        return _CheckPackedArchiveMembers(archive_path, files_to_add, image_stats, manifest_path)
+
+def _CheckPackedArchiveMembers(archive_path, files_to_add, image_stats, manifest_path):
+    ''' The second half of _QuickVerifyPackedArchive, which lists the archive without extracting it '''
+    expected_members = {} # map of 'relative path' -> (symlink target or None, size)
+    for file_abspath, file_relpath in files_to_add.items():
+        if stat.S_ISLNK(image_stats[file_abspath].st_mode):
+            expected_members[file_relpath] = (os.readlink(file_abspath), 0)
+        else:
+            expected_members[file_relpath] = (None, image_stats[file_abspath].st_size)
+    expected_members[CommonUtils.package_root_hash_file_name] = (None, os.path.getsize(manifest_path))
+
+    try:
+        with tarfile.open(archive_path, mode="r|xz") as tar:
+            for member in tar:
+                if member.name not in expected_members:
+                    print(f"        - FAILED!  The archive contains a file that was not packed, or contains it twice: {member.name}")
+                    return False
+                expected_link_target, expected_size = expected_members.pop(member.name)
+                if expected_link_target is not None:
+                    member_ok = member.issym() and member.linkname == expected_link_target
+                elif member.islnk():
+                    # tarfile stores the second name of a hard linked file as a link to the first
+                    member_ok = member.linkname in files_to_add.values()
+                else:
+                    member_ok = member.isreg() and member.size == expected_size
+                if not member_ok:
+                    print(f"        - FAILED!  The archive does not contain {member.name} the way it was packed.")
+                    return False
+                if not member.issym() and not member.mode & stat.S_IWUSR:
+                    print(f"        - FAILED!  File is read-only in the archive: {member.name}")
+                    return False
+    except (tarfile.TarError, lzma.LZMAError, EOFError) as e:
+        print(f"        - FAILED!  The archive could not be read back: {e}")
+        return False
+
+    if expected_members:
+        print(f"        - FAILED!  Files are missing from the archive: {set(expected_members.keys())}")
+        return False
+    return True
+
+def PackageUpFolder(package_folder_path, output_folder, jobs = None, xz_threads = None, xz_block_size = None, force = None, compression = None, reproducible = None, validation = None):
     ''' Packages up a folder into an package-file and stamps it with SHASUMS and so forth
+    jobs is the number of threads to hash the package contents with (defaults to CommonUtils.jobs)
+    xz_threads and xz_block_size (MiB) control parallel compression (default to the module settings)
+    Unless force is set, a package whose image has not changed since it was last packed is not packed again.
+    compression is the name of one of the compression_profiles (defaults to the module setting)
+    reproducible makes the archive depend only on the contents of the image (defaults to the module setting)
+    validation is one of the validation_modes, how the archive is checked once packed (defaults to the module setting)
     '''
+    compression = compression or default_compression
+    xz_threads = xz_threads or default_xz_threads
+    xz_block_size = xz_block_size or default_xz_block_size
+    force = default_force if force is None else force
+    reproducible = default_reproducible if reproducible is None else reproducible
+    validation = validation or default_validation
     package_descriptor_path = os.path.join(package_folder_path, CommonUtils.package_descriptor_name)
     if not os.path.exists(package_descriptor_path):
         raise FileNotFoundError('package descriptor file was not found {}'.format(package_descriptor_path))
@@ -44,40 +373,37 @@ def PackageUpFolder(package_folder_path, output_folder):
 
     # build script does not exist, assume just an existing package folder
 
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    # several packages may be packed into the same output folder at once
+    os.makedirs(output_folder, exist_ok=True)
 
     print("Creating/Updating package: {}".format(package_name))
     # we would normally use mkstemp but we actually want a temp folder on the same volume
     # so that fast renames work.
     temp_output_path = os.path.join(output_folder, "temp")
 
-    if not os.path.exists(temp_output_path):
-        os.makedirs(temp_output_path)
+    os.makedirs(temp_output_path, exist_ok=True)
 
     # create a manifest which has the hash and name of every file in the folder.
     # this includes the package info file.
-    path_to_scan = str(pathlib.Path(package_folder_path))
-    file_hashes = {} # map of 'relative path' -> sha256sum
-    files_to_add = {} # map of 'absolute path' -> relative path from the package root
-
-    # Note:  While it would be great to use pathlib.glob, it doesn't 'see' symlinks!
-    # We have to use glob.glob instead, then wrap it in a pathlib.Path:
-    path_list = list(glob(f"{path_to_scan}/**/*", recursive=True))
-    for path_str in path_list:
-        individual_path = pathlib.Path(path_str)
-        if not individual_path.is_dir():
-            individual_relpath = individual_path.relative_to(package_folder_path)
-            individual_relpath = individual_relpath.as_posix()
-            individual_abspath = individual_path.absolute()
-
-            hash_result = CommonUtils.ComputeHashOfFile(individual_abspath)
-            file_hashes[individual_relpath] = hash_result
-            files_to_add[individual_abspath] = individual_relpath
-
-    individual_file_hashes_string = ''
-    for hash_key in file_hashes.keys():
-        individual_file_hashes_string += "{} *{}\n".format(file_hashes[hash_key], hash_key)
+    with CommonUtils.metrics.Phase(package_name, 'enumerate') as phase:
+        files_to_add, image_stats = _FindImageFiles(package_folder_path)
+        image_size = sum(stat_result.st_size for stat_result in image_stats.values() if stat.S_ISREG(stat_result.st_mode))
+        phase.byte_count = image_size
+
+    compression_level = compression_profiles[compression]
+    pack_settings = {'preset': compression_level, 'xz_threads': xz_threads, 'xz_block_size': xz_block_size if xz_threads > 1 else None,
+                     'reproducible': reproducible, 'mtime': reproducible_mtime if reproducible else None}
+    if not force:
+        with CommonUtils.metrics.Phase(package_name, 'hash') as phase:
+            phase.byte_count = image_size
+            package_is_up_to_date = _IsPackageUpToDate(output_folder, package_name, files_to_add, image_stats, pack_settings, jobs)
+        if package_is_up_to_date:
+            print(f"    Package {package_name} is unchanged since it was last packed, skipping.  Use --force to repack it.")
+            CommonUtils.metrics.Emit('pack_skipped', package=package_name)
+            return True
+
+    with CommonUtils.metrics.Phase(package_name, 'hash'):
+        symlink_hashes = _HashSymlinkTargets(image_stats, jobs)
 
     package_file_name = package_name + CommonUtils.package_extension
     full_package_file_name       = os.path.join(output_folder, package_name + CommonUtils.package_extension)
@@ -88,58 +414,155 @@ def PackageUpFolder(package_folder_path, output_folder):
     temp_package_hash_file = os.path.join(temp_output_path, 'temp_package_hash_' + package_name) # temp file for the hash of the package itself
     temp_package_contents_hash_file_path = os.path.join(temp_output_path, 'temp_package_contents_hash_' + package_name) # temp file for the hash of the package itself
 
-    # using LZMA yields overall best compression for packages tested:
-    compression_level = lzma.PRESET_EXTREME|9
-    with tarfile.open(temp_package_file, mode="w:xz", bufsize=_archive_buffer_size, preset=compression_level) as tar:
-        print('    Adding files to: "{}"'.format(temp_package_file))
-        for individual_file in files_to_add.keys():
-            tar.add(str(individual_file), arcname=str(files_to_add[individual_file]), filter=_NoReadOnlyTarFileFilter)
-
-        # save the contents hash to root
-        with open(temp_package_contents_hash_file_path, "wb") as temp_package_contents_hash_file:
-            temp_package_contents_hash_file.write(individual_file_hashes_string.encode('utf8'))
-
-        tar.add(temp_package_contents_hash_file_path, arcname=CommonUtils.package_root_hash_file_name, filter=_NoReadOnlyTarFileFilter)
+    full_fingerprint_file_name   = os.path.join(output_folder, package_name + CommonUtils.package_fingerprint_extension)
+    with CommonUtils.metrics.Phase(package_name, 'compress') as phase:
+        phase.byte_count = image_size
+        file_hashes, file_hash = _WritePackageArchive(temp_package_file, temp_package_contents_hash_file_path, files_to_add, symlink_hashes, compression_level, xz_threads, xz_block_size, reproducible)
+    archive_size = os.path.getsize(temp_package_file)
 
     new_hash_contents = ''
 
-    file_hash = CommonUtils.ComputeHashOfFile(temp_package_file)
-        
     with open(temp_package_hash_file, "wb") as package_hash_file:
         new_hash_contents = "{} *{}\n".format(file_hash, package_file_name)
         package_hash_file.write(new_hash_contents.encode("utf8"))
 
-    # replace them all
-    if os.path.exists(full_package_file_name):
-        os.remove(full_package_file_name)
+    with CommonUtils.metrics.Phase(package_name, 'move') as phase:
+        phase.byte_count = archive_size
+        # replace them all.  The fingerprint goes first, so that a half replaced package never looks up to date.
+        if os.path.exists(full_fingerprint_file_name):
+            os.remove(full_fingerprint_file_name)
 
-    if os.path.exists(full_hash_file_name):
-        os.remove(full_hash_file_name)
+        if os.path.exists(full_package_file_name):
+            os.remove(full_package_file_name)
 
-    if os.path.exists(full_contents_hash_file_name):
-        os.remove(full_contents_hash_file_name)
-    
-    os.rename(temp_package_file, full_package_file_name)
-    os.rename(temp_package_hash_file, full_hash_file_name)
-    os.rename(temp_package_contents_hash_file_path, full_contents_hash_file_name)
-    shutil.copyfile(package_descriptor_path, full_package_info_file_name)
+        if os.path.exists(full_hash_file_name):
+            os.remove(full_hash_file_name)
+
+        if os.path.exists(full_contents_hash_file_name):
+            os.remove(full_contents_hash_file_name)
+
+        os.rename(temp_package_file, full_package_file_name)
+        os.rename(temp_package_hash_file, full_hash_file_name)
+        os.rename(temp_package_contents_hash_file_path, full_contents_hash_file_name)
+        shutil.copyfile(package_descriptor_path, full_package_info_file_name)
 
     print("    Created: {}".format(full_package_file_name))
     print("    Created: {}".format(full_hash_file_name))   
     print("    Created: {}".format(full_contents_hash_file_name))
     print("    Created: {}".format(full_package_info_file_name))
     
-    returnCode = CommonUtils.FullyValidatePackage(output_folder, package_name)
+    if validation == 'full' or (validation == 'sampled' and random.random() < full_validation_rate):
+        validation = 'full'
+        returnCode = CommonUtils.FullyValidatePackage(output_folder, package_name)
+    else:
+        validation = 'quick'
+        returnCode = _QuickVerifyPackedArchive(package_name, full_package_file_name, file_hash, files_to_add, image_stats, full_contents_hash_file_name)
+
+    CommonUtils.metrics.Emit('validation', package=package_name, mode=validation, valid=bool(returnCode))
+
+    if returnCode:
+        with open(full_fingerprint_file_name, "w", encoding='utf8') as fingerprint_file:
+            fingerprint_file.write(_ComputeImageFingerprint(files_to_add, image_stats, file_hashes, pack_settings) + '\n')
 
     print(f"    Package Hash: {new_hash_contents}")
     return returnCode
 
+def _ParsePreset(preset_name):
+    ''' Turns a profile name, or a preset like '6' or '9e', into an lzma preset '''
+    if preset_name in compression_profiles:
+        return compression_profiles[preset_name]
+    if preset_name.endswith('e'):
+        return int(preset_name[:-1]) | lzma.PRESET_EXTREME
+    return int(preset_name)
+
+def GetPeakMemoryUsage():
+    ''' Returns the peak resident memory of this process in bytes, or None where that cannot be measured '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KiB, macOS reports bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def _BenchmarkPreset(package_folder_path, scratch_folder, preset, xz_threads, xz_block_size):
+    ''' Packs the image at one preset, then reads the archive back.
+    Runs in a process of its own, so that the peak memory it reports belongs to this preset alone.
+    '''
+    files_to_add, image_stats = _FindImageFiles(package_folder_path)
+    symlink_hashes = _HashSymlinkTargets(image_stats, None)
+    archive_path = os.path.join(scratch_folder, f'benchmark_{os.getpid()}{CommonUtils.package_extension}')
+    manifest_path = os.path.join(scratch_folder, f'benchmark_{os.getpid()}_{CommonUtils.package_root_hash_file_name}')
+
+    start_time = time.perf_counter()
+    _WritePackageArchive(archive_path, manifest_path, files_to_add, symlink_hashes, preset, xz_threads, xz_block_size)
+    compression_seconds = time.perf_counter() - start_time
+    peak_memory = GetPeakMemoryUsage()
+
+    uncompressed_size = 0
+    start_time = time.perf_counter()
+    with tarfile.open(archive_path, mode="r|xz") as tar:
+        for member in tar:
+            member_file = tar.extractfile(member)
+            if member_file:
+                data = member_file.read(CommonUtils.hash_chunk_size)
+                while data:
+                    uncompressed_size += len(data)
+                    data = member_file.read(CommonUtils.hash_chunk_size)
+    decompression_seconds = time.perf_counter() - start_time
+
+    compressed_size = os.path.getsize(archive_path)
+    os.remove(archive_path)
+    os.remove(manifest_path)
+    return {
+        'compression_seconds'   : compression_seconds,
+        'decompression_seconds' : decompression_seconds,
+        'peak_memory'           : peak_memory,
+        'compressed_size'       : compressed_size,
+        'uncompressed_size'     : uncompressed_size,
+    }
+
+def BenchmarkCompression(package_folder_path, output_folder, preset_names, xz_threads = None, xz_block_size = None):
+    ''' Packs the image in package_folder_path once per preset in preset_names (profile names, or xz presets
+    such as '6' or '9e') and prints wall time, peak memory, size and decompression time for each.
+    Nothing is written to the output folder other than scratch files in its temp folder.
+    Returns a map of preset name -> measurements.
+    '''
+    xz_threads = xz_threads or default_xz_threads
+    xz_block_size = xz_block_size or default_xz_block_size
+    scratch_folder = os.path.join(output_folder, "temp")
+    os.makedirs(scratch_folder, exist_ok=True)
+
+    print(f"Benchmarking compression of {package_folder_path} with {xz_threads} xz thread(s)...")
+    results = {}
+    for preset_name in preset_names:
+        print(f"    - Preset {preset_name}...")
+        # a fresh process per preset, otherwise peak memory would just be the largest so far
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results[preset_name] = executor.submit(_BenchmarkPreset, package_folder_path, scratch_folder, _ParsePreset(preset_name), xz_threads, xz_block_size).result()
+
+    print('| PRESET  | COMPRESS (s) | PEAK MEM (MiB) | SIZE (bytes)  | RATIO  | DECOMPRESS (s) |')
+    print('|---------|--------------|----------------|---------------|--------|----------------|')
+    for preset_name, result in results.items():
+        peak_memory = f"{result['peak_memory'] / (1024 * 1024):.0f}" if result['peak_memory'] else 'n/a'
+        ratio = result['compressed_size'] / max(1, result['uncompressed_size'])
+        print(f"| {preset_name:<7} | {result['compression_seconds']:>12.2f} | {peak_memory:>14} | {result['compressed_size']:>13} | {ratio:>6.3f} | {result['decompression_seconds']:>14.2f} |")
+    return results
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Creates a package from a folder which contains a PackageInfo.json file')
     parser.add_argument('source_folder', help='The folder to turn into a package.')
+    parser.add_argument('--benchmark_compression', action='store_true',
+                        help='Instead of creating the package, pack it at each of the --benchmark_presets and report how they compare')
+    parser.add_argument('--benchmark_presets', default='fast,3,default,9,release',
+                        help='Comma separated compression profiles or xz presets (such as 6 or 9e) to benchmark')
     CommonUtils.AddCommonArgs(parser)    
+    AddPackArgs(parser)
     args = parser.parse_args()
     CommonUtils.PostArgParse(args)
 
-    PackageUpFolder(args.source_folder, args.output_folder)
+    if args.benchmark_compression:
+        BenchmarkCompression(args.source_folder, args.output_folder, args.benchmark_presets.split(','), args.xz_threads, args.xz_block_size)
+    else:
+        PackageUpFolder(args.source_folder, args.output_folder, args.jobs, args.xz_threads, args.xz_block_size, args.force, args.compression, args.reproducible, args.validation)
 
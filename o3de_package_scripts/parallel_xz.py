@@ -0,0 +1,160 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import lzma
+import zlib
+import struct
+import collections
+import concurrent.futures
+
+"""This module implements a file-like writer that compresses its input into a standard .xz file on
+several threads, the same way 'xz -T' does.
+
+The input is cut into fixed size blocks, each block is compressed independently by a worker thread
+(liblzma releases the GIL while it works) and the compressed blocks are written, in order, into a
+single xz stream with one index covering all of them.  The result is an ordinary multi-block .xz file
+that any xz decoder (xz-utils, libarchive/CMake, python's lzma module) can decompress.
+
+Because blocks do not share a dictionary, the output is slightly larger than a single-threaded
+stream at the same preset, and it is not byte-identical to it.
+"""
+
+_stream_header_magic = b'\xfd7zXZ\x00'
+_stream_footer_magic = b'YZ'
+_stream_header_size = 12
+_stream_footer_size = 12
+
+class XZFormatError(Exception):
+    '''Raised when liblzma produced a stream this module does not know how to split into blocks'''
+    pass
+
+def _EncodeVarint(value):
+    ''' Encodes an integer the way the xz format stores sizes in the index '''
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+def _DecodeVarint(data, offset):
+    ''' Returns (value, offset after the value) '''
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+def _CompressBlock(data, preset, check):
+    ''' Compresses data into a complete single-block xz stream, then cuts the block back out of it.
+    Returns (stream flags, block bytes including padding and check, unpadded size, uncompressed size)
+    '''
+    stream = lzma.compress(data, format=lzma.FORMAT_XZ, check=check, preset=preset)
+    if stream[:len(_stream_header_magic)] != _stream_header_magic or stream[-len(_stream_footer_magic):] != _stream_footer_magic:
+        raise XZFormatError('liblzma did not produce a single xz stream')
+
+    stream_flags = stream[len(_stream_header_magic):len(_stream_header_magic) + 2]
+    backward_size = (struct.unpack('<I', stream[-8:-4])[0] + 1) * 4
+    index_start = len(stream) - _stream_footer_size - backward_size
+    index = stream[index_start:-_stream_footer_size]
+
+    # index is: indicator (0), number of records, then (unpadded size, uncompressed size) per record
+    record_count, offset = _DecodeVarint(index, 1)
+    if index[0] != 0 or record_count != 1:
+        raise XZFormatError(f'expected exactly one block in the stream, found {record_count}')
+    unpadded_size, offset = _DecodeVarint(index, offset)
+    uncompressed_size, offset = _DecodeVarint(index, offset)
+
+    return stream_flags, stream[_stream_header_size:index_start], unpadded_size, uncompressed_size
+
+class ParallelXZWriter():
+    ''' A write-only file object that compresses everything written to it into fileobj as a
+    multi-block .xz stream.
+        threads     - number of blocks compressed at the same time.
+        block_size  - uncompressed bytes per block.  Each worker holds about twice this much memory on
+                      top of what the preset itself needs, and larger blocks compress better.
+    fileobj is not closed by close().
+    '''
+    def __init__(self, fileobj, preset, threads, block_size, check=lzma.CHECK_CRC64):
+        self.fileobj = fileobj
+        self.preset = preset
+        self.threads = max(1, threads)
+        self.block_size = block_size
+        self.check = check
+        self.buffer = bytearray()
+        self.pending_blocks = collections.deque()
+        self.index_records = []
+        self.stream_flags = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._SubmitBlock(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _SubmitBlock(self, block):
+        self.pending_blocks.append(self.executor.submit(_CompressBlock, block, self.preset, self.check))
+        # never hold more blocks than the workers can chew on, to keep memory bounded
+        while len(self.pending_blocks) > self.threads:
+            self._WriteBlock(self.pending_blocks.popleft().result())
+
+    def _WriteBlock(self, compressed_block):
+        stream_flags, block, unpadded_size, uncompressed_size = compressed_block
+        if self.stream_flags is None:
+            self.stream_flags = stream_flags
+            self.fileobj.write(_stream_header_magic + stream_flags + struct.pack('<I', zlib.crc32(stream_flags)))
+        self.fileobj.write(block)
+        self.index_records.append((unpadded_size, uncompressed_size))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer:
+                self._SubmitBlock(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending_blocks:
+                self._WriteBlock(self.pending_blocks.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True)
+
+        if not self.index_records:
+            # nothing was written at all, which is a valid stream with no blocks
+            self.fileobj.write(lzma.compress(b'', format=lzma.FORMAT_XZ, check=self.check))
+            return
+
+        # the index lists every block, then is padded to a multiple of 4 and followed by its crc32
+        index = bytearray(b'\x00')
+        index += _EncodeVarint(len(self.index_records))
+        for unpadded_size, uncompressed_size in self.index_records:
+            index += _EncodeVarint(unpadded_size)
+            index += _EncodeVarint(uncompressed_size)
+        index += b'\x00' * (-len(index) % 4)
+        index += struct.pack('<I', zlib.crc32(index))
+        self.fileobj.write(index)
+
+        footer_fields = struct.pack('<I', len(index) // 4 - 1) + self.stream_flags
+        self.fileobj.write(struct.pack('<I', zlib.crc32(footer_fields)) + footer_fields + _stream_footer_magic)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            # dont bother finishing a stream nobody is going to use
+            self.closed = True
+            self.executor.shutdown(wait=True)
+        else:
+            self.close()
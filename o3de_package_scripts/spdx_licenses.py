@@ -0,0 +1,158 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import sys
+import argparse
+import json
+import time
+import threading
+import ssl
+import certifi
+import urllib.request
+
+"""This module implements the index of SPDX license identifiers that package licenses are checked against.
+
+The index never goes to the network on its own.  It is loaded from a copy of the official license list
+cached in the output folder by an explicit refresh (run this module with --refresh), or, if there is no
+such copy, from the snapshot that ships next to these scripts (spdx_licenses.json).
+
+A cached copy older than PACKAGE_spdx_ttl_days is still used, but produces a warning asking for a refresh,
+unless PACKAGE_spdx_auto_refresh is set, in which case it is refreshed the first time it is needed.
+"""
+
+# the license list on the official site, and how long to wait for it
+license_list_url = "https://spdx.org/licenses/licenses.json"
+fetch_timeout_seconds = 30
+# days after which a cached license list should be refreshed.
+spdx_ttl_days = float(os.environ.get("PACKAGE_spdx_ttl_days", default = 30))
+# set PACKAGE_spdx_auto_refresh to 1 to fetch the license list when the cached copy is missing or older than the TTL.
+spdx_auto_refresh = os.environ.get("PACKAGE_spdx_auto_refresh", default = '0') not in ['', '0']
+
+class SPDXLicenseIndex():
+    ''' A frozenset of every SPDX license identifier, loaded lazily from the cached or the bundled license list. '''
+    cache_file_name = 'spdx_licenses.json'
+    bundled_snapshot_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'spdx_licenses.json')
+
+    def __init__(self, cache_file_path = None):
+        self.cache_file_path = cache_file_path
+        self.license_list = None # loaded lazily on first use
+        self.license_ids = frozenset()
+        self.source_path = None
+
+    @staticmethod
+    def GetCacheFilePath(output_folder):
+        # kept next to the hash cache
+        return os.path.join(output_folder, '.cache', SPDXLicenseIndex.cache_file_name)
+
+    @staticmethod
+    def _ReadLicenseList(file_path):
+        ''' Returns the license list stored in file_path, or None if it is missing or not a license list '''
+        try:
+            with open(file_path, encoding='utf8') as license_file:
+                data = json.load(license_file)
+        except (OSError, ValueError):
+            return None
+        # validate that its actually the right content
+        if not isinstance(data, dict) or 'licenses' not in data:
+            print(f"Invalid license list format in {file_path}, ignoring it")
+            return None
+        return data
+
+    def GetCacheAgeDays(self):
+        ''' Returns how many days ago the cached license list was fetched, or None if there is none '''
+        if not self.cache_file_path or not os.path.exists(self.cache_file_path):
+            return None
+        return (time.time() - os.path.getmtime(self.cache_file_path)) / (24 * 60 * 60)
+
+    def _EnsureLoaded(self):
+        if self.license_list is not None:
+            return
+
+        cache_age_days = self.GetCacheAgeDays()
+        if self.cache_file_path and spdx_auto_refresh and (cache_age_days is None or cache_age_days > spdx_ttl_days):
+            self.Refresh()
+            cache_age_days = self.GetCacheAgeDays()
+
+        for file_path in [self.cache_file_path, SPDXLicenseIndex.bundled_snapshot_path]:
+            license_list = SPDXLicenseIndex._ReadLicenseList(file_path) if file_path else None
+            if license_list:
+                self._SetLicenseList(license_list, file_path)
+                break
+        else:
+            print(f"ERROR: No SPDX license list found at {self.cache_file_path or SPDXLicenseIndex.bundled_snapshot_path}, license validation unavailable")
+            self.license_list = {}
+            return
+
+        if self.source_path == self.cache_file_path and cache_age_days > spdx_ttl_days:
+            print(f"WARNING: The SPDX license list in {self.cache_file_path} is {cache_age_days:.0f} days old.  Refresh it with spdx_licenses.py --refresh")
+
+    def _SetLicenseList(self, license_list, source_path):
+        self.license_list = license_list
+        self.license_ids = frozenset(license['licenseId'] for license in license_list['licenses'])
+        self.source_path = source_path
+
+    def GetLicenseList(self):
+        ''' Returns the license list in the format of the official licenses.json, or None if there is none '''
+        self._EnsureLoaded()
+        return self.license_list or None
+
+    def GetVersion(self):
+        ''' Returns the licenseListVersion of the license list in use, or None if there is none '''
+        self._EnsureLoaded()
+        return self.license_list.get('licenseListVersion')
+
+    def IsKnownLicense(self, license_id):
+        self._EnsureLoaded()
+        return license_id in self.license_ids
+
+    def Refresh(self):
+        ''' Fetches the license list from the official site into the cache file.  Returns True if it succeeded. '''
+        if not self.cache_file_path:
+            print("ERROR: There is no cache file to refresh the SPDX license list into")
+            return False
+        print(f"Fetching the SPDX license list from {license_list_url}...")
+        try:
+            context = ssl.create_default_context(cafile=certifi.where())
+            with urllib.request.urlopen(license_list_url, context=context, timeout=fetch_timeout_seconds) as url:
+                data = json.loads(url.read().decode())
+        except Exception as e:
+            print(f"ERROR: Could not fetch the license list from {license_list_url}")
+            print(str(e))
+            return False
+        if not isinstance(data, dict) or 'licenses' not in data:
+            print(f"Invalid license format from spdx.org, see whats at {license_list_url}")
+            return False
+
+        os.makedirs(os.path.dirname(self.cache_file_path), exist_ok=True)
+        temp_file_path = f'{self.cache_file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file_path, 'w', encoding='utf8') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(temp_file_path, self.cache_file_path)
+        self._SetLicenseList(data, self.cache_file_path)
+        print(f"    - Cached SPDX license list version {self.GetVersion()} with {len(self.license_ids)} licenses")
+        return True
+
+if __name__ == "__main__":
+    from common import CommonUtils
+
+    parser = argparse.ArgumentParser(description='Shows or refreshes the SPDX license list that package licenses are checked against')
+    CommonUtils.AddCommonArgs(parser)
+    parser.add_argument('--refresh', action='store_true', help=f'Fetch the current license list from {license_list_url} into the output folder')
+    args = parser.parse_args()
+    CommonUtils.PostArgParse(args)
+
+    license_index = CommonUtils.spdx_license_index
+    if args.refresh and not license_index.Refresh():
+        sys.exit(1)
+
+    if not license_index.GetLicenseList():
+        sys.exit(1)
+    cache_age_days = license_index.GetCacheAgeDays() if license_index.source_path == license_index.cache_file_path else None
+    age_text = f", fetched {cache_age_days:.1f} days ago" if cache_age_days is not None else ''
+    print(f"Using SPDX license list version {license_index.GetVersion()} with {len(license_index.license_ids)} licenses from '{license_index.source_path}'{age_text}")
+    sys.exit(0)
@@ -13,25 +13,74 @@
 
 import os
 import sys
+import time
 import argparse
+import concurrent.futures
 import boto3
+import botocore.config
 
 from common import CommonUtils
 from find_package_on_server import FindPackageUtils
 
-def UploadPackage(package_folder, package_name, session, bucket_name):
-    bucket = session.resource('s3').Bucket(bucket_name)
+# number of packages to upload at the same time
+default_upload_jobs = int(os.environ.get("PACKAGE_upload_jobs", default = 8))
+# number of connections S3 uploads each file over, large archives are uploaded in several parts at once
+upload_file_concurrency = 10
 
+def UploadPackage(package_folder, package_name, s3_client, bucket_name):
+    ''' Uploads the parts of a package, in order, so that the PackageInfo.json marker only
+    gets to the bucket once every other part did.  Returns the number of bytes uploaded.
+    '''
+    package_bytes = 0
     # we actually want this to be uploaded in ORDER, so we don't put it into a dict
     # which would otherwise mess with the order:
     for expected_file in CommonUtils.GetPackageParts(package_name):
         abspath = os.path.join(package_folder, expected_file)
         print(f"    - Uploading {expected_file}...")
-        bucket.upload_file(abspath, expected_file, ExtraArgs={'ACL':'bucket-owner-full-control'})
+        with CommonUtils.metrics.Phase(package_name, 'upload') as phase:
+            phase.byte_count = os.path.getsize(abspath)
+            s3_client.upload_file(abspath, bucket_name, expected_file, ExtraArgs={'ACL':'bucket-owner-full-control'})
+        CommonUtils.metrics.Emit('upload_file_done', package=package_name, bucket=bucket_name, key=expected_file, bytes=phase.byte_count)
+        package_bytes += phase.byte_count
     
     print(f"    - Uploaded package {package_name}.")
+    return package_bytes
 
-def UploadPackages(aws_profile_name, aws_bucket_name, package_folder):
+def _ValidateAndUploadPackage(package_folder, package_name, session, s3_client, bucket_name):
+    ''' Returns (seconds, bytes) it took to upload the package, or None if it was not uploaded '''
+    # don't upload invalid packages, test them locally before uploading
+    package_is_valid = CommonUtils.FullyValidatePackage(package_folder, package_name)
+    CommonUtils.metrics.Emit('validation', package=package_name, mode='full', valid=package_is_valid)
+    if not package_is_valid:
+        return None
+
+    # the inventory of the bucket may predate someone else uploading it, and packages are never overwritten.
+    if FindPackageUtils.IsPackageInS3BucketNow(package_name, session, bucket_name, s3_client):
+        CommonUtils.metrics.Emit('upload_skipped', package=package_name, bucket=bucket_name)
+        return None
+
+    start_time = time.perf_counter()
+    package_bytes = UploadPackage(package_folder, package_name, s3_client, bucket_name)
+    upload_seconds = time.perf_counter() - start_time
+    FindPackageUtils.GetBucketInventory(bucket_name, session.profile_name, session).Add(package_name)
+    CommonUtils.metrics.Emit('package_uploaded', package=package_name, bucket=bucket_name, seconds=upload_seconds, bytes=package_bytes)
+    return upload_seconds, package_bytes
+
+def _PrintUploadSummary(upload_times, total_seconds, top = 5):
+    ''' Prints how fast the packages went up, and the ones that took the longest '''
+    total_bytes = sum(package_bytes for _, package_bytes in upload_times.values())
+    mib = 1024 * 1024
+    print(f"Uploaded {len(upload_times)} packages, {total_bytes / mib:.1f} MiB in {total_seconds:.1f}s ({total_bytes / mib / max(total_seconds, 0.001):.1f} MiB/s)")
+    slowest = sorted(upload_times.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    for package_name, (seconds, package_bytes) in slowest:
+        print(f"    - {package_name}: {package_bytes / mib:.1f} MiB in {seconds:.1f}s")
+
+def UploadPackages(aws_profile_name, aws_bucket_name, package_folder, upload_jobs = None, session = None):
+    ''' Uploads every valid package in package_folder that is not in the bucket yet, up to upload_jobs
+    (defaults to default_upload_jobs) at the same time.  Returns a map of package name -> (seconds, bytes)
+    of the packages uploaded.
+    '''
+    upload_jobs = max(1, upload_jobs or default_upload_jobs)
     # we assume all packages in the package location are candidates:
     if aws_profile_name:
         print(f"Using profile: {aws_profile_name}")
@@ -39,37 +88,57 @@ def UploadPackages(aws_profile_name, aws_bucket_name, package_folder):
     print(f"Using bucket: {aws_bucket_name}")
 
     # verify that boto3 actually gives us access:
-    session = boto3.session.Session(profile_name=aws_profile_name)
+    session = session or boto3.session.Session(profile_name=aws_profile_name)
+    # sessions are not thread safe but clients are, so every upload goes through this one,
+    # with enough connections for every package being uploaded to use all of its own.
+    s3_client = session.client('s3', config=botocore.config.Config(max_pool_connections=upload_jobs * upload_file_concurrency))
 
     # find out what packages are locally available to upload:
-    onlyfiles = [f for f in os.listdir(package_folder) if os.path.isfile(os.path.join(package_folder, f))]
-    for existing_file in onlyfiles:
-        if existing_file.endswith(CommonUtils.package_extension):
-            package_name = existing_file[:-len(CommonUtils.package_extension)]
-            print(f"Package: {package_name} ...")
-            # don't bother doing anything if the package is already on s3.
-            # if this throws an exception we're going to allow it to flow back 
-            # down and cause a non zero exit code
-            if (FindPackageUtils.IsPackageAlreadyInS3Bucket(package_name, session, aws_bucket_name)):
-                continue
-    
-            # don't upload invalid packages, test them locally before uploading
-            if not CommonUtils.FullyValidatePackage(package_folder, package_name):
-                continue
+    packages_to_upload = []
+    for package_name in CommonUtils.FindPackagesInFolder(package_folder):
+        print(f"Package: {package_name} ...")
+        # don't bother doing anything if the package is already on s3.
+        # if this throws an exception we're going to allow it to flow back 
+        # down and cause a non zero exit code
+        if (FindPackageUtils.IsPackageAlreadyInS3Bucket(package_name, session, aws_bucket_name)):
+            CommonUtils.metrics.Emit('upload_skipped', package=package_name, bucket=aws_bucket_name)
+            continue
+        packages_to_upload.append(package_name)
+
+    print(f"Uploading up to {len(packages_to_upload)} packages, {upload_jobs} at a time...")
+    start_time = time.perf_counter()
+    upload_times = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=upload_jobs) as executor:
+        uploads = {executor.submit(_ValidateAndUploadPackage, package_folder, package_name, session, s3_client, aws_bucket_name): package_name
+                   for package_name in packages_to_upload}
+        try:
+            for upload in concurrent.futures.as_completed(uploads):
+                # this too, can cause an exception, so if it flows down, its okay,
+                # allow the non zero exit code to flow all the way down into the main
+                # return, once the packages being uploaded already are done.
+                upload_time = upload.result()
+                if upload_time:
+                    upload_times[uploads[upload]] = upload_time
+        except BaseException:
+            for upload in uploads:
+                upload.cancel()
+            raise
 
-            # this too, can cause an exception, so if it flows down, its okay,
-            # allow the non zero exit code to flow all the way down into the main
-            # return.
-            UploadPackage(package_folder, package_name, session, aws_bucket_name)
+    _PrintUploadSummary(upload_times, time.perf_counter() - start_time)
+    print(CommonUtils.metrics.GetSummary())
+    return upload_times
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Uploads packages to s3.')
     
     CommonUtils.AddCommonArgs(parser)
     FindPackageUtils.AddServerArgs(parser)
+    parser.add_argument('--upload_jobs', type=int, action='store', default=default_upload_jobs,
+                        help='(optional) Number of packages to upload at the same time.  You can also use env var PACKAGE_upload_jobs')
 
     args = parser.parse_args()
     CommonUtils.PostArgParse(args)
+    FindPackageUtils.PostServerArgParse(args)
 
     if not args.bucket_name:
         print("Please set LY_PACKAGE_BUCKET_NAME in env or pass in --bucket_name <bucket_name>")
@@ -82,5 +151,5 @@ if __name__ == '__main__':
 
     # this will throw an exception and thus produce a non zero exit code
     # if something goes wrong.
-    UploadPackages(args.profile_name, args.bucket_name, args.output_folder)
+    UploadPackages(args.profile_name, args.bucket_name, args.output_folder, args.upload_jobs)
     sys.exit(0)
\ No newline at end of file
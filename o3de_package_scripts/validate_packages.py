@@ -0,0 +1,185 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+# this script fully validates every package in a packages folder, the same way
+# upload_all_packages.py does before uploading each of them, but on several
+# processes at once.  Use it to re-check a whole folder, for example after moving
+# it to a different disk, or before a release.
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import contextlib
+import traceback
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+from common import CommonUtils
+from hash_cache import HashCache
+from spdx_licenses import SPDXLicenseIndex
+from validation_stamps import ValidationStamps
+
+# seconds a single package may take to validate before it counts as failed.  0 means no limit.
+default_timeout = float(os.environ.get("PACKAGE_timeout", default = 0))
+# set PACKAGE_stop_on_failure to 1 to stop validating as soon as one package fails.
+default_stop_on_failure = os.environ.get("PACKAGE_stop_on_failure", default = '0') not in ['', '0']
+default_report_file_name = 'validation_report.json'
+# how the validation processes are started, the platform's default unless changed
+process_context = multiprocessing.get_context()
+
+def _GetWorkerSettings():
+    ''' Returns what a validation process needs to validate the way this one would, going by what PostArgParse set up '''
+    return {'jobs': CommonUtils.jobs,
+            'spdx_cache_file_path': CommonUtils.spdx_license_index.cache_file_path,
+            'hash_cache_file_path': CommonUtils.hash_cache.cache_file_path if CommonUtils.hash_cache else None,
+            'stamp_file_path': CommonUtils.validation_stamps.stamp_file_path if CommonUtils.validation_stamps else None}
+
+def _SetUpWorker(worker_settings):
+    # a spawned process starts from a fresh import of common, which knows nothing of the output folder, and a forked
+    # one must not share the locks of this one's copies, so either way the worker makes its own.  Hashes it computes
+    # are not written back to the hash cache, stamps of archives that pass are.
+    CommonUtils.jobs = worker_settings['jobs']
+    CommonUtils.spdx_license_index = SPDXLicenseIndex(worker_settings['spdx_cache_file_path'])
+    CommonUtils.hash_cache = HashCache(worker_settings['hash_cache_file_path']) if worker_settings['hash_cache_file_path'] else None
+    CommonUtils.validation_stamps = ValidationStamps(worker_settings['stamp_file_path']) if worker_settings['stamp_file_path'] else None
+
+def _ValidatePackageWorker(package_folder, package_name, worker_settings, result_connection):
+    ''' Runs in a process of its own.  Validates one package, and sends back its result and everything it printed. '''
+    output = io.StringIO()
+    start_time = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            _SetUpWorker(worker_settings)
+            status = 'valid' if CommonUtils.FullyValidatePackage(package_folder, package_name) else 'invalid'
+    except Exception:
+        status = 'error'
+        output.write(traceback.format_exc())
+    result_connection.send({'status': status, 'seconds': time.perf_counter() - start_time, 'output': output.getvalue()})
+    result_connection.close()
+
+def ValidatePackages(package_folder, jobs = None, timeout = None, stop_on_failure = None):
+    ''' Fully validates every package in package_folder on up to jobs processes at once (defaults to CommonUtils.jobs).
+    A package taking longer than timeout seconds is stopped and counts as failed.  If stop_on_failure is set,
+    packages still running when one fails are stopped, and the rest are skipped.
+    Returns a map of package name -> { 'status' : valid, invalid, error, timeout, cancelled or skipped, 'seconds', 'output' }
+    '''
+    jobs = max(1, jobs or CommonUtils.jobs)
+    timeout = default_timeout if timeout is None else timeout
+    stop_on_failure = default_stop_on_failure if stop_on_failure is None else stop_on_failure
+
+    package_names = CommonUtils.FindPackagesInFolder(package_folder)
+    print(f"Validating {len(package_names)} packages in {package_folder} on {jobs} processes...")
+
+    worker_settings = _GetWorkerSettings()
+    pending_packages = collections.deque(package_names)
+    running_packages = {} # map of package name -> (process, connection to receive the result on, start time)
+    results = {}
+    stopping = False
+
+    def FinishPackage(package_name, result):
+        nonlocal stopping
+        process, result_connection, _ = running_packages.pop(package_name)
+        result_connection.close()
+        process.join()
+        results[package_name] = result
+        print(f"    - {package_name}: {result['status']} ({result['seconds']:.2f}s)")
+        CommonUtils.metrics.Emit('validation', package=package_name, mode='full', status=result['status'], seconds=result['seconds'])
+        if result['status'] != 'valid' and stop_on_failure:
+            stopping = True
+
+    while pending_packages or running_packages:
+        while pending_packages and not stopping and len(running_packages) < jobs:
+            package_name = pending_packages.popleft()
+            receive_connection, send_connection = process_context.Pipe(duplex=False)
+            process = process_context.Process(target=_ValidatePackageWorker, args=(package_folder, package_name, worker_settings, send_connection), daemon=True)
+            process.start()
+            send_connection.close() # the worker owns the sending end now
+            running_packages[package_name] = (process, receive_connection, time.perf_counter())
+
+        if stopping:
+            for package_name, (process, _, start_time) in list(running_packages.items()):
+                process.terminate()
+                FinishPackage(package_name, {'status': 'cancelled', 'seconds': time.perf_counter() - start_time, 'output': ''})
+            for package_name in pending_packages:
+                results[package_name] = {'status': 'skipped', 'seconds': 0.0, 'output': ''}
+            pending_packages.clear()
+            break
+
+        wait_seconds = None
+        if timeout:
+            oldest_start_time = min(start_time for _, _, start_time in running_packages.values())
+            wait_seconds = max(0.0, oldest_start_time + timeout - time.perf_counter())
+        # a worker's connection becomes readable when it sends its result, or when it dies without sending one.
+        multiprocessing.connection.wait([result_connection for _, result_connection, _ in running_packages.values()], wait_seconds)
+
+        for package_name, (process, result_connection, start_time) in list(running_packages.items()):
+            elapsed_seconds = time.perf_counter() - start_time
+            if result_connection.poll():
+                try:
+                    result = result_connection.recv()
+                except EOFError:
+                    process.join()
+                    result = {'status': 'error', 'seconds': elapsed_seconds, 'output': f'Validation process exited with code {process.exitcode}\n'}
+                FinishPackage(package_name, result)
+            elif timeout and elapsed_seconds >= timeout:
+                process.terminate()
+                FinishPackage(package_name, {'status': 'timeout', 'seconds': elapsed_seconds, 'output': f'Validation took more than {timeout} seconds\n'})
+
+    return {package_name: results[package_name] for package_name in package_names}
+
+def PrintValidationSummary(results):
+    ''' Prints the output of every package that did not validate, then a table of all of them '''
+    for package_name, result in results.items():
+        if result['status'] != 'valid' and result['output']:
+            print(f"Output for {package_name}:")
+            print(result['output'], end='')
+
+    name_width = max([len('PACKAGE')] + [len(package_name) for package_name in results.keys()])
+    print(f"| {'PACKAGE':<{name_width}} | STATUS    | TIME (s) |")
+    print(f"|-{'-' * name_width}-|-----------|----------|")
+    for package_name, result in results.items():
+        print(f"| {package_name:<{name_width}} | {result['status']:<9} | {result['seconds']:>8.2f} |")
+
+    status_counts = collections.Counter(result['status'] for result in results.values())
+    print(', '.join(f"{count} {status}" for status, count in sorted(status_counts.items())) or 'No packages found')
+
+def WriteValidationReport(report_path, package_folder, results, total_seconds):
+    ''' Writes the results of ValidatePackages as a JSON report '''
+    report = {
+        'package_folder' : package_folder,
+        'seconds' : total_seconds,
+        'counts' : collections.Counter(result['status'] for result in results.values()),
+        'packages' : [{'name': package_name, 'status': result['status'], 'seconds': result['seconds'],
+                       'output': result['output'] if result['status'] != 'valid' else ''} for package_name, result in results.items()]
+    }
+    with open(report_path, 'w', encoding='utf8') as report_file:
+        json.dump(report, report_file, indent=4)
+    print(f"Wrote validation report to {report_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fully validates every package in the output folder, on several processes at once.')
+    CommonUtils.AddCommonArgs(parser)
+    parser.add_argument('--timeout', type=float, default=default_timeout,
+                        help='Seconds a single package may take to validate before it counts as failed, 0 for no limit.  Can also use PACKAGE_timeout')
+    parser.add_argument('--stop_on_failure', action='store_true', default=default_stop_on_failure,
+                        help='Stop as soon as one package fails to validate.  Can also use PACKAGE_stop_on_failure=1')
+    parser.add_argument('--report', default=None,
+                        help=f'Where to write the JSON report.  Defaults to {default_report_file_name} in the output folder')
+    args = parser.parse_args()
+    CommonUtils.PostArgParse(args)
+
+    start_time = time.perf_counter()
+    results = ValidatePackages(args.output_folder, args.jobs, args.timeout, args.stop_on_failure)
+    total_seconds = time.perf_counter() - start_time
+    PrintValidationSummary(results)
+    WriteValidationReport(args.report or os.path.join(args.output_folder, default_report_file_name), args.output_folder, results, total_seconds)
+    print(f"Validated {len(results)} packages in {total_seconds:.2f}s")
+    sys.exit(0 if all(result['status'] == 'valid' for result in results.values()) else 1)
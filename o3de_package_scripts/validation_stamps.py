@@ -0,0 +1,71 @@
+#
+# Copyright (c) Contributors to the Open 3D Engine Project. For complete copyright and license terms please see the LICENSE at the root of this distribution.
+#
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+#
+#
+
+import os
+import json
+import threading
+
+from hash_cache import HashCache
+
+"""This module implements a local record of package archives that already passed full validation, so that
+validating the exact same archive bytes again only costs hashing the archive.
+
+Each stamp records the sha256 of the archive along with the version of the validation rules and the version
+of the SPDX license list that it passed with.  A stamp only counts while both are still the current ones,
+so changing the archive, the validator or the license list all force a full validation again.
+
+Stamps are appended to a JSON lines file, one line at a time, so that several processes validating
+packages at once can all record into the same file.  Delete the file to forget every stamp.
+"""
+
+class ValidationStamps():
+    ''' The set of (archive sha256, validator version, license list version) that passed full validation.
+    All methods are safe to call from multiple threads.
+    '''
+    stamp_file_name = 'validated_archives.jsonl'
+
+    def __init__(self, stamp_file_path):
+        self.stamp_file_path = stamp_file_path
+        self.stamps = None # loaded lazily on first use
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def GetStampFilePath(output_folder):
+        return os.path.join(output_folder, HashCache.cache_folder_name, ValidationStamps.stamp_file_name)
+
+    def _EnsureLoaded(self):
+        # must be called with the lock held.
+        if self.stamps is not None:
+            return
+        self.stamps = set()
+        if not os.path.exists(self.stamp_file_path):
+            return
+        with open(self.stamp_file_path, encoding='utf8') as stamp_file:
+            for line in stamp_file:
+                try:
+                    stamp = json.loads(line)
+                    self.stamps.add((stamp['sha256'], stamp['validator_version'], stamp['license_list_version']))
+                except (ValueError, KeyError):
+                    pass # a partially written line, that archive just gets validated again.
+
+    def IsValidated(self, archive_hash, validator_version, license_list_version):
+        with self.lock:
+            self._EnsureLoaded()
+            return (archive_hash, validator_version, license_list_version) in self.stamps
+
+    def Record(self, archive_hash, validator_version, license_list_version):
+        ''' Records that the archive with archive_hash passed full validation '''
+        stamp = (archive_hash, validator_version, license_list_version)
+        with self.lock:
+            self._EnsureLoaded()
+            if stamp in self.stamps:
+                return
+            self.stamps.add(stamp)
+            os.makedirs(os.path.dirname(self.stamp_file_path), exist_ok=True)
+            # a single short append, which does not interleave with appends from other processes.
+            with open(self.stamp_file_path, 'a', encoding='utf8') as stamp_file:
+                stamp_file.write(json.dumps({'sha256': archive_hash, 'validator_version': validator_version, 'license_list_version': license_list_version}) + '\n')